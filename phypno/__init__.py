@@ -7,5 +7,5 @@ here = path.abspath(path.dirname(__file__))
 with open(path.join(here, 'VERSION')) as f:
     __version__ = f.read().strip()
 
-from .dataset import Dataset
+from .dataset import Dataset, MultiDataset
 from .datatype import Data, ChanTime, ChanFreq, ChanTimeFreq
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""Convert recordings in any supported format to the phypno format (version 2),
+so that the slow decoding of the original format happens only once.
+"""
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha1
+from json import load
+from logging import getLogger, INFO, StreamHandler, Formatter
+from os import replace
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from .dataset import Dataset, _file_stat
+from .ioeeg import write_phypno
+
+lg = getLogger('phypno')
+
+CHECKSUM_BLOCK = 2 ** 20  # n of bytes read at once to compute the checksum
+
+_datasets = {}  # datasets opened by each worker
+
+
+def convert(filename, output_dir=None, executor=None, n_jobs=1,
+            chunk_duration=60, dtype='int16', compression='zlib',
+            overwrite=False):
+    """Convert one recording to the phypno format (version 2).
+
+    Parameters
+    ----------
+    filename : path to file
+        recording in any format supported by Dataset
+    output_dir : path to dir
+        directory where to write the .phy and .dat files (if None, the same
+        directory as filename)
+    executor : instance of concurrent.futures.Executor
+        executor used to read the chunks of data (if None, the chunks are read
+        in the main process)
+    n_jobs : int
+        number of chunks that are read at the same time by the executor
+    chunk_duration : float
+        duration in s of the data which is read at once
+    dtype : str
+        numpy dtype in which you want to save the data
+    compression : None or 'zlib'
+        compression of the chunks (see write_phypno)
+    overwrite : bool
+        convert the recording even if it was already converted
+
+    Returns
+    -------
+    path to file
+        the .phy file
+    bool
+        if the recording was converted (False if it had already been converted)
+
+    Raises
+    ------
+    ValueError
+        if the converted files would overwrite the recording itself or if the
+        checksum of the converted data is not correct
+
+    Notes
+    -----
+    The data are written to temporary files in output_dir, which are renamed
+    only if the whole conversion was successful, so an interrupted conversion
+    does not change the files of a previous conversion.
+    """
+    filename = Path(filename)
+    phypno_file = _output_file(filename, output_dir)
+    output_dir = phypno_file.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    memmap_file = phypno_file.with_suffix('.dat')
+
+    if any(_is_source(x, filename) for x in (phypno_file, memmap_file)):
+        raise ValueError('Converting ' + str(filename) + ' to ' +
+                         str(phypno_file) + ' would overwrite the recording, '
+                         'use a different output_dir')
+
+    if not overwrite and is_converted(phypno_file, filename):
+        lg.info(str(filename) + ' was already converted')
+        return phypno_file, False
+
+    d = Dataset(filename)
+    if executor is None:
+        data = d
+    else:
+        n_samples = d.header['n_samples']
+        n_smp_chunk = max((int(chunk_duration * d.header['s_freq']), 1))
+        data = _read_chunks(executor, n_jobs, filename, n_samples, n_smp_chunk)
+
+    lg.info('Converting ' + str(filename) + ' to ' + str(phypno_file))
+    tmp_dir = Path(mkdtemp(dir=str(output_dir), prefix='.convert_'))
+    try:
+        tmp_file = tmp_dir / 'converted.phy'
+        write_phypno(data, tmp_file, subj_id=d.header['subj_id'],
+                     dtype=dtype, version=2, compression=compression)
+
+        if not is_converted(tmp_file, filename):
+            raise ValueError('The checksum of ' + str(phypno_file) + ' is '
+                             'not correct')
+
+        # the header last, so that it matches the data only when both are new
+        replace(str(tmp_file.with_suffix('.dat')), str(memmap_file))
+        replace(str(tmp_file), str(phypno_file))
+
+    finally:
+        rmtree(str(tmp_dir), ignore_errors=True)
+
+    return phypno_file, True
+
+
+def is_converted(phypno_file, filename):
+    """Check if a recording was completely converted and was not modified
+    since then.
+
+    Parameters
+    ----------
+    phypno_file : path to file
+        the .phy file
+    filename : path to file
+        the original recording
+
+    Returns
+    -------
+    bool
+        True if the .phy file is complete, it's more recent than the original
+        recording and the checksum of the .dat file is correct.
+
+    Notes
+    -----
+    The .phy file is written after all the data, so an interrupted conversion
+    does not have a .phy file (or it has the .phy file of a previous
+    conversion, whose checksum does not match the .dat file).
+    """
+    phypno_file = Path(phypno_file)
+    memmap_file = phypno_file.with_suffix('.dat')
+    if not phypno_file.exists() or not memmap_file.exists():
+        return False
+
+    if phypno_file.stat().st_mtime_ns < _file_stat(Path(filename))[1]:
+        return False
+
+    try:
+        with phypno_file.open() as f:
+            orig = load(f)
+    except ValueError:
+        return False
+
+    if 'sha1' not in orig:
+        return False
+
+    return _compute_checksum(memmap_file) == orig['sha1']
+
+
+def _output_file(filename, output_dir=None):
+    """Return the .phy file of the conversion of one recording (see
+    convert)."""
+    filename = Path(filename)
+    if output_dir is None:
+        output_dir = filename.parent
+    return Path(output_dir) / (filename.stem + '.phy')
+
+
+def _is_source(output_file, filename):
+    """Check if one of the converted files is one of the files of the
+    recording (f.e. when converting a .phy file of version 1 in the same
+    directory)."""
+    output_file = Path(output_file).resolve()
+    filename = Path(filename).resolve()
+    if output_file == filename:
+        return True
+
+    # the .phy and .dat files of the phypno format
+    return (filename.suffix in ('.phy', '.dat') and
+            output_file.with_suffix('') == filename.with_suffix(''))
+
+
+def _read_chunks(executor, n_jobs, filename, n_samples, n_smp_chunk):
+    """Read consecutive chunks of data with an executor, keeping at most
+    2 * n_jobs chunks in memory.
+
+    Yields
+    ------
+    instance of ChanTime
+        the data, in the right order
+    """
+    futures = deque()
+    for begsam in range(0, n_samples, n_smp_chunk):
+        endsam = min((begsam + n_smp_chunk, n_samples))
+        futures.append(executor.submit(_read_chunk, str(filename), begsam,
+                                       endsam))
+        if len(futures) >= 2 * n_jobs:
+            yield futures.popleft().result()
+
+    while futures:
+        yield futures.popleft().result()
+
+
+def _read_chunk(filename, begsam, endsam):
+    """Read one chunk of data (in the worker, each dataset is opened once)."""
+    if filename not in _datasets:
+        _datasets[filename] = Dataset(filename)
+    return _datasets[filename].read_data(begsam=begsam, endsam=endsam)
+
+
+def _compute_checksum(filename):
+    """Compute the SHA-1 checksum of a file, as hex str."""
+    checksum = sha1()
+    with filename.open('rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def main():
+    parser = ArgumentParser(prog='convert_data',
+                            description='Convert recordings to the phypno '
+                            'format (version 2). Recordings which were '
+                            'already converted are skipped, so you can run '
+                            'it again after an interruption.')
+    parser.add_argument('filename', nargs='+',
+                        help='recordings to convert')
+    parser.add_argument('-o', '--output_dir',
+                        help='directory where to write the converted data '
+                        '(default: same directory as each recording)')
+    parser.add_argument('-j', '--n_jobs', type=int, default=1,
+                        help='number of processes to read the data')
+    parser.add_argument('--dtype', default='int16',
+                        help='dtype of the converted data (default: int16)')
+    parser.add_argument('--no_compression', action='store_true',
+                        help='do not compress the converted data')
+    parser.add_argument('--chunk_duration', type=float, default=60,
+                        help='duration in s of the data which is read at '
+                        'once (default: 60)')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='convert recordings which were already converted')
+    args = parser.parse_args()
+
+    handler = StreamHandler()
+    handler.setFormatter(Formatter(fmt='%(asctime)s (%(levelname)s): '
+                                   '%(message)s', datefmt='%H:%M:%S'))
+    lg.handlers = []
+    lg.addHandler(handler)
+    lg.setLevel(INFO)
+
+    compression = None if args.no_compression else 'zlib'
+
+    executor = None
+    if args.n_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.n_jobs)
+
+    # recordings with the same name would overwrite each other
+    failed = []
+    outputs = {}
+    for filename in args.filename:
+        phypno_file = _output_file(filename, args.output_dir).resolve()
+        memmap_file = phypno_file.with_suffix('.dat')
+        other = [x for x in args.filename if x != filename and
+                 (_is_source(phypno_file, x) or _is_source(memmap_file, x))]
+        if phypno_file in outputs:
+            other.append('the conversion of ' + outputs[phypno_file])
+        if other:
+            lg.error('Could not convert ' + filename + ': it would overwrite '
+                     + ', '.join(other))
+            failed.append(filename)
+        outputs.setdefault(phypno_file, filename)
+
+    try:
+        for filename in args.filename:
+            if filename in failed:
+                continue
+            try:
+                convert(filename, args.output_dir, executor, args.n_jobs,
+                        args.chunk_duration, args.dtype, compression,
+                        args.overwrite)
+            except Exception as err:
+                lg.error('Could not convert ' + filename + ': ' + str(err))
+                failed.append(filename)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if failed:
+        lg.error('Could not convert ' + str(len(failed)) + ' recordings')
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,38 @@
 """Module has information about the datasets, not data.
 
 """
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
+from hashlib import sha1
 from math import ceil
 from logging import getLogger
+from os import replace, scandir
 from pathlib import Path
+from pickle import dump, load, PicklingError, UnpicklingError
+from tempfile import NamedTemporaryFile
+from threading import Lock
 
-from numpy import arange, asarray, empty, int64
+from numpy import (argsort, array_split, asarray, diff, empty, flatnonzero,
+                   int64, NaN, searchsorted, split)
 
+from . import __version__, ioeeg
 from .ioeeg import (Edf, Ktlx, BlackRock, EgiMff, FieldTrip, IEEG_org,
                     Moberg, Phypno, OpBox, Micromed, BCI2000)
 from .ioeeg.bci2000 import _read_header_length
-from .datatype import ChanTime
+from .ioeeg.ktlx import IDX_SUFFIX
+from .datatype import ChanTime, RegularAxis
 from .utils import UnrecognizedFormat
 
 
 lg = getLogger('phypno')
 
+CACHE_BLOCK_SIZE = 4096  # n of samples in each block of the cache
+# directory with the headers of the datasets (None to disable it)
+HEADER_CACHE_DIR = Path.home() / '.cache' / 'phypno' / 'headers'
+HEADER_CACHE_VERSION = 1
+
 
 def _convert_time_to_sample(abs_time, dataset):
     """Convert absolute time into samples.
@@ -52,6 +68,344 @@ def _convert_time_to_sample(abs_time, dataset):
     return sample
 
 
+class BlockCache:
+    """Cache of the data, in blocks of samples, for any format.
+
+    Parameters
+    ----------
+    return_dat : function
+        function to read the data (return_dat of the classes in phypno.ioeeg)
+    max_size : int
+        max number of bytes to keep in the cache
+    block_size : int
+        number of samples in each block
+
+    Attributes
+    ----------
+    hits : int
+        number of blocks (one channel) read from the cache
+    misses : int
+        number of blocks (one channel) read from the file
+    size : int
+        number of bytes in the cache
+
+    Notes
+    -----
+    Each block contains the data of one channel and it's identified by the
+    index of the channel and the index of the block (blocks start at sample
+    0). When the cache is full, the blocks that were not used for the longest
+    time are removed.
+
+    Consecutive blocks which are not in the cache are read with one call to
+    return_dat.
+    """
+    def __init__(self, return_dat, max_size, block_size=CACHE_BLOCK_SIZE):
+        self.return_dat = return_dat
+        self.max_size = max_size
+        self.block_size = block_size
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._blocks = OrderedDict()
+        self._lock = Lock()
+
+    def __getstate__(self):
+        """Send an empty cache to other processes."""
+        return {'return_dat': self.return_dat,
+                'max_size': self.max_size,
+                'block_size': self.block_size,
+                }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def clear(self):
+        """Remove all the blocks from the cache."""
+        with self._lock:
+            self._blocks.clear()
+            self.size = 0
+
+    def __call__(self, chan, begsam, endsam):
+        """Return the data, from the cache or from the file.
+
+        Parameters
+        ----------
+        chan : list of int
+            indices of the channels to read
+        begsam : int
+            index of the first sample
+        endsam : int
+            index of the last sample (this sample will NOT be included)
+
+        Returns
+        -------
+        numpy.ndarray
+            A 2d matrix, with dimension chan X samples
+        """
+        if begsam == endsam:
+            return empty((len(chan), 0))
+
+        bs = self.block_size
+        begblk = begsam // bs
+        endblk = -(-endsam // bs)
+
+        blocks = {}
+        with self._lock:
+            for blk in range(begblk, endblk):
+                for one_chan in chan:
+                    try:
+                        dat = self._blocks[one_chan, blk]
+                    except KeyError:
+                        continue
+                    self._blocks.move_to_end((one_chan, blk))
+                    blocks[one_chan, blk] = dat
+                    self.hits += 1
+
+        # read consecutive blocks with the same missing channels at once
+        missing = [(blk, tuple(x for x in chan if (x, blk) not in blocks))
+                   for blk in range(begblk, endblk)]
+        i = 0
+        while i < len(missing):
+            blk0, to_read = missing[i]
+            blk1 = blk0 + 1
+            while (i + 1 < len(missing) and missing[i + 1][1] == to_read):
+                i += 1
+                blk1 += 1
+            i += 1
+            if not to_read:
+                continue
+
+            dat = self.return_dat(list(to_read), blk0 * bs, blk1 * bs)
+            with self._lock:
+                self.misses += len(to_read) * (blk1 - blk0)
+            for i_chan, one_chan in enumerate(to_read):
+                for blk in range(blk0, blk1):
+                    x = dat[i_chan, (blk - blk0) * bs:(blk - blk0 + 1) * bs]
+                    blocks[one_chan, blk] = x.copy()
+            self._add(blocks, to_read, blk0, blk1)
+
+        dtype = blocks[chan[0], begblk].dtype if chan else float
+        output = empty((len(chan), (endblk - begblk) * bs), dtype=dtype)
+        for i_chan, one_chan in enumerate(chan):
+            for blk in range(begblk, endblk):
+                i0 = (blk - begblk) * bs
+                output[i_chan, i0:i0 + bs] = blocks[one_chan, blk]
+
+        i0 = begsam - begblk * bs
+        return output[:, i0:i0 + endsam - begsam]
+
+    def _add(self, blocks, chan, blk0, blk1):
+        """Add new blocks to the cache and remove the old ones."""
+        with self._lock:
+            for one_chan in chan:
+                for blk in range(blk0, blk1):
+                    key = one_chan, blk
+                    if key in self._blocks:
+                        continue
+                    self._blocks[key] = blocks[key]
+                    self.size += blocks[key].nbytes
+
+            while self.size > self.max_size and self._blocks:
+                self.size -= self._blocks.popitem(last=False)[1].nbytes
+
+
+def _read_trials(return_dat, idx_chan, begsam, endsam):
+    """Read some trials, one after the other.
+
+    Parameters
+    ----------
+    return_dat : function
+        function to read the data (return_dat of the reader or BlockCache)
+    idx_chan : list of int
+        indices of the channels to read
+    begsam : list of int
+        first sample of each trial
+    endsam : list of int
+        last sample of each trial (this sample will NOT be included)
+
+    Returns
+    -------
+    list of numpy.ndarray
+        data of each trial (chan X samples)
+    """
+    output = []
+    for one_begsam, one_endsam in zip(begsam, endsam):
+        lg.debug('begsam {0: 6}, endsam {1: 6}'.format(one_begsam,
+                 one_endsam))
+        output.append(return_dat(idx_chan, one_begsam, one_endsam))
+
+    return output
+
+
+def _group_trials(begsam, n_groups, segments=None):
+    """Split the trials into groups of nearby trials, which do not cross
+    the file segments.
+
+    Parameters
+    ----------
+    begsam : list of int
+        first sample of each trial
+    n_groups : int
+        number of groups, before splitting them at the segments
+    segments : list of int, optional
+        first sample of each file segment (see return_segments of the readers)
+
+    Returns
+    -------
+    list of numpy.ndarray
+        indices of the trials in each group, sorted by time
+    """
+    i_trl = argsort(begsam, kind='mergesort')
+    groups = [x for x in array_split(i_trl, n_groups) if len(x)]
+    if segments is None:
+        return groups
+
+    output = []
+    for one_group in groups:
+        seg = searchsorted(segments, asarray(begsam)[one_group], side='right')
+        output.extend(split(one_group, flatnonzero(diff(seg)) + 1))
+    return output
+
+
+def _file_stat(filename):
+    """Size and modification time of a file or of all the files in a directory.
+
+    Parameters
+    ----------
+    filename : Path
+        file or directory
+
+    Returns
+    -------
+    int
+        size in bytes (for directories, the sum of the files, recursively)
+    int
+        modification time in ns (for directories, the latest of the files)
+
+    Notes
+    -----
+    For a file, the files in the same directory with the same name and a
+    different extension are included, because many formats store the data or
+    the events in a companion file (f.e. the .dat file of a .phy file or the
+    .nev file of a .ns3 file).
+
+    The index files written by phypno (for Ktlx) and their temporary files are
+    ignored. The modification time of the directories is ignored too, because
+    it changes when the index files are written.
+    """
+    is_dir = filename.is_dir()
+    if is_dir:
+        with scandir(str(filename)) as it:
+            entries = list(it)
+    else:
+        filename.stat()  # raise FileNotFoundError if it does not exist
+        with scandir(str(filename.parent)) as it:
+            entries = [x for x in it if Path(x.name).stem == filename.stem]
+
+    size = 0
+    mtime = 0
+    for entry in entries:
+        if entry.is_dir():
+            if not is_dir:
+                continue
+            stat = _file_stat(Path(entry.path))
+        elif entry.is_file() and not entry.name.endswith(IDX_SUFFIX):
+            stat = entry.stat()
+            stat = stat.st_size, stat.st_mtime_ns
+        else:
+            continue
+        size += stat[0]
+        mtime = max(mtime, stat[1])
+
+    return size, mtime
+
+
+def _header_cache_file(filename):
+    """Name of the file in the header cache for one dataset."""
+    path = str(filename.resolve()).encode('utf-8', errors='replace')
+    return HEADER_CACHE_DIR / (sha1(path).hexdigest() + '.pkl')
+
+
+def _read_header_cache(filename):
+    """Read the format and the header from the cache.
+
+    Parameters
+    ----------
+    filename : Path
+        file or directory of the dataset
+
+    Returns
+    -------
+    class or None
+        one of the classes of phypno.ioeeg, None if the dataset is not in the
+        cache, if it has changed or if the cache file cannot be read
+    dict or None
+        header of the dataset (see Dataset)
+    """
+    cache_file = _header_cache_file(filename)
+    if not cache_file.exists():
+        return None, None
+
+    try:
+        with cache_file.open('rb') as f:
+            cached = load(f)
+        key = (str(filename.resolve()), ) + _file_stat(filename)
+        if (cached['version'] != (HEADER_CACHE_VERSION, __version__) or
+                cached['key'] != key):
+            return None, None
+
+        IOClass = getattr(ioeeg, cached['IOClass'], None)
+        header = cached['header']
+
+    # a corrupted cache should never prevent reading the dataset
+    except (OSError, EOFError, UnpicklingError, AttributeError, ImportError,
+            IndexError, KeyError, TypeError, ValueError):
+        lg.debug('Could not read header of ' + str(filename) + ' from cache')
+        return None, None
+
+    if IOClass is None or not isinstance(header, dict):
+        return None, None
+
+    return IOClass, header
+
+
+def _write_header_cache(filename, IOClass, header):
+    """Write the format and the header in the cache.
+
+    Parameters
+    ----------
+    filename : Path
+        file or directory of the dataset
+    IOClass : class
+        one of the classes of phypno.ioeeg
+    header : dict
+        header of the dataset (see Dataset)
+
+    Notes
+    -----
+    It does not store formats which are not in phypno.ioeeg and headers which
+    cannot be pickled.
+    """
+    if getattr(ioeeg, getattr(IOClass, '__name__', ''), None) is not IOClass:
+        return
+
+    cache_file = _header_cache_file(filename)
+    try:
+        cached = {'version': (HEADER_CACHE_VERSION, __version__),
+                  'key': (str(filename.resolve()), ) + _file_stat(filename),
+                  'IOClass': IOClass.__name__,
+                  'header': header,
+                  }
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(dir=str(cache_file.parent), suffix='.pkl',
+                                delete=False) as f:
+            dump(cached, f)
+        replace(f.name, str(cache_file))
+
+    except (OSError, PicklingError, TypeError, AttributeError):
+        lg.debug('Could not write header of ' + str(filename) + ' in cache')
+
+
 def detect_format(filename, server=None):
     """Detect file format.
 
@@ -102,9 +456,7 @@ def detect_format(filename, server=None):
                 if file_header == b'0       ':
                     f.seek(192)
                     edf_type = f.read(5)
-                    if edf_type == b'EDF+C':
-                        return 'EDF+C'
-                    elif edf_type == b'EDF+D':
+                    if edf_type == b'EDF+D':
                         return 'EDF+D'
                     else:
                         return Edf
@@ -135,6 +487,15 @@ class Dataset:
         one of the classes of phypno.ioeeg
     server : str
         remote repository ('ieeg.org')
+    cache_size : int
+        max number of bytes of data to keep in memory, so that the same data
+        is not read again from the file (0 means no cache)
+    header_cache : bool
+        use the header stored in HEADER_CACHE_DIR, if the files of the dataset
+        did not change (and store the header there after reading it). It's
+        useful for formats whose header is slow to read, but the cached
+        headers are stored as pickle files, so only use it if nobody else can
+        write to HEADER_CACHE_DIR (default: False)
 
     Attributes
     ----------
@@ -160,6 +521,8 @@ class Dataset:
           - filename
           - return_hdr
           - return_dat
+    cache : instance of BlockCache or None
+        cache of the data (it also counts hits and misses)
 
     Notes
     -----
@@ -168,26 +531,90 @@ class Dataset:
     while the latter is the file that you really read. There might be
     differences, for example, if the argument points to a file within a
     directory, or if the file is mapped to memory.
+
+    When the header comes from the header cache, the files are only read
+    (with return_hdr) the first time that you use Dataset.dataset, for
+    example to read the data or the markers.
     """
-    def __init__(self, filename, IOClass=None, server=None):
+    def __init__(self, filename, IOClass=None, server=None, cache_size=0,
+                 header_cache=False):
         self.filename = Path(filename)
+        self._dataset = None
+        self._hdr_from_cache = False
+
+        use_header_cache = (header_cache and server is None and
+                            HEADER_CACHE_DIR is not None)
+        hdr = None
+        if use_header_cache:
+            cached_IOClass, hdr = _read_header_cache(self.filename)
+            if IOClass is not None and cached_IOClass is not IOClass:
+                hdr = None
+            if hdr is not None:
+                IOClass = cached_IOClass
+                self._hdr_from_cache = True
 
         if IOClass is not None:
             self.IOClass = IOClass
         else:
             self.IOClass = detect_format(filename, server)
 
-        self.dataset = self.IOClass(self.filename)
-        output = self.dataset.return_hdr()
-        hdr = {}
-        hdr['subj_id'] = output[0]
-        hdr['start_time'] = output[1]
-        hdr['s_freq'] = output[2]
-        hdr['chan_name'] = output[3]
-        hdr['n_samples'] = output[4]
-        hdr['orig'] = output[5]
+        if hdr is None:
+            output = self.dataset.return_hdr()
+            hdr = {}
+            hdr['subj_id'] = output[0]
+            hdr['start_time'] = output[1]
+            hdr['s_freq'] = output[2]
+            hdr['chan_name'] = output[3]
+            hdr['n_samples'] = output[4]
+            hdr['orig'] = output[5]
+
+            if use_header_cache:
+                _write_header_cache(self.filename, self.IOClass, hdr)
+
         self.header = hdr
 
+        self.cache = None
+        if cache_size:
+            self.cache = BlockCache(None, cache_size)
+
+    @property
+    def dataset(self):
+        """Instance of the class to read the data (it reads the header the
+        first time)."""
+        if self._dataset is None:
+            self._dataset = self.IOClass(self.filename)
+            if self._hdr_from_cache:  # the reader needs the header
+                self._dataset.return_hdr()
+        return self._dataset
+
+    @dataset.setter
+    def dataset(self, dataset):
+        self._dataset = dataset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the files kept open by the reader (such as memmaps) and
+        the cache. The files are opened again if you read the data."""
+        if self._dataset is not None and hasattr(self._dataset, 'close'):
+            self._dataset.close()
+        if self.cache is not None:
+            self.cache.clear()
+
+    @property
+    def _return_dat(self):
+        """Function to read the data, from the cache if there is a cache."""
+        if self.cache is not None:
+            if self.cache.return_dat is None:
+                self.cache.return_dat = self.dataset.return_dat
+            return self.cache
+        else:
+            return self.dataset.return_dat
+
     def read_markers(self):
         """Return the markers."""
         return self.dataset.return_markers()
@@ -248,7 +675,7 @@ class Dataset:
         return videos
 
     def read_data(self, chan=None, begtime=None, endtime=None, begsam=None,
-                  endsam=None):
+                  endsam=None, n_jobs=1, executor=None):
         """Read the data and creates a ChanTime instance
 
         Parameters
@@ -271,6 +698,11 @@ class Dataset:
             first sample (this sample will be included)
         endsam : int
             last sample (this sample will NOT be included)
+        n_jobs : int
+            number of threads to read the trials concurrently
+        executor : instance of concurrent.futures.Executor
+            pool of threads or processes to read the trials (if specified,
+            n_jobs is ignored)
 
         Returns
         -------
@@ -287,6 +719,16 @@ class Dataset:
         If neither begtime or begsam are specified, it starts from the first
         sample. If neither endtime or endsam are specified, it reads until the
         end.
+
+        When reading trials concurrently, the trials are sorted by time and
+        split into contiguous groups, so that each thread (or process) reads
+        nearby trials. If the reader has a return_segments method (with the
+        first sample of each file segment, such as the ERD files of Ktlx or
+        the recordings of MultiDataset), the groups are also split where a
+        new segment starts, so that each group reads one segment. The
+        order of the trials in the output does not change. A pool of
+        processes needs to pickle the reader (Dataset.dataset) and it does not
+        share the cache.
         """
         data = ChanTime()
         data.start_time = self.header['start_time']
@@ -332,13 +774,317 @@ class Dataset:
 
         for i, one_begsam, one_endsam in zip(range(n_trl), begsam, endsam):
             data.axis['chan'][i] = asarray(chan, dtype='U')
-            data.axis['time'][i] = (arange(one_begsam, one_endsam) /
-                                   self.header['s_freq'])
+            data.axis['time'][i] = RegularAxis(one_begsam,
+                                               self.header['s_freq'],
+                                               one_endsam - one_begsam)
+
+        if n_trl == 1 or (n_jobs == 1 and executor is None):
+            trials = _read_trials(self._return_dat, idx_chan, begsam, endsam)
+            for i, dat in enumerate(trials):
+                data.data[i] = dat
+            return data
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+            n_groups = n_jobs
+        else:
+            n_groups = getattr(executor, '_max_workers', 1)
+
+        # groups of nearby trials, in the same segment of the files
+        segments = None
+        if hasattr(self.dataset, 'return_segments'):
+            segments = self.dataset.return_segments()
+        groups = _group_trials(begsam, n_groups * 4, segments)
+
+        return_dat = self._return_dat
+        try:
+            futures = [executor.submit(_read_trials, return_dat, idx_chan,
+                                       [begsam[i] for i in one_group],
+                                       [endsam[i] for i in one_group])
+                       for one_group in groups]
+
+            for one_group, future in zip(groups, futures):
+                for i, dat in zip(one_group, future.result()):
+                    data.data[i] = dat
+
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+        return data
+
+    def iter_chunks(self, chan=None, chunk_duration=60, overlap=0,
+                    begtime=None, endtime=None):
+        """Read the data in consecutive chunks, to process long recordings in
+        constant memory.
+
+        Parameters
+        ----------
+        chan : list of strings
+            names of the channels to read
+        chunk_duration : float
+            duration of each chunk (in s)
+        overlap : float
+            duration of the data (in s) added before and after each chunk
+        begtime : int or datedelta or datetime
+            start of the data to read (see read_data)
+        endtime : int or datedelta or datetime
+            end of the data to read (see read_data)
+
+        Yields
+        ------
+        instance of ChanTime
+            data with one trial, containing one chunk and the overlap around
+            it.
+
+        Notes
+        -----
+        The chunks cover the period between begtime and endtime without gaps.
+        The overlap is only added where there are data, so that it does not
+        introduce NaN, which would spread when filtering. To remove the
+        overlap from the results, use the time axis, e.g.:
+
+        >>> for data in d.iter_chunks(chunk_duration=60, overlap=5):
+        >>>     filtered = filter_(data)
+        >>>     t = filtered.axis['time'][0]
+        >>>     filtered(time=(t[0] + 5, t[-1] - 5))
+
+        All the chunks share the same buffer, so the values of one chunk are
+        overwritten by the next chunk. Make a copy if you need to keep them.
+        """
+        if chan is None:
+            chan = self.header['chan_name']
+        if not (isinstance(chan, list) or isinstance(chan, tuple)):
+            raise TypeError('Parameter "chan" should be a list')
+        idx_chan = [self.header['chan_name'].index(x) for x in chan]
+
+        s_freq = self.header['s_freq']
+        n_samples = self.header['n_samples']
+
+        begsam = 0
+        if begtime is not None:
+            begsam = _convert_time_to_sample(begtime, self)
+        endsam = n_samples
+        if endtime is not None:
+            endsam = _convert_time_to_sample(endtime, self)
+
+        chunk_n_smp = int(round(chunk_duration * s_freq))
+        overlap_n_smp = int(round(overlap * s_freq))
+        if chunk_n_smp <= 0 or overlap_n_smp < 0:
+            raise ValueError('chunk_duration should be positive and overlap '
+                             'should not be negative')
+
+        buffer = empty((len(idx_chan), chunk_n_smp + 2 * overlap_n_smp))
+
+        for chunk_begsam in range(begsam, endsam, chunk_n_smp):
+            chunk_endsam = min(chunk_begsam + chunk_n_smp, endsam)
+
+            one_begsam = min(chunk_begsam, max(chunk_begsam - overlap_n_smp,
+                                               0))
+            one_endsam = max(chunk_endsam, min(chunk_endsam + overlap_n_smp,
+                                               n_samples))
 
-            dataset = self.dataset
             lg.debug('begsam {0: 6}, endsam {1: 6}'.format(one_begsam,
                      one_endsam))
-            dat = dataset.return_dat(idx_chan, one_begsam, one_endsam)
-            data.data[i] = dat
+            dat = buffer[:, :one_endsam - one_begsam]
+            dat[:] = self._return_dat(idx_chan, one_begsam, one_endsam)
 
-        return data
+            data = ChanTime()
+            data.start_time = self.header['start_time']
+            data.s_freq = s_freq
+            data.axis['chan'] = empty(1, dtype='O')
+            data.axis['chan'][0] = asarray(chan, dtype='U')
+            data.axis['time'] = empty(1, dtype='O')
+            data.axis['time'][0] = RegularAxis(one_begsam, s_freq,
+                                               one_endsam - one_begsam)
+            data.data = empty(1, dtype='O')
+            data.data[0] = dat
+
+            yield data
+
+
+class MultiDataset(Dataset):
+    """Dataset made of consecutive recordings, as if they were one file.
+
+    Parameters
+    ----------
+    filenames : list of str or Path
+        names of the files (the order does not matter, they are sorted by
+        start time)
+    IOClass : class
+        one of the classes of phypno.ioeeg (if None, it's detected for each
+        file)
+    cache_size : int
+        max number of bytes of data to keep in memory (see Dataset)
+    header_cache : bool
+        use the header cache for each file (see Dataset, default: False)
+
+    Attributes
+    ----------
+    datasets : list of instances of Dataset
+        the recordings, sorted by start time
+    begsam : list of int
+        first sample of each recording, relative to the first recording
+
+    Raises
+    ------
+    ValueError
+        if the recordings have different sampling frequencies
+
+    Notes
+    -----
+    The channels are those of the first recording. The channels which are not
+    in a recording, and the samples between recordings, are NaN. If two
+    recordings overlap, the data of the later one are used.
+
+    The markers of each recording are shifted to the start of the first
+    recording.
+    """
+    def __init__(self, filenames, IOClass=None, cache_size=0,
+                 header_cache=False):
+        datasets = [Dataset(f, IOClass=IOClass, header_cache=header_cache)
+                    for f in filenames]
+        if not datasets:
+            raise ValueError('MultiDataset needs at least one file')
+        self.datasets = sorted(datasets,
+                               key=lambda x: x.header['start_time'])
+
+        first = self.datasets[0].header
+        s_freq = first['s_freq']
+        if any(d.header['s_freq'] != s_freq for d in self.datasets):
+            raise ValueError('All the recordings should have the same '
+                             'sampling frequency')
+
+        self.begsam = [int(round((d.header['start_time'] -
+                                  first['start_time']).total_seconds() *
+                                 s_freq)) for d in self.datasets]
+        endsam = [b + d.header['n_samples'] for b, d in zip(self.begsam,
+                                                            self.datasets)]
+
+        self.filename = self.datasets[0].filename
+        self.IOClass = _Concatenated
+        self._dataset = _Concatenated(self.datasets, self.begsam,
+                                      first['chan_name'])
+        self._hdr_from_cache = False
+
+        self.header = {'subj_id': first['subj_id'],
+                       'start_time': first['start_time'],
+                       's_freq': s_freq,
+                       'chan_name': first['chan_name'],
+                       'n_samples': max(endsam),
+                       'orig': [d.header['orig'] for d in self.datasets],
+                       }
+
+        self.cache = None
+        if cache_size:
+            self.cache = BlockCache(None, cache_size)
+
+
+class _Concatenated:
+    """Reader of MultiDataset, which reads the data from each recording.
+
+    Parameters
+    ----------
+    datasets : list of instances of Dataset
+        the recordings, sorted by start time
+    begsam : list of int
+        first sample of each recording
+    chan_name : list of str
+        channels of the concatenated dataset
+    """
+    def __init__(self, datasets, begsam, chan_name):
+        self.datasets = datasets
+        self.begsam = begsam
+        self.filename = datasets[0].filename
+
+        # last sample of each recording and of all the previous ones, which
+        # increases even if an earlier recording is longer than a later one
+        self.max_endsam = []
+        for d, d_begsam in zip(datasets, begsam):
+            d_endsam = d_begsam + d.header['n_samples']
+            self.max_endsam.append(max(self.max_endsam[-1:] + [d_endsam]))
+
+        # index of each channel in each recording (None if missing)
+        self.idx_chan = []
+        for d in datasets:
+            names = d.header['chan_name']
+            self.idx_chan.append([names.index(x) if x in names else None
+                                  for x in chan_name])
+
+    def return_dat(self, chan, begsam, endsam):
+        """Return the data as 2D numpy.ndarray.
+
+        Parameters
+        ----------
+        chan : list of int
+            index (indices) of the channels to read
+        begsam : int
+            index of the first sample
+        endsam : int
+            index of the last sample
+
+        Returns
+        -------
+        numpy.ndarray
+            A 2d matrix, with dimension chan X samples. The samples which are
+            not in any recording are NaN.
+
+        Notes
+        -----
+        The first recording is found with a binary search on the last sample
+        of each recording (or of a previous recording, if it's longer), so
+        that all the recordings which overlap with begsam are read. If the
+        recordings overlap, the data of the later one are used.
+        """
+        dat = empty((len(chan), endsam - begsam))
+        dat.fill(NaN)
+
+        i = bisect_right(self.max_endsam, begsam)
+        for d, d_begsam, idx_chan in zip(self.datasets[i:], self.begsam[i:],
+                                         self.idx_chan[i:]):
+            if d_begsam >= endsam:
+                break
+
+            d_endsam = d_begsam + d.header['n_samples']
+            sel0 = max((begsam, d_begsam))
+            sel1 = min((endsam, d_endsam))
+            if sel0 >= sel1:
+                continue
+
+            rows = [j for j, c in enumerate(chan) if idx_chan[c] is not None]
+            if not rows:
+                continue
+            dat[rows, sel0 - begsam:sel1 - begsam] = d._return_dat(
+                [idx_chan[chan[j]] for j in rows], sel0 - d_begsam,
+                sel1 - d_begsam)
+
+        return dat
+
+    def return_segments(self):
+        """Return the first sample of each recording."""
+        return self.begsam
+
+    def return_markers(self):
+        """Return the markers of all the recordings, relative to the start of
+        the first recording."""
+        s_freq = self.datasets[0].header['s_freq']
+        markers = []
+        for d, d_begsam in zip(self.datasets, self.begsam):
+            try:
+                d_markers = d.read_markers()
+            except FileNotFoundError:
+                continue
+            offset = d_begsam / s_freq
+            for m in d_markers:
+                m = dict(m)
+                m['start'] += offset
+                m['end'] += offset
+                markers.append(m)
+
+        return markers
+
+    def close(self):
+        """Close all the recordings."""
+        for d in self.datasets:
+            d.close()
@@ -8,7 +8,9 @@ from collections import OrderedDict, Iterable
 from copy import deepcopy
 from logging import getLogger
 
-from numpy import arange, array, empty, ix_, NaN, squeeze, where
+from numpy import (arange, argsort, array, array_equal, asarray, ceil, diff,
+                   dtype, empty, flatnonzero, float64, integer, isnan, ix_,
+                   NaN, ndarray, result_type, searchsorted, squeeze, where)
 
 lg = getLogger()
 
@@ -43,6 +45,8 @@ class Data:
             - surf
             - chan
             - scores
+    stacked : ndarray or None
+        all the trials in one ndarray (trial X ...), see stack_trials
 
     Notes
     -----
@@ -90,6 +94,26 @@ class Data:
                      'scores': None,
                      }
 
+        self._index = {}  # lookup of the axis values, see _lookup
+        self._stacked = None  # all the trials in one ndarray, see stacked
+        self._stacked_trials = None  # views of _stacked, one for each trial
+
+    def __getstate__(self):
+        """Do not pickle the lookup of the axis values and, if the trials are
+        stacked, pickle the trials only once."""
+        state = self.__dict__.copy()
+        state.pop('_index', None)
+        if self.stacked is not None:
+            state['data'] = None
+            state['_stacked_trials'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index = {}
+        if self.data is None:
+            self._set_stacked(self._stacked)
+
     def __call__(self, trial=None, tolerance=None, **axes):
         """Return the recordings and their time stamps.
 
@@ -153,28 +177,39 @@ class Data:
                         selected_values = array([selected_values])
                         squeeze_axis.append(self.index_of(axis))
 
-                    idx = _get_indices(values[i],
+                    idx = _get_indices(self._lookup(axis, i),
                                        selected_values,
                                        tolerance=tolerance)
                     if len(idx[0]) == 0:
                         lg.warning('No index was selected for ' + axis)
 
+                    if len(idx[1]) == n_values:  # all the values were found
+                        idx = _as_slice(idx[0]), slice(None)
+
                     idx_data.append(idx[0])
                     idx_output.append(idx[1])
                 else:
                     n_values = len(values[i])
-                    idx_data.append(arange(n_values))
-                    idx_output.append(arange(n_values))
+                    idx_data.append(slice(None))
+                    idx_output.append(slice(None))
 
                 output_shape.append(n_values)
 
-            output[cnt] = empty(output_shape, dtype=self.data[i].dtype)
-            output[cnt].fill(NaN)
+            if all(isinstance(x, slice) for x in idx_output):
+                output[cnt] = _take(self.data[i], idx_data)
+                if all(isinstance(x, slice) for x in idx_data):
+                    output[cnt] = output[cnt].copy()  # not a view of the data
+
+            else:
+                output[cnt] = empty(output_shape, dtype=self.data[i].dtype)
+                output[cnt].fill(NaN)
 
-            if all([len(x) > 0 for x in idx_data]):
-                ix_output = ix_(*idx_output)
-                ix_data = ix_(*idx_data)
-                output[cnt][ix_output] = self.data[i][ix_data]
+                if all([len(x) > 0 for x in idx_output
+                        if not isinstance(x, slice)]):
+                    ix_output = ix_(*[arange(n) if isinstance(x, slice) else x
+                                      for x, n in zip(idx_output,
+                                                      output_shape)])
+                    output[cnt][ix_output] = _take(self.data[i], idx_data)
 
             if len(squeeze_axis) > 0:
                 output[cnt] = squeeze(output[cnt],
@@ -185,6 +220,136 @@ class Data:
 
         return output
 
+    def _lookup(self, axis, trial):
+        """Return the lookup of the values of one axis in one trial.
+
+        Parameters
+        ----------
+        axis : str
+            Name of the axis (such as 'chan', 'time', etc)
+        trial : int
+            index of the trial
+
+        Returns
+        -------
+        instance of _AxisIndex
+            lookup of the values of the axis
+
+        Notes
+        -----
+        The lookup is created the first time that it's needed and it's created
+        again only if the values of the axis are reassigned (either the whole
+        axis or the values of that trial). If you modify the values in place,
+        the lookup is not updated.
+        """
+        values = self.axis[axis][trial]
+        try:
+            cached_values, index = self._index[axis, trial]
+        except KeyError:
+            cached_values = None
+
+        if cached_values is not values:
+            # trials often share the same axis (f.e. after stack_trials)
+            previous = self._index.get((axis, trial - 1), (None, None))
+            if previous[0] is values:
+                index = previous[1]
+            else:
+                index = _AxisIndex(values)
+            self._index[axis, trial] = values, index
+
+        return index
+
+    @property
+    def stacked(self):
+        """Return all the trials in one ndarray (trial X ...) or None.
+
+        Returns
+        -------
+        ndarray or None
+            the trials in one ndarray, where each trial in data is a view of
+            it. None if the trials are not stacked or if some trials were
+            reassigned after stacking them.
+        """
+        if (self._stacked is None or
+                len(self.data) != len(self._stacked_trials)):
+            return None
+
+        if all(x is y for x, y in zip(self.data, self._stacked_trials)):
+            return self._stacked
+
+        return None
+
+    def stack_trials(self):
+        """Store all the trials in one ndarray, so that the functions in trans
+        operate on all the trials at once.
+
+        Raises
+        ------
+        ValueError
+            If the trials do not have the same shape.
+
+        Notes
+        -----
+        Each trial in data becomes a view of the stacked ndarray, so you can
+        keep on using data as usual. The axes which have the same values in
+        all the trials are shared between the trials.
+
+        This is useful when you have many short trials (such as epochs around
+        events), because each function in trans has to loop over the trials
+        otherwise.
+        """
+        if self.stacked is not None or self.number_of('trial') == 0:
+            return
+
+        if len({x.shape for x in self.data}) > 1:
+            raise ValueError('All the trials should have the same shape')
+
+        stacked = empty((len(self.data), ) + self.data[0].shape,
+                        dtype=result_type(*self.data))
+        for i, one_trial in enumerate(self.data):
+            stacked[i] = one_trial
+        self._set_stacked(stacked)
+
+        for values in self.axis.values():
+            for i in range(1, len(values)):
+                if array_equal(values[i], values[0]):
+                    values[i] = values[0]
+
+    def _set_stacked(self, stacked):
+        """Store the trials as views of one ndarray (trial X ...).
+
+        Parameters
+        ----------
+        stacked : ndarray
+            all the trials, where the first dimension is trial
+        """
+        self._stacked = stacked
+        self.data = empty(len(stacked), dtype='O')
+        for i in range(len(stacked)):
+            self.data[i] = stacked[i]
+        self._stacked_trials = tuple(self.data)
+
+    def _shared_axis(self, axis, trial=None):
+        """Check if all the trials have the same values for one axis.
+
+        Parameters
+        ----------
+        axis : str
+            Name of the axis (such as 'chan', 'time', etc)
+        trial : list of int, optional
+            trials to check (default: all the trials)
+
+        Returns
+        -------
+        bool
+            True if the values of the axis are the same object in all the
+            trials (as after stack_trials).
+        """
+        values = self.axis[axis]
+        if trial is None:
+            trial = range(len(values))
+        return all(values[i] is values[trial[0]] for i in trial)
+
     @property
     def list_of_axes(self):
         """Return the name of all the axes in the data."""
@@ -305,9 +470,9 @@ class Data:
         Parameters
         ----------
         axis : bool, optional
-            deep copy the axes (default: True)
+            copy the axes, sharing the values (default: True)
         attr : bool, optional
-            deep copy the attributes (default: True)
+            copy the attributes, sharing the values (default: True)
         data : bool, optional
             deep copy the data (default: False)
 
@@ -321,8 +486,18 @@ class Data:
         It's important that we copy all the relevant information here. If you
         add new attributes, you should add them here.
 
-        Remember that it deep-copies all the information, so if you copy data
-        the size might become really large.
+        The values of the axes and of the attributes are shared between the
+        copy and the original data (copy-on-write), so that only the data
+        which changes is copied. You can assign new values to each trial of
+        an axis (f.e. output.axis['time'][0] = new_time) or to each attribute
+        (f.e. output.attr['chan'] = new_chan) of the copy. The axes of the
+        copy are read-only views of the axes of the original data, so you
+        cannot modify them in place (the original data does not change). The
+        objects in attr (f.e. the Channels in attr['chan']) are the same
+        objects as in the original data, so if you modify them in place, both
+        change. Use deepcopy if you need an independent copy of everything.
+
+        If you copy data, the size might become really large.
         """
         cdata = type(self)()  # create instance of the same class
 
@@ -330,12 +505,25 @@ class Data:
         cdata.start_time = self.start_time
 
         if axis:
-            cdata.axis = deepcopy(self.axis)
+            cdata.axis = OrderedDict()
+            for one_axis, values in self.axis.items():
+                cdata.axis[one_axis] = _share_axis(values)
+
+            # the views have the same values, so they have the same lookup
+            for (one_axis, trial), (values, index) in self._index.items():
+                if (one_axis in self.axis and
+                        trial < len(self.axis[one_axis]) and
+                        self.axis[one_axis][trial] is values):
+                    cdata._index[one_axis, trial] = (
+                        cdata.axis[one_axis][trial], index)
 
         if attr:
-            cdata.attr = deepcopy(self.attr)
+            cdata.attr = self.attr.copy()
+
+        if data and self.stacked is not None:
+            cdata._set_stacked(self.stacked.copy())
 
-        if data:
+        elif data:
             cdata.data = deepcopy(self.data)
 
         else:
@@ -358,6 +546,9 @@ class Data:
         -----
         EDF takes an optional argument "physical_max", see write_edf.
 
+        FieldTrip takes an optional argument "version" ('7.3' for large data),
+        see write_fieldtrip.
+
         Phypno takes an optional argument "subj_id", see write_phypno.
         Phypno format creates two files, one .phy with the dataset info as json
         file and one .dat with the memmap recordings.
@@ -369,7 +560,7 @@ class Data:
 
         elif export_format == 'fieldtrip':
             from .ioeeg import write_fieldtrip  # avoid circular import
-            write_fieldtrip(self, filename)
+            write_fieldtrip(self, filename, **options)
 
         elif export_format == 'mnefiff':
 
@@ -439,13 +630,304 @@ class ChanTimeFreq(Data):
         self.axis['freq'] = array([], dtype='O')
 
 
-def _get_indices(values, selected, tolerance):
-    """Get indices based on user-selected values.
+class RegularAxis:
+    """Regularly sampled axis (such as time), which stores only the first
+    sample, the sampling frequency and the number of values.
+
+    Parameters
+    ----------
+    begsam : int or float
+        first sample (the first value is begsam / s_freq)
+    s_freq : int or float
+        sampling frequency
+    n_samples : int
+        number of values
+    step : int
+        number of samples between two consecutive values
+
+    Attributes
+    ----------
+    start : float
+        the first value (in s, for time)
+
+    Notes
+    -----
+    It behaves like the 1d ndarray:
+
+    >>> arange(begsam, begsam + n_samples * step, step) / s_freq
+
+    but the values are only computed when necessary (f.e. by numpy functions)
+    and they are not stored. Indexing with int, slices or arrays of int, len
+    and searchsorted are computed directly, so that you can select the data
+    without creating the array. Slices return a RegularAxis as well. min and
+    max are computed directly, while copy, astype and tolist behave like the
+    methods of ndarray. The values cannot be modified in place, so there is no
+    flags attribute.
+    """
+    dtype = dtype('float64')
+    ndim = 1
+
+    def __init__(self, begsam, s_freq, n_samples, step=1):
+        self.begsam = begsam
+        self.s_freq = s_freq
+        self.n_samples = int(n_samples)
+        self.step = step
+
+    @property
+    def start(self):
+        return self.begsam / self.s_freq
+
+    @property
+    def shape(self):
+        return (self.n_samples, )
+
+    @property
+    def size(self):
+        return self.n_samples
+
+    def __len__(self):
+        return self.n_samples
+
+    def __repr__(self):
+        return ('RegularAxis(begsam={}, s_freq={}, n_samples={}, step={})'
+                ''.format(self.begsam, self.s_freq, self.n_samples,
+                          self.step))
+
+    def __array__(self, dtype=None, copy=None):
+        values = ((self.begsam + arange(self.n_samples) * self.step) /
+                  self.s_freq)
+        if dtype is not None:
+            values = values.astype(dtype)
+        return values
+
+    def __iter__(self):
+        return iter(self.__array__())
+
+    def copy(self):
+        """Return a new RegularAxis with the same values (it does not change
+        in place, so the values are not copied)."""
+        return RegularAxis(self.begsam, self.s_freq, self.n_samples,
+                           self.step)
+
+    def astype(self, dtype, **kwargs):
+        """Return the values as ndarray, like ndarray.astype."""
+        return self.__array__().astype(dtype, **kwargs)
+
+    def tolist(self):
+        """Return the values as list, like ndarray.tolist."""
+        return self.__array__().tolist()
+
+    def min(self, axis=None, out=None, **kwargs):
+        """Return the smallest value, like ndarray.min (it's computed
+        directly only without additional arguments)."""
+        if axis not in (None, 0, -1) or out is not None or kwargs or not self:
+            return self.__array__().min(axis=axis, out=out, **kwargs)
+        return min((self[0], self[-1]))
+
+    def max(self, axis=None, out=None, **kwargs):
+        """Return the largest value, like ndarray.max (it's computed directly
+        only without additional arguments)."""
+        if axis not in (None, 0, -1) or out is not None or kwargs or not self:
+            return self.__array__().max(axis=axis, out=out, **kwargs)
+        return max((self[0], self[-1]))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            beg, end, step = idx.indices(self.n_samples)
+            if step < 0:
+                return self.__array__()[idx]
+            return RegularAxis(self.begsam + beg * self.step, self.s_freq,
+                               len(range(beg, end, step)), self.step * step)
+
+        if isinstance(idx, (int, integer)):
+            if idx < 0:
+                idx += self.n_samples
+            if not 0 <= idx < self.n_samples:
+                raise IndexError('index out of range for axis with ' +
+                                 str(self.n_samples) + ' values')
+            return float64(self.begsam + idx * self.step) / self.s_freq
+
+        idx = asarray(idx)
+        if idx.dtype.kind not in 'iu':  # f.e. boolean indexing
+            return self.__array__()[idx]
+
+        idx = where(idx < 0, idx + self.n_samples, idx)
+        if ((idx < 0) | (idx >= self.n_samples)).any():
+            raise IndexError('index out of range for axis with ' +
+                             str(self.n_samples) + ' values')
+        return (self.begsam + idx * self.step) / self.s_freq
+
+    def searchsorted(self, v, side='left', sorter=None):
+        """Find the indices where the values should be inserted to keep the
+        order, like ndarray.searchsorted, but without creating the array.
+
+        Parameters
+        ----------
+        v : float or array_like
+            values to insert
+        side : 'left' or 'right'
+            if 'left', the index of the first value which is >= v, if 'right'
+            the index of the first value which is > v
+
+        Returns
+        -------
+        int or ndarray (dtype='int')
+            indices, with the same shape as v
+        """
+        v = asarray(v, dtype='float64')
+        idx = ceil((v * self.s_freq - self.begsam) / self.step)
+        idx = where(isnan(idx), self.n_samples, idx)
+        idx = idx.clip(0, self.n_samples).astype(int)
+
+        # correct floating-point errors, comparing with the actual values
+        before = (self.begsam + (idx - 1) * self.step) / self.s_freq
+        after = (self.begsam + idx * self.step) / self.s_freq
+        if side == 'left':
+            idx -= (idx > 0) & (before >= v)
+            idx += (idx < self.n_samples) & (after < v)
+        else:
+            idx -= (idx > 0) & (before > v)
+            idx += (idx < self.n_samples) & (after <= v)
+
+        if idx.ndim == 0:
+            return int(idx)
+        return idx
+
+    def _match(self, selected, tolerance):
+        """Find the indices of the values of another RegularAxis, see
+        _get_indices.
+
+        Returns
+        -------
+        tuple of range or None
+            indices of the data and of the output, or None if the values of
+            the two axes are not aligned
+        """
+        offset = selected.begsam - self.begsam
+        if (selected.s_freq != self.s_freq or selected.step != self.step or
+                offset % self.step != 0 or
+                float(self.begsam) != int(self.begsam) or
+                (tolerance is not None and
+                 tolerance * self.s_freq >= self.step / 2)):
+            return None
+
+        offset = int(offset // self.step)
+        beg = min((max((offset, 0)), self.n_samples))
+        end = max((min((offset + selected.n_samples, self.n_samples)), beg))
+        return range(beg, end), range(beg - offset, end - offset)
+
+    def _values(self, other):
+        if isinstance(other, RegularAxis):
+            other = other.__array__()
+        return self.__array__(), other
+
+    def __eq__(self, other):
+        values, other = self._values(other)
+        return values == other
+
+    def __ne__(self, other):
+        values, other = self._values(other)
+        return values != other
+
+    def __lt__(self, other):
+        values, other = self._values(other)
+        return values < other
+
+    def __le__(self, other):
+        values, other = self._values(other)
+        return values <= other
+
+    def __gt__(self, other):
+        values, other = self._values(other)
+        return values > other
+
+    def __ge__(self, other):
+        values, other = self._values(other)
+        return values >= other
+
+    def __add__(self, other):
+        values, other = self._values(other)
+        return values + other
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        values, other = self._values(other)
+        return values - other
+
+    def __rsub__(self, other):
+        values, other = self._values(other)
+        return other - values
+
+    def __mul__(self, other):
+        values, other = self._values(other)
+        return values * other
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        values, other = self._values(other)
+        return values / other
+
+    def __rtruediv__(self, other):
+        values, other = self._values(other)
+        return other / values
+
+    def __neg__(self):
+        return -self.__array__()
+
+    def __abs__(self):
+        return abs(self.__array__())
+
+    __hash__ = None
+
+
+class _AxisIndex:
+    """Lookup of the values of one axis, to find the values selected by the
+    user quickly.
 
     Parameters
     ----------
     values : ndarray (any dtype)
         values present in the axis.
+
+    Attributes
+    ----------
+    labels : dict or None
+        for non-numeric axes (such as 'chan'), the index of each value
+    sorted_values : ndarray or None
+        for numeric axes, the values in ascending order
+    sorter : ndarray (dtype='int') or None
+        indices which sort the values (None if they are already sorted)
+    """
+    def __init__(self, values):
+        self.labels = None
+        self.sorted_values = None
+        self.sorter = None
+
+        if isinstance(values, RegularAxis):
+            self.sorted_values = values
+
+        elif values.dtype.kind in 'iuf':
+            if (diff(values) >= 0).all():
+                self.sorted_values = values
+            else:  # stable, so the first of equal values comes first
+                self.sorter = argsort(values, kind='mergesort')
+                self.sorted_values = values[self.sorter]
+
+        else:
+            self.labels = {}
+            for i, one_value in enumerate(values):
+                self.labels.setdefault(one_value, i)
+
+
+def _get_indices(index, selected, tolerance):
+    """Get indices based on user-selected values.
+
+    Parameters
+    ----------
+    index : instance of _AxisIndex
+        lookup of the values present in the axis.
     selected : ndarray (any dtype) or tuple or list
         values selected by the user
     tolerance : float
@@ -453,34 +935,127 @@ def _get_indices(values, selected, tolerance):
 
     Returns
     -------
-    idx_data : list of int
+    idx_data : ndarray (dtype='int')
         indices of row/column to select the data
-    idx_output : list of int
+    idx_output : ndarray (dtype='int')
         indices of row/column to copy into output
 
     Notes
     -----
-    This function is probably not very fast, but it's pretty robust. It keeps
-    the order, which is extremely important.
+    It keeps the order, which is extremely important. If a value is present
+    more than once, it returns the first one.
 
     If you use values in the self.axis, you don't need to specify tolerance.
     However, if you specify arbitrary points, floating point errors might
-    affect the actual values. Of course, using tolerance is much slower.
+    affect the actual values. Tolerance is ignored for non-numeric axes.
 
     Maybe tolerance should be part of Select instead of here.
 
     """
-    idx_data = []
-    idx_output = []
-    for idx_of_selected, one_selected in enumerate(selected):
+    if index.labels is not None:
+        idx_data = []
+        idx_output = []
+        for idx_of_selected, one_selected in enumerate(selected):
+            idx_of_data = index.labels.get(one_selected)
+            if idx_of_data is not None:
+                idx_data.append(idx_of_data)
+                idx_output.append(idx_of_selected)
+
+        return asarray(idx_data, dtype=int), asarray(idx_output, dtype=int)
+
+    values = index.sorted_values
+    if isinstance(values, RegularAxis) and isinstance(selected, RegularAxis):
+        idx = values._match(selected, tolerance)
+        if idx is not None:
+            return idx
+
+    selected = asarray(selected)
+    if (len(values) == 0 or len(selected) == 0 or
+            selected.dtype.kind not in 'biuf'):
+        return empty(0, dtype=int), empty(0, dtype=int)
+
+    if tolerance is None:
+        begidx = searchsorted(values, selected, side='left')
+        begidx = begidx.clip(max=len(values) - 1)
+        found = values[begidx] == selected
+    else:
+        begidx = searchsorted(values, selected - tolerance, side='left')
+        endidx = searchsorted(values, selected + tolerance, side='right')
+        begidx = begidx.clip(max=len(values) - 1)
+        found = ((begidx < endidx) &
+                 (abs(values[begidx] - selected) <= tolerance))
+
+    if index.sorter is None:
+        idx_data = begidx[found]
+    elif tolerance is None:
+        idx_data = index.sorter[begidx[found]]
+    else:  # the first value (in the original order) within tolerance
+        idx_data = asarray([index.sorter[b:e].min() for b, e
+                            in zip(begidx[found], endidx[found])], dtype=int)
+
+    return idx_data, flatnonzero(found)
+
+
+def _share_axis(values):
+    """Copy the container of one axis, with read-only views of the values of
+    each trial.
+
+    Parameters
+    ----------
+    values : ndarray (dtype='O')
+        for each trial, the values of the axis
+
+    Returns
+    -------
+    ndarray (dtype='O')
+        new container, with views of the values for each trial (trials with
+        the same values have the same view)
+
+    Notes
+    -----
+    The values in the input do not change and they remain writable.
+    """
+    output = values.copy()
+    views = {}
+    for i, one_trial in enumerate(values):
+        if isinstance(one_trial, ndarray):
+            if id(one_trial) not in views:
+                one_view = one_trial.view()
+                one_view.flags.writeable = False
+                views[id(one_trial)] = one_view
+            output[i] = views[id(one_trial)]
+    return output
 
-        if tolerance is None or values.dtype.kind == 'U':
-            idx_of_data = where(values == one_selected)[0]
-        else:
-            idx_of_data = where(abs(values - one_selected) <= tolerance)[0] # actual use min
 
-        if len(idx_of_data) > 0:
-            idx_data.append(idx_of_data[0])
-            idx_output.append(idx_of_selected)
+def _as_slice(idx):
+    """Convert consecutive indices into a slice (which does not copy data)."""
+    if isinstance(idx, range):
+        if len(idx) > 0 and idx.step == 1:
+            return slice(idx.start, idx.stop)
+        return asarray(idx, dtype=int)
 
-    return idx_data, idx_output
+    if len(idx) > 0 and (diff(idx) == 1).all():
+        return slice(idx[0], idx[-1] + 1)
+    return idx
+
+
+def _take(dat, idx):
+    """Select slices or indices along each dimension (like ix_).
+
+    Parameters
+    ----------
+    dat : ndarray
+        data of one trial
+    idx : list of slice or ndarray (dtype='int')
+        for each dimension, the slice or the indices to select
+
+    Returns
+    -------
+    ndarray
+        the selected data (a view, if all the elements of idx are slices)
+    """
+    dat = dat[tuple(x if isinstance(x, slice) else slice(None) for x in idx)]
+    for i, x in enumerate(idx):
+        if not isinstance(x, slice):
+            dat = dat.take(x, axis=i)
+    return dat
@@ -107,10 +107,14 @@ class DetectSpindle:
         spindle.det_value = zeros(data.number_of('chan')[0])
         spindle.sel_value = zeros(data.number_of('chan')[0])
 
+        if data.number_of('trial') == 1:  # it can be a RegularAxis
+            time = data.axis['time'][0]
+        else:
+            time = hstack(data.axis['time'])
+
         all_spindles = []
         for i, chan in enumerate(data.axis['chan'][0]):
             lg.info('Detecting spindles on chan %s', chan)
-            time = hstack(data.axis['time'])
             dat_orig = hstack(data(chan=chan))
 
             if self.method == 'Ferrarelli2007':
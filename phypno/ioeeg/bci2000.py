@@ -3,21 +3,19 @@ from re import search, finditer, match
 from datetime import datetime
 
 from numpy import (fromfile,
-                   fromstring,
-                   asmatrix,
                    array,
-                   arange,
                    c_,
                    diff,
                    empty,
                    hstack,
+                   memmap,
                    ndarray,
                    NaN,
-                   vstack,
                    where,
+                   zeros,
                    dtype,
-                   float64,
                    int32,
+                   int64,
                    uint8,
                    )
 
@@ -145,9 +143,19 @@ class BCI2000:
 
         return dat[chan, :] * self.gain[chan][:, None]  # apply gain
 
-    def return_markers(self, state='MicromedCode'):
+    def return_markers(self, state='MicromedCode', begtime=None,
+                       endtime=None):
         """Return all the markers (also called triggers or events).
 
+        Parameters
+        ----------
+        state : str
+            name of the state to convert into markers
+        begtime : float
+            start of the time range (in s from the start of the recordings)
+        endtime : float
+            end of the time range (in s from the start of the recordings)
+
         Returns
         -------
         list of dict
@@ -160,10 +168,25 @@ class BCI2000:
         FileNotFoundError
             when it cannot read the events for some reason (don't use other
             exceptions).
+
+        Notes
+        -----
+        Each marker is a period during which the state has the same value. If
+        you specify a time range, only that part of the file is read and the
+        markers are cut at the boundaries of the time range.
         """
+        begsam = 0
+        if begtime is not None:
+            begsam = min((max((int(begtime * self.s_freq), 0)),
+                          self.n_samples))
+        endsam = self.n_samples
+        if endtime is not None:
+            endsam = min((max((int(endtime * self.s_freq), begsam)),
+                          self.n_samples))
+
         markers = []
         try:
-            all_states = self._read_states()
+            all_states = self._read_states(begsam, endsam)
         except ValueError:  # cryptic error when reading states
             return markers
 
@@ -172,34 +195,64 @@ class BCI2000:
         except KeyError:
             return markers
 
-        markers = []
+        if len(x) == 0:
+            return markers
+
         i_mrk = hstack((0, where(diff(x))[0] + 1, len(x)))
         for i0, i1 in zip(i_mrk[:-1], i_mrk[1:]):
             marker = {'name': str(x[i0]),
-                      'start': (i0) / self.s_freq,
-                      'end': i1 / self.s_freq,
+                      'start': (begsam + i0) / self.s_freq,
+                      'end': (begsam + i1) / self.s_freq,
+                      'chan': None,
                      }
             markers.append(marker)
 
         return markers
 
-    def _read_states(self):
+    def _read_states(self, begsam=0, endsam=None):
+        """Read the state vectors and decode the states.
 
-        all_states = []
-        with self.filename.open('rb') as f:
-            f.seek(self.header_len, SEEK_SET)  # skip header
-            StatevectorOffset = self.dtype.itemsize - self.statevector_len
+        Parameters
+        ----------
+        begsam : int
+            index of the first sample
+        endsam : int
+            index of the last sample (this sample is NOT included)
 
-            for i in range(self.n_samples):
-                f.seek(StatevectorOffset, SEEK_CUR)
-                raw_statevector = f.read(self.statevector_len)
-                all_states.append(fromstring(raw_statevector, dtype='<u1'))
+        Returns
+        -------
+        dict
+            where the key is the name of the state and the value is a vector
+            with the value of the state for each sample
 
-        all_states = vstack(all_states).T
+        Notes
+        -----
+        The state vectors are read from a strided view on the memory-mapped
+        file, using the dtype of each sample (channels and statevector), so
+        only the bytes of the state vectors are read.
+        """
+        if endsam is None:
+            endsam = self.n_samples
+        n_smp = max((endsam - begsam, 0))
+
+        if n_smp:
+            mm = memmap(str(self.filename), dtype=uint8, mode='r')
+            offset = (self.header_len + self.dtype.itemsize * begsam +
+                      self.dtype.fields['statevector'][1])
+            all_states = ndarray((n_smp, self.statevector_len), dtype=uint8,
+                                 buffer=mm, offset=offset,
+                                 strides=(self.dtype.itemsize, 1))
+        else:
+            all_states = empty((0, self.statevector_len), dtype=uint8)
 
         states = {}
         for statename, statedef in self.statevectors.items():
-            states[statename] = array(statedef['mult'] * asmatrix(all_states[statedef['slice'], :] & statedef['mask']), dtype=int32).squeeze()
+            startbyte = statedef['slice'].start
+            value = zeros(n_smp, dtype=int64)
+            for i, mask in enumerate(statedef['mask']):
+                value |= ((all_states[:, startbyte + i] & mask).astype(int64)
+                          << (8 * i))
+            states[statename] = (value >> statedef['startbit']).astype(int32)
 
         return states
 
@@ -286,13 +339,11 @@ def _prepare_statevectors(sv):
         extrabits = int(nbytes * 8) - nbits - startbit;
         startmask = 255 & (255 << startbit)
         endmask   = 255 & (255 >> extrabits)
-        div       = (1 << startbit);
         v['slice'] = slice(startbyte, startbyte + nbytes)
         v['mask'] = array([255] * nbytes, dtype=uint8)
         v['mask'][0]  &= startmask
         v['mask'][-1] &= endmask
-        v['mask'].shape = (nbytes, 1)
-        v['mult'] = asmatrix(256.0 ** arange(nbytes, dtype=float64) / float(div))
+        v['startbit'] = startbit
         statedefs[v['Name']] = v
 
     return statedefs
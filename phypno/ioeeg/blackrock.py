@@ -4,8 +4,7 @@ from os import SEEK_SET, SEEK_CUR, SEEK_END
 from os.path import splitext
 from struct import unpack
 
-from numpy import (asarray, empty, expand_dims, fromfile, iinfo, NaN, ones,
-                   reshape, where)
+from numpy import asarray, empty, iinfo, memmap, NaN, ones, where
 
 lg = getLogger(__name__)
 
@@ -21,16 +20,25 @@ class BlackRock:
     ----------
     filename : path to file
         the name of the filename or directory
+    dtype : str
+        numpy dtype of the data returned by return_dat ('float32' uses half
+        the memory of 'float64')
 
+    Notes
+    -----
+    To pass dtype when reading the data with Dataset, use
+    functools.partial(BlackRock, dtype='float32') as IOClass.
     """
-    def __init__(self, filename):
+    def __init__(self, filename, dtype='float64'):
         self.filename = filename
+        self.dtype = dtype
         self.markers = []
 
         self.BOData = None
         self.sess_begin = None
         self.sess_end = None
         self.factor = None
+        self._memmap = None
 
     def return_hdr(self):
         """Return the header for further use.
@@ -106,6 +114,11 @@ class BlackRock:
             self.n_samples = n_samples
             self.factor = 0.25 * ones(len(orig['ChannelID']))
 
+            # INFO to read the data (only one session)
+            self.BOData = [orig['BOData']]
+            self.sess_begin = asarray([0])
+            self.sess_end = asarray([n_samples])
+
             # make up names
             chan_name = ['chan{0:04d}'.format(x) for x in orig['ChannelID']]
 
@@ -114,6 +127,10 @@ class BlackRock:
 
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
+    def return_segments(self):
+        """Return the first sample of each session (see Dataset.read_data)."""
+        return self.sess_begin
+
     def return_dat(self, chan, begsam, endsam):
         """Return the data as 2D numpy.ndarray.
 
@@ -136,10 +153,13 @@ class BlackRock:
         if ext == '.nev':
             raise TypeError('NEV contains only header info, not data')
 
-        data = _read_nsx(self.filename, self.BOData, self.sess_begin,
-                         self.sess_end, self.factor, begsam, endsam)
+        if self._memmap is None:
+            self._memmap = _memmap_nsx(self.filename, self.BOData,
+                                       self.sess_begin, self.sess_end,
+                                       len(self.factor))
 
-        return data[chan, :]
+        return _read_nsx(self._memmap, self.sess_begin, self.sess_end,
+                         self.factor, chan, begsam, endsam, self.dtype)
 
     def return_markers(self, trigger_bits=8, trigger_zero=True):
         """We always read triggers as 16bit, but we convert them to 8 here
@@ -172,8 +192,66 @@ class BlackRock:
             return markers_no_zero
 
 
-def _read_nsx(filename, BOData, sess_begin, sess_end, factor, begsam, endsam):
+def _memmap_nsx(filename, BOData, sess_begin, sess_end, n_chan):
+    """Memory-map the data of each session.
+
+    Parameters
+    ----------
+    filename : path to file
+        the NSx file
+    BOData : list of int
+        position of the data of each session in the file
+    sess_begin : ndarray
+        first sample of each session
+    sess_end : ndarray
+        last sample of each session (not included)
+    n_chan : int
+        number of channels
+
+    Returns
+    -------
+    list of numpy.memmap
+        for each session, 2d matrix (samples X channels) as int16, or None if
+        the session has no data
     """
+    sessions = []
+    for begin, end, offset in zip(sess_begin, sess_end, BOData):
+        if end > begin:
+            sessions.append(memmap(str(filename), BLACKROCK_FORMAT, mode='r',
+                                   offset=offset, shape=(end - begin, n_chan)))
+        else:
+            sessions.append(None)
+
+    return sessions
+
+
+def _read_nsx(sessions, sess_begin, sess_end, factor, chan, begsam, endsam,
+              dtype='float64'):
+    """Read the data of some channels, from memory-mapped sessions.
+
+    Parameters
+    ----------
+    sessions : list of numpy.memmap
+        see _memmap_nsx
+    sess_begin : ndarray
+        first sample of each session
+    sess_end : ndarray
+        last sample of each session (not included)
+    factor : ndarray
+        conversion factor for each channel
+    chan : int or list
+        index (indices) of the channels to read
+    begsam : int
+        index of the first sample
+    endsam : int
+        index of the last sample
+    dtype : str
+        numpy dtype of the output
+
+    Returns
+    -------
+    numpy.ndarray
+        A 2d matrix, with dimension chan X samples
 
     Notes
     -----
@@ -181,40 +259,28 @@ def _read_nsx(filename, BOData, sess_begin, sess_end, factor, begsam, endsam):
 
     It returns NaN if you select an interval outside of the data
     """
-    n_chan = factor.shape[0]
+    chan = asarray(chan)
+    chan_factor = factor[chan].astype(dtype)[..., None]
 
-    dat = empty((n_chan, endsam - begsam))
+    dat = empty(chan.shape + (endsam - begsam, ), dtype=dtype)
     dat.fill(NaN)
 
     sess_to_read = where((begsam < sess_end) & (endsam > sess_begin))[0]
 
-    with open(filename, 'rb') as f:
-
-        for sess in sess_to_read:
-            begsam_sess = begsam - sess_begin[sess]
-            endsam_sess = endsam - sess_begin[sess]
-
-            begshift = 0
-
-            if begsam_sess < 0:
-                begsam_sess = 0
-                begshift = sess_begin[sess] - begsam
-
-            if endsam_sess > (sess_end[sess] - sess_begin[sess]):
-                endsam_sess = (sess_end[sess] - sess_begin[sess])
-
-            endshift = begshift + endsam_sess - begsam_sess
-
-            f.seek(BOData[sess], SEEK_SET)
-            f.seek(n_chan * N_BYTES * begsam_sess, SEEK_CUR)
+    for sess in sess_to_read:
+        if sessions[sess] is None:
+            continue
 
-            n_sam = endsam_sess - begsam_sess
-            dat_in_file = fromfile(f, BLACKROCK_FORMAT, n_chan * n_sam)
+        begsam_sess = max((begsam - sess_begin[sess], 0))
+        endsam_sess = min((endsam, sess_end[sess])) - sess_begin[sess]
+        begshift = begsam_sess + sess_begin[sess] - begsam
+        endshift = begshift + endsam_sess - begsam_sess
 
-            dat[:, begshift:endshift] = reshape(dat_in_file, (n_chan, n_sam),
-                                                order='F')
+        # only the requested channels are copied and converted
+        dat[..., begshift:endshift] = (sessions[sess][begsam_sess:endsam_sess,
+                                                      chan].T * chan_factor)
 
-    return expand_dims(factor, 1) * dat
+    return dat
 
 
 def _read_neuralsg(filename):
@@ -11,24 +11,35 @@ to the calibration.
 from logging import getLogger
 lg = getLogger(__name__)
 
-from datetime import datetime, timedelta
-from math import floor
+from datetime import datetime
 from re import findall
-from struct import pack
 
-from numpy import empty, asarray, fromstring, iinfo, abs, max
+from numpy import (abs,
+                   arange,
+                   asarray,
+                   clip,
+                   concatenate,
+                   empty,
+                   frombuffer,
+                   iinfo,
+                   isnan,
+                   max,
+                   memmap,
+                   NaN,
+                   rint,
+                   where,
+                   zeros,
+                   )
+
+from .utils import prepare_chunks
 
 EDF_FORMAT = 'int16'  # by definition
 edf_iinfo = iinfo(EDF_FORMAT)
 DIGITAL_MAX = edf_iinfo.max
 DIGITAL_MIN = -1 * edf_iinfo.max  # so that digital 0 = physical 0
-
-
-def _assert_all_the_same(items):
-    """Check that all the items in a list are the same.
-
-    """
-    assert all(items[0] == x for x in items)
+ANNOT_LABEL = 'EDF Annotations'
+# bytes of the time-keeping annotation at the beginning of each record
+TIMEKEEPING_N_BYTES = 16
 
 
 class Edf:
@@ -50,6 +61,12 @@ class Edf:
         self.filename = edffile
         self._read_hdr()
 
+        # signals with data (EDF+ annotations are read as markers)
+        self._chan = [i for i, label in enumerate(self.hdr['label'])
+                      if label != ANNOT_LABEL]
+        self._max_sam_rec = max([self.hdr['n_samples_per_record'][i]
+                                 for i in self._chan], initial=0)
+
     def _read_hdr(self):
         """Read header from EDF file.
 
@@ -76,7 +93,7 @@ class Edf:
 
             # misc
             hdr['header_n_bytes'] = int(f.read(8))
-            f.seek(44, 1)  # reserved for EDF+
+            hdr['reserved'] = f.read(44).decode('utf-8').strip()  # for EDF+
             hdr['n_records'] = int(f.read(8))
             hdr['record_length'] = float(f.read(8))  # in seconds
             nchannels = hdr['n_channels'] = int(f.read(4))
@@ -122,86 +139,64 @@ class Edf:
         orig : dict
             additional information taken directly from the header
 
+        Notes
+        -----
+        If the channels have different number of samples per record, s_freq
+        is the highest sampling frequency. The channels with lower sampling
+        frequency are upsampled by repeating each sample (see return_dat).
+
+        The EDF+ annotations are not included in the channels.
         """
         subj_id = self.hdr['subject_id']
         start_time = self.hdr['start_time']
-        _assert_all_the_same(self.hdr['n_samples_per_record'])
-        s_freq = (self.hdr['n_samples_per_record'][0] /
-                  self.hdr['record_length'])
-        chan_name = self.hdr['label']
-        n_samples = (self.hdr['n_samples_per_record'][0] *
-                     self.hdr['n_records'])
+        s_freq = self._max_sam_rec / self.hdr['record_length']
+        chan_name = [self.hdr['label'][i] for i in self._chan]
+        n_samples = self._max_sam_rec * self.hdr['n_records']
 
         return subj_id, start_time, s_freq, chan_name, n_samples, self.hdr
 
-    def _read_dat(self, i_chan, begsam, endsam):
-        """Read raw data from a single EDF channel.
-
-        Reads only one channel at the time. Very initial implementation, very
-        simple and probably not very fast
+    def _read_record_idx(self, chan):
+        """Index of the samples of each channel within one record.
 
         Parameters
         ----------
-        i_chan : int
-            index of the channel to read
-        begsam : int
-            index of the first sample
-        endsam : int
-            index of the last sample
+        chan : list of int
+            index (indices) of the signals in the header
 
         Returns
         -------
         numpy.ndarray
-            A vector with the data as written on file, in 16-bit precision
-
+            A 2d matrix (channels x samples in one record, at the highest
+            sampling frequency) with the position of each sample in a record
+            (as int16 values). If a channel has fewer samples per record, each
+            sample is repeated.
         """
+        n_sam_rec = asarray(self.hdr['n_samples_per_record'])
+        chan_offset = n_sam_rec.cumsum() - n_sam_rec
 
-        assert begsam < endsam
-
-        begsam = float(begsam)
-        endsam = float(endsam)
-
-        n_sam_rec = self.hdr['n_samples_per_record']
-
-        begrec = int(floor(begsam / n_sam_rec[i_chan]))
-        begsam_rec = int(begsam % n_sam_rec[i_chan])
-
-        endrec = int(floor(endsam / n_sam_rec[i_chan]))
-        endsam_rec = int(endsam % n_sam_rec[i_chan])
+        chan = asarray(chan)
+        return (chan_offset[chan, None] +
+                arange(self._max_sam_rec) * n_sam_rec[chan, None] //
+                self._max_sam_rec)
 
-        dat = empty(shape=(int(endsam) - int(begsam)), dtype='int16')
-        i_dat = 0
+    def _read_records(self):
+        """Memory-map the data section.
 
-        with open(self.filename, 'rb') as f:
-            for rec in range(begrec, endrec + 1):
-                if rec == begrec:
-                    begpos_rec = begsam_rec
-                else:
-                    begpos_rec = 0
-
-                if rec == endrec:
-                    endpos_rec = endsam_rec
-                else:
-                    endpos_rec = n_sam_rec[i_chan]
-
-                begpos = begpos_rec + sum(n_sam_rec) * rec + sum(
-                    n_sam_rec[:i_chan])
-                endpos = endpos_rec + sum(n_sam_rec) * rec + sum(
-                    n_sam_rec[:i_chan])
-
-                f.seek(begpos * 2 + self.hdr['header_n_bytes'])
-                samples = f.read(2 * (endpos - begpos))
-
-                i_dat_end = i_dat + endpos - begpos
-                dat[i_dat:i_dat_end] = fromstring(samples, dtype='<i2')
-                i_dat = i_dat_end
-
-        return dat
+        Returns
+        -------
+        numpy.memmap
+            A 2d matrix (records x int16 values in one record)
+        """
+        return memmap(str(self.filename), dtype='<i2', mode='r',
+                      offset=self.hdr['header_n_bytes'],
+                      shape=(self.hdr['n_records'],
+                             sum(self.hdr['n_samples_per_record'])))
 
     def return_dat(self, chan, begsam, endsam):
         """Read data from an EDF file.
 
-        Reads channel by channel, and adjusts the values by calibration.
+        The data section is memory-mapped as a matrix of records and all the
+        channels are read with one index, then adjusted by calibration.
 
         Parameters
         ----------
@@ -216,10 +211,12 @@ class Edf:
         -------
         numpy.ndarray
             A 2d matrix, where the first dimension is the channels and the
-            second dimension are the samples.
+            second dimension are the samples. Samples outside the recording
+            are NaN.
 
         """
         hdr = self.hdr
+        chan = [self._chan[i] for i in chan]
         dig_min = hdr['digital_min']
         phys_min = hdr['physical_min']
         phys_range = hdr['physical_max'] - hdr['physical_min']
@@ -229,30 +226,102 @@ class Edf:
         gain = phys_range / dig_range
 
         dat = empty(shape=(len(chan), endsam - begsam), dtype='float64')
+        dat.fill(NaN)
+
+        max_sam_rec = self._max_sam_rec
+        n_samples = max_sam_rec * hdr['n_records']
+        begpos, endpos = clip((begsam, endsam), 0, n_samples)
+        if begpos == endpos or len(chan) == 0:
+            return dat
+
+        begrec = begpos // max_sam_rec
+        endrec = (endpos - 1) // max_sam_rec + 1
 
-        for i, i_chan in enumerate(chan):
-            d = self._read_dat(i_chan, begsam, endsam).astype('float64')
-            dat[i, :] = (d - dig_min[i_chan]) * gain[i_chan] + phys_min[i_chan]
+        # records x channels x samples in one record
+        d = self._read_records()[begrec:endrec][:, self._read_record_idx(chan)]
+        d = d.transpose(1, 0, 2).reshape(len(chan), -1)
+        d = d[:, begpos - begrec * max_sam_rec:endpos - begrec * max_sam_rec]
+
+        d_cal = dat[:, begpos - begsam:endpos - begsam]
+        d_cal[:] = d
+        d_cal -= dig_min[chan, None]
+        d_cal *= gain[chan, None]
+        d_cal += phys_min[chan, None]
 
         return dat
 
     def return_markers(self):
-        """"""
-        return []
-
+        """Return the EDF+ annotations.
 
-def write_edf(data, filename, physical_max=1000):
-    """Export data to FieldTrip.
+        Returns
+        -------
+        list of dict
+            where each dict contains 'name' as str, 'start' and 'end' as float
+            in seconds from the start of the recordings, and 'chan' as None.
+
+        Notes
+        -----
+        The annotations are stored as time-stamped annotation lists (TAL):
+        "+onset\x15duration\x14text\x14\x00" (duration is optional and each
+        TAL can have more than one text). The first TAL of each record only
+        contains the onset of the record (time-keeping annotation) and it's
+        not returned.
+        """
+        annot = [i for i, label in enumerate(self.hdr['label'])
+                 if label == ANNOT_LABEL]
+        if not annot:
+            return []
+
+        n_sam_rec = asarray(self.hdr['n_samples_per_record'])
+        chan_offset = n_sam_rec.cumsum() - n_sam_rec
+        records = self._read_records()
+
+        markers = []
+        for i in annot:
+            tals = records[:, chan_offset[i]:chan_offset[i] + n_sam_rec[i]]
+            for tal in tals.tobytes().split(b'\x00'):
+                tal = tal.decode('utf-8', errors='replace').split('\x14')
+                if len(tal) < 2:
+                    continue
+                onset, _, duration = tal[0].partition('\x15')
+                onset = float(onset)
+                duration = float(duration) if duration else 0
+                for text in tal[1:]:
+                    if text:
+                        markers.append({'name': text,
+                                        'start': onset,
+                                        'end': onset + duration,
+                                        'chan': None,
+                                        })
+
+        return sorted(markers, key=lambda x: x['start'])
+
+
+def write_edf(data, filename, physical_max=1000, physical_min=None,
+              markers=None, chunk_duration=60):
+    """Export data to EDF.
 
     Parameters
     ----------
-    data : instance of ChanTime
-        data with only one trial
+    data : instance of ChanTime or Dataset or iterable of ChanTime
+        data with only one trial, or a dataset (which is read in chunks), or
+        consecutive chunks of data (each with only one trial)
     filename : path to file
-        file to export to (include '.mat')
-    physical_max : int
-        values above this parameter will be considered saturated (and also
-        those that are too negative). This parameter defines the precision.
+        file to export to (include '.edf')
+    physical_max : int or float or list of float
+        values above this parameter will be considered saturated. This
+        parameter defines the precision. It can be one value for each channel.
+        If None, it uses the max absolute value (only for ChanTime).
+    physical_min : int or float or list of float
+        values below this parameter will be considered saturated. If None, it
+        uses -1 * physical_max.
+    markers : list of dict
+        markers to store as EDF+ annotations, where each dict contains 'name'
+        as str, 'start' and 'end' as float in seconds (same reference as the
+        time axis or the dataset).
+    chunk_duration : float
+        duration in s of the data which is read, converted and written at once
+        (only for ChanTime and Dataset).
 
     Notes
     -----
@@ -263,22 +332,50 @@ def write_edf(data, filename, physical_max=1000):
     >>> precision = physical_max / DIGITAL_MAX
 
     where DIGITAL_MAX is 32767.
+
+    Only the data in chunk_duration is kept in memory (for ChanTime, the data
+    are already in memory), so you can convert very long recordings. The
+    number of records is written when all the data has been written. The
+    samples in the last (incomplete) second are not written.
+
+    If markers are specified, the file is EDF+C and the markers are stored in
+    the record which contains their onset.
     """
-    if data.start_time is None:
-        raise ValueError('Data should contain a valid start_time (as datetime)')
-    start_time = data.start_time + timedelta(seconds=data.axis['time'][0][0])
+    start_time, s_freq, chan_name, chunks = prepare_chunks(data,
+                                                           chunk_duration)
+    n_channels = len(chan_name)
+    s_freq = int(s_freq)
+    record_length = 1
 
     if physical_max is None:
+        if not hasattr(data, 'data'):
+            raise ValueError('physical_max can only be computed on ChanTime')
         physical_max = max(abs(data.data[0]))
-
-    precision = physical_max / DIGITAL_MAX
+    physical_max = _broadcast_chan(physical_max, n_channels)
+    if physical_min is None:
+        physical_min = -1 * physical_max
+    physical_min = _broadcast_chan(physical_min, n_channels)
+
+    # use the values that are actually stored in the header
+    str_pmax = [_format_number(x, 8) for x in physical_max]
+    str_pmin = [_format_number(x, 8) for x in physical_min]
+    physical_max = asarray([float(x) for x in str_pmax])[:, None]
+    physical_min = asarray([float(x) for x in str_pmin])[:, None]
+    gain = (DIGITAL_MAX - DIGITAL_MIN) / (physical_max - physical_min)
+
+    precision = (1 / gain).max()
     lg.info('Data exported to EDF will have precision ' + str(precision))
 
-    physical_min = -1 * physical_max
-    dat = data.data[0] / physical_max * DIGITAL_MAX
-    dat = dat.astype(EDF_FORMAT)
-    dat[dat > DIGITAL_MAX] = DIGITAL_MAX
-    dat[dat < DIGITAL_MIN] = DIGITAL_MIN
+    tals = {}
+    n_annot = 0
+    if markers is not None:
+        tals = _markers_to_tals(markers, data)
+        n_annot_bytes = TIMEKEEPING_N_BYTES + max([len(x) for x in
+                                                   tals.values()] + [0])
+        n_annot = (n_annot_bytes + 1) // 2
+
+    n_data = s_freq * n_channels
+    rec_len = n_data + n_annot
 
     with open(filename, 'wb') as f:
         f.write('{:<8}'.format(0).encode('ascii'))
@@ -287,44 +384,181 @@ def write_edf(data, filename, physical_max=1000):
         f.write(start_time.strftime('%d.%m.%y').encode('ascii'))
         f.write(start_time.strftime('%H.%M.%S').encode('ascii'))
 
-        n_smp = data.data[0].shape[1]
-        s_freq = int(data.s_freq)
-        n_records = n_smp // s_freq  # floor
-        record_length = 1
-        n_channels = data.number_of('chan')[0]
-
-        header_n_bytes = 256 + 256 * n_channels
+        n_signals = n_channels + (1 if n_annot else 0)
+        header_n_bytes = 256 + 256 * n_signals
         f.write('{:<8d}'.format(header_n_bytes).encode('ascii'))
-        f.write((' ' * 44).encode('ascii'))  # reserved for EDF+
+        reserved = 'EDF+C' if n_annot else ''
+        f.write('{:<44}'.format(reserved).encode('ascii'))
 
-        f.write('{:<8}'.format(n_records).encode('ascii'))
+        f.write('{:<8}'.format(-1).encode('ascii'))  # n_records, see below
         f.write('{:<8d}'.format(record_length).encode('ascii'))
-        f.write('{:<4}'.format(n_channels).encode('ascii'))
-
-        for chan in data.axis['chan'][0]:
-            f.write('{:<16}'.format(chan).encode('ascii'))  # label
-        for _ in range(n_channels):
+        f.write('{:<4}'.format(n_signals).encode('ascii'))
+
+        labels = [chan[:16] for chan in chan_name]
+        phys_dim = ['uV'] * n_channels
+        dig_min = [DIGITAL_MIN] * n_channels
+        dig_max = [DIGITAL_MAX] * n_channels
+        n_smp_rec = [s_freq] * n_channels
+        if n_annot:
+            labels.append(ANNOT_LABEL)
+            phys_dim.append('')
+            str_pmin.append('-1')
+            str_pmax.append('1')
+            dig_min.append(edf_iinfo.min)
+            dig_max.append(edf_iinfo.max)
+            n_smp_rec.append(n_annot)
+
+        for label in labels:
+            f.write('{:<16}'.format(label).encode('ascii'))
+        for _ in range(n_signals):
             f.write(('{:<80}').format('').encode('ascii'))  # tranducer
-        for _ in range(n_channels):
-            f.write('{:<8}'.format('uV').encode('ascii'))  # physical_dim
-        for _ in range(n_channels):
-            f.write('{:<8}'.format(physical_min).encode('ascii'))
-        for _ in range(n_channels):
-            f.write('{:<8}'.format(physical_max).encode('ascii'))
-        for _ in range(n_channels):
-            f.write('{:<8}'.format(DIGITAL_MIN).encode('ascii'))
-        for _ in range(n_channels):
-            f.write('{:<8}'.format(DIGITAL_MAX).encode('ascii'))
-        for _ in range(n_channels):
+        for dim in phys_dim:
+            f.write('{:<8}'.format(dim).encode('ascii'))
+        for pmin in str_pmin:
+            f.write('{:<8}'.format(pmin).encode('ascii'))
+        for pmax in str_pmax:
+            f.write('{:<8}'.format(pmax).encode('ascii'))
+        for dmin in dig_min:
+            f.write('{:<8}'.format(dmin).encode('ascii'))
+        for dmax in dig_max:
+            f.write('{:<8}'.format(dmax).encode('ascii'))
+        for _ in range(n_signals):
             f.write('{:<80}'.format('').encode('ascii'))  # prefiltering
-        for _ in range(n_channels):
-            f.write('{:<8d}'.format(s_freq).encode('ascii'))  # n_smp in record
-        for _ in range(n_channels):
+        for n_smp in n_smp_rec:
+            f.write('{:<8d}'.format(n_smp).encode('ascii'))
+        for _ in range(n_signals):
             f.write((' ' * 32).encode('ascii'))
 
-        l = s_freq * n_channels  # length of one record
-        for i in range(n_records):
-            i0 = i * s_freq
-            i1 = i0 + s_freq
-            x = dat[:, i0:i1].flatten(order='C')  # assumes it's ChanTimeData
-            f.write(pack('<' + 'h' * l, *x))
+        n_records = 0
+        rest = empty((n_channels, 0))
+        for chunk in chunks:
+            dat = concatenate((rest, chunk), axis=1)
+            n_rec = dat.shape[1] // s_freq
+            rest = dat[:, n_rec * s_freq:]
+            if n_rec == 0:
+                continue
+
+            dat = dat[:, :n_rec * s_freq]
+            dat = (where(isnan(dat), 0, dat) - physical_min) * gain
+            dat += DIGITAL_MIN
+            dat = clip(rint(dat), DIGITAL_MIN, DIGITAL_MAX).astype(EDF_FORMAT)
+
+            records = empty((n_rec, rec_len), dtype='<i2')
+            records[:, :n_data] = dat.reshape(n_channels, n_rec,
+                                              s_freq).transpose(1, 0, 2
+                                                                ).reshape(
+                n_rec, n_data)
+            if n_annot:
+                records[:, n_data:] = _write_tals(tals, n_records, n_rec,
+                                                  n_annot)
+
+            f.write(records.tobytes())
+            n_records += n_rec
+
+        if rest.shape[1]:
+            lg.info('Last ' + str(rest.shape[1]) + ' samples were not '
+                    'exported to EDF (incomplete record)')
+
+        # each TAL ends with one null byte
+        n_late = sum(tals[rec].count(b'\x00') for rec in tals
+                     if rec >= n_records)
+        if n_late:
+            lg.warning(str(n_late) + ' markers start after the end of the '
+                       'data and were not exported to EDF')
+
+        f.seek(236)
+        f.write('{:<8}'.format(n_records).encode('ascii'))
+
+
+def _broadcast_chan(values, n_chan):
+    """Return one value for each channel, as 1d numpy.ndarray."""
+    values = asarray(values, dtype='float64').ravel()
+    if len(values) == 1:
+        values = values.repeat(n_chan)
+    if len(values) != n_chan:
+        raise ValueError('You need to specify one value or one value for '
+                         'each channel')
+    return values
+
+
+def _format_number(x, n_char):
+    """Format a number so that it fits in the EDF header."""
+    for precision in range(n_char, 0, -1):
+        s = '{:.{}g}'.format(x, precision)
+        if 'e' in s:
+            s = '{:.{}f}'.format(x, n_char).rstrip('0').rstrip('.')[:n_char]
+        if len(s) <= n_char:
+            return s
+    raise ValueError('Value ' + str(x) + ' does not fit in EDF header')
+
+
+def _markers_to_tals(markers, data):
+    """Convert markers into EDF+ TAL.
+
+    Parameters
+    ----------
+    markers : list of dict
+        where each dict contains 'name' as str, 'start' and 'end' as float
+    data : instance of ChanTime or Dataset or iterable of ChanTime
+        see write_edf (to get the time of the first sample)
+
+    Returns
+    -------
+    dict
+        where the key is the index of the record and the value is the bytes
+        of all the TALs starting in that record
+    """
+    offset = 0
+    if hasattr(data, 'axis'):
+        offset = data.axis['time'][0][0]
+    elif not hasattr(data, 'read_data'):
+        lg.info('For iterable of data, markers are relative to the first '
+                'sample')
+
+    tals = {}
+    for mrk in markers:
+        onset = mrk['start'] - offset
+        duration = mrk['end'] - mrk['start']
+        tal = _format_onset(onset)
+        if duration > 0:
+            tal += '\x15' + _format_onset(duration)[1:]
+        tal += '\x14' + mrk['name'] + '\x14\x00'
+
+        rec = int(max((onset, 0)))
+        tals[rec] = tals.get(rec, b'') + tal.encode('utf-8')
+
+    return tals
+
+
+def _format_onset(x):
+    """Format onset in s, as required by EDF+."""
+    return '{:+f}'.format(x).rstrip('0').rstrip('.')
+
+
+def _write_tals(tals, first_rec, n_rec, n_annot):
+    """Write the annotation channel for some records.
+
+    Parameters
+    ----------
+    tals : dict
+        see _markers_to_tals
+    first_rec : int
+        index of the first record
+    n_rec : int
+        number of records
+    n_annot : int
+        number of samples (2 bytes) in the annotation channel
+
+    Returns
+    -------
+    numpy.ndarray
+        2d matrix (records X n_annot), as int16
+    """
+    annot = zeros((n_rec, n_annot * 2), dtype='u1')
+    for i in range(n_rec):
+        rec = first_rec + i
+        tal = ('+' + str(rec) + '\x14\x14\x00').encode('utf-8')
+        tal += tals.get(rec, b'')
+        annot[i, :len(tal)] = frombuffer(tal, dtype='u1')
+
+    return annot.view('<i2')
@@ -1,17 +1,29 @@
 from datetime import datetime
 from glob import glob
 from logging import getLogger
-from os import SEEK_CUR
 from os.path import basename, join, splitext
-from struct import unpack
+from struct import unpack_from
 from xml.etree.ElementTree import parse
 
-from numpy import (append, asarray, cumsum, diff, empty, NaN, reshape, sum,
-                   where)
+from numpy import (append, asarray, cumsum, diff, dtype, empty, frombuffer,
+                   memmap, NaN, ndarray, searchsorted, sum)
 
 shorttime = lambda x: x[:26] + x[29:32] + x[33:]
 lg = getLogger(__name__)
 
+# one row for each block in the signal file
+BLOCK_HDR = dtype([('data_pos', 'q'),  # position of the data in the file
+                   ('data_size', 'q'),
+                   ('n_signals', 'I'),
+                   ('n_samples', 'q'),  # for each signal
+                   ('depth', 'B'),
+                   ('freq', 'I'),
+                   ])
+DEPTH_DTYPE = {16: '<i2',
+               32: '<f4',
+               64: '<f8',
+               }
+
 
 class EgiMff:
     """Basic class to read the data.
@@ -25,8 +37,8 @@ class EgiMff:
     def __init__(self, filename):
         self.filename = filename
         self._signal = []
+        self._memmap = []
         self._block_hdr = []
-        self._i_data = []
         self._nchan_signal1 = []  # n of channels in signal1
         self._n_samples = []
         self._orig = {}
@@ -58,12 +70,12 @@ class EgiMff:
         signals = sorted(glob(join(self.filename, 'signal*.bin')))
 
         for signal in signals:
-            block_hdr, i_data = read_all_block_hdr(join(self.filename, signal))
+            signal_memmap = memmap(signal, dtype='u1', mode='r')
+            block_hdr = read_all_block_hdr(signal_memmap)
             self._signal.append(signal)
+            self._memmap.append(signal_memmap)
             self._block_hdr.append(block_hdr)
-            self._i_data.append(i_data)
-            n_samples = asarray([x['n_samples'][0] for x in block_hdr], 'q')
-            self._n_samples.append(n_samples)
+            self._n_samples.append(block_hdr['n_samples'])
 
         try:
             subj_id = orig['subject'][0][0]['name']
@@ -85,10 +97,10 @@ class EgiMff:
         self._videos = videos
 
         # it only works if they have all the same sampling frequency
-        s_freq = [x[0]['freq'][0] for x in self._block_hdr]
+        s_freq = [x[0]['freq'] for x in self._block_hdr]
         assert all([x == s_freq[0] for x in s_freq])
         SIGNAL = 0
-        s_freq = self._block_hdr[SIGNAL][0]['freq'][0]
+        s_freq = self._block_hdr[SIGNAL][0]['freq']
         n_samples = sum(self._n_samples[SIGNAL])
 
         chan_name, self._nchan_signal1 = _read_chan_name(orig)
@@ -144,55 +156,29 @@ class EgiMff:
                 i_chan_data = chan >= self._nchan_signal1
                 i_chan_rec = chan[i_chan_data] - self._nchan_signal1
 
-            x = self._n_samples[one_signal]
-            x1 = cumsum(append(0, x))
-
-            # begrec is -1 when begsam is before start of the recordings
-            begrec = where(begsam < x1)[0][0] - 1
-            try:
-                endrec = where(endsam < x1)[0][0] - 1
-            except IndexError:
-                endrec = len(x)
-
-            f = open(self._signal[one_signal], 'rb')
-
-            i0 = 0
-            for rec in range(begrec, endrec + 1):
-
-                # if begsam is before start of the recordings, we just shift the baseline
-                if rec == -1:
-                    i0 = - begsam
-                    continue
-
-                # if endsam is after end of the recordings, we just stop here
-                if rec == len(self._n_samples[one_signal]):
-                    break
-
-
-                if rec == begrec: 
-                    begpos_rec = begsam - x1[rec]
-                else:
-                    begpos_rec = 0
-
-                if rec == endrec:
-                    endpos_rec = endsam - x1[rec]
-                else:
-                    endpos_rec = x[rec]
-
-                i1 = i0 + endpos_rec - begpos_rec
+            block_hdr = self._block_hdr[one_signal]
+            x1 = cumsum(append(0, block_hdr['n_samples']))
 
-                lg.debug('data {: 8d}-{: 8d}, rec ({}) {: 5d} - {: 5d}'.format(i0, i1, rec, begpos_rec, endpos_rec))
+            # samples outside the recordings are NaN
+            begpos = max((begsam, 0))
+            endpos = min((endsam, x1[-1]))
+            if begpos >= endpos:
+                continue
 
-                rec_dat = _read_block(f,
-                                  self._block_hdr[one_signal][rec],
-                                  self._i_data[one_signal][rec])
+            begrec = searchsorted(x1, begpos, side='right') - 1
+            endrec = searchsorted(x1, endpos, side='left')
 
+            for r0, r1 in _find_runs(block_hdr, begrec, endrec):
+                rec_dat = _read_run(self._memmap[one_signal], block_hdr[r0:r1],
+                                    i_chan_rec)
+                i0 = max((x1[r0], begpos))
+                i1 = min((x1[r1], endpos))
 
-                data[i_chan_data, i0:i1] = rec_dat[i_chan_rec,
-                                                   begpos_rec:endpos_rec]
-                i0 = i1
+                lg.debug('data {: 8d}-{: 8d}, rec {: 5d} - {: 5d}'.format(
+                    i0 - begsam, i1 - begsam, r0, r1))
 
-            f.close()
+                data[i_chan_data, i0 - begsam:i1 - begsam] = rec_dat[
+                    :, i0 - x1[r0]:i1 - x1[r0]]
 
         return data
 
@@ -256,103 +242,134 @@ class EgiMff:
         return mp4_file, begtime, endtime
 
 
-def _read_block(filename, block_hdr, i):
-    f = filename
+def _find_runs(block_hdr, begrec, endrec):
+    """Group adjacent blocks, which have the same size and are equally spaced
+    in the file.
 
-    n_bytes = (block_hdr['depth'] / 8).astype('B')
-
-    data_type = []
-    for b, n_smp in zip(n_bytes, block_hdr['n_samples']):
-        if b == 2:
-            data_type.append('h' * n_smp)
-        if b == 4:
-            data_type.append('f' * n_smp)
-        if b == 8:
-            data_type.append('d' * n_smp)
-
-    f.seek(i)
-
-    v = unpack('<' + ''.join(data_type),
-               f.read(sum(n_bytes * block_hdr['n_samples'])))
-
-    return reshape(v, (block_hdr['n_signals'], block_hdr['n_samples'][0]))
-
-
-def read_block_hdr(f):
-
-    version = unpack('<I', f.read(4))[0]
-    hdr_size = unpack('<I', f.read(4))[0]
-    data_size = unpack('<I', f.read(4))[0]
-    n_signals = unpack('<I', f.read(4))[0]
+    Parameters
+    ----------
+    block_hdr : numpy.ndarray
+        structured array with the header of all the blocks (see BLOCK_HDR)
+    begrec : int
+        index of the first block to read
+    endrec : int
+        index of the last block to read (this block will NOT be read)
 
-    offset = asarray(unpack('<' + 'I' * n_signals, f.read(4 * n_signals)), 'I')
+    Returns
+    -------
+    list of tuple of int
+        first and last block (not included) of each run of blocks
+    """
+    runs = []
+    r0 = begrec
+    for rec in range(begrec + 1, endrec):
+        prev = block_hdr[rec - 1]
+        same = (block_hdr[rec]['n_signals'] == prev['n_signals'] and
+                block_hdr[rec]['n_samples'] == prev['n_samples'] and
+                block_hdr[rec]['depth'] == prev['depth'])
+        if same and rec - r0 > 1:
+            stride = prev['data_pos'] - block_hdr[rec - 2]['data_pos']
+            same = block_hdr[rec]['data_pos'] - prev['data_pos'] == stride
+        if not same:
+            runs.append((r0, rec))
+            r0 = rec
+    runs.append((r0, endrec))
+
+    return runs
+
+
+def _read_run(signal_memmap, block_hdr, chan):
+    """Read adjacent blocks with one bulk copy.
 
-    depth = empty(n_signals, 'B')
-    freq = empty(n_signals, 'I')
-    for j in range(n_signals):
-        depth[j] = unpack('<B', f.read(1))[0]
-        freq[j] = unpack('<I', f.read(3) + b'\x00')[0]
+    Parameters
+    ----------
+    signal_memmap : numpy.memmap
+        memory-map of the signal file, as uint8
+    block_hdr : numpy.ndarray
+        structured array with the header of the blocks to read (see
+        _find_runs), with the same size and spaced equally
+    chan : numpy.ndarray
+        indices of the signals to read
 
-    n_samples = diff(offset)
-    n_samples = append(n_samples, data_size - offset[-1])
-    n_samples = (n_samples / (depth / 8)).astype('I')
+    Returns
+    -------
+    numpy.ndarray
+        2d matrix (chan X samples in all the blocks)
+    """
+    n_blocks = len(block_hdr)
+    n_signals = block_hdr[0]['n_signals']
+    n_samples = block_hdr[0]['n_samples']
+    data_type = dtype(DEPTH_DTYPE[block_hdr[0]['depth']])
 
-    opt_hdr_size = unpack('<I', f.read(4))[0]
-    if opt_hdr_size > 0:
-        opt_hdr_type = unpack('<I', f.read(4))[0]
-        n_blocks = unpack('<Q', f.read(8))[0]
-        n_smp = unpack('<Q', f.read(8))[0]  # unreliable
-        n_signals_opt = unpack('<I', f.read(4))[0]
+    if n_blocks > 1:
+        stride = block_hdr[1]['data_pos'] - block_hdr[0]['data_pos']
     else:
-        n_blocks = None
-        n_smp = None
-        n_signals_opt = None
-
-    opt_hdr = {'n_blocks': n_blocks,
-               'n_smp': n_smp,
-               'n_signals_opt': n_signals_opt}
-
-    hdr = {'version': version,
-           'hdr_size': hdr_size,
-           'data_size': data_size,
-           'n_signals': n_signals,
-           'offset': offset,
-           'depth': depth,
-           'freq': freq,
-           'n_samples': n_samples,
-           'opt_hdr_size': opt_hdr_size,
-           'opt_hdr': opt_hdr,
-           }
-
-    return hdr
+        stride = block_hdr[0]['data_size']
 
+    dat = ndarray((n_blocks, n_signals, n_samples), dtype=data_type,
+                  buffer=signal_memmap, offset=block_hdr[0]['data_pos'],
+                  strides=(stride, n_samples * data_type.itemsize,
+                           data_type.itemsize))
 
-def read_all_block_hdr(filename):
+    return dat[:, chan, :].transpose(1, 0, 2).reshape(len(chan), -1)
 
-    with open(filename, 'rb') as f:
 
-        block_hdr = []
-        i_data = []
+def read_all_block_hdr(signal_memmap):
+    """Read the header of all the blocks in the signal file.
 
-        while True:
-            version_bytes = f.read(4)
-            if not version_bytes:
-                break
-            version = unpack('<I', version_bytes)[0]
+    Parameters
+    ----------
+    signal_memmap : numpy.memmap
+        memory-map of the signal file, as uint8
 
-            if version:
-                f.seek(-4, SEEK_CUR)  # re-read version
-                block_hdr.append(read_block_hdr(f))
+    Returns
+    -------
+    numpy.ndarray
+        structured array with one row for each block (see BLOCK_HDR)
 
-            else:
-                block_hdr.append(block_hdr[-1])
+    Notes
+    -----
+    When the version of a block is zero, the block has the same header as the
+    previous block. The number of samples and the depth should be the same for
+    all the signals in one block.
+    """
+    block_hdr = []
+    pos = 0
+    while pos < len(signal_memmap):
+        version = unpack_from('<I', signal_memmap, pos)[0]
+
+        if version:
+            _, hdr_size, data_size, n_signals = unpack_from('<4I',
+                                                            signal_memmap,
+                                                            pos)
+            pos += 16
+            offset = frombuffer(signal_memmap, '<u4', n_signals, pos)
+            pos += 4 * n_signals
+            # depth is 1 byte and frequency is 3 bytes
+            depth_freq = frombuffer(signal_memmap, '<u4', n_signals, pos)
+            pos += 4 * n_signals
+            depth = depth_freq & 0xff
+            freq = depth_freq >> 8
+
+            opt_hdr_size = unpack_from('<I', signal_memmap, pos)[0]
+            pos += 4
+            if opt_hdr_size > 0:
+                pos += 24  # type, n_blocks, n_smp, n_signals
+
+            n_bytes = diff(append(offset, data_size))
+            n_samples = n_bytes // (depth // 8)
+            if (n_samples != n_samples[0]).any() or (depth != depth[0]).any():
+                raise ValueError('All signals in one block should have the '
+                                 'same number of samples and depth')
+            hdr = (data_size, n_signals, n_samples[0], depth[0], freq[0])
 
-            i_data.append(f.tell())
-            f.seek(block_hdr[-1]['data_size'], SEEK_CUR)
+        else:
+            pos += 4
 
-        i_data = asarray(i_data, 'q')
+        block_hdr.append((pos, ) + hdr)
+        pos += hdr[0]
 
-    return block_hdr, i_data
+    return asarray(block_hdr, dtype=BLOCK_HDR)
 
 
 def parse_xml(xml_file):
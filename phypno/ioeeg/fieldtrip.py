@@ -3,7 +3,10 @@ lg = getLogger(__name__)
 
 from datetime import datetime
 
-from numpy import around, empty
+from numpy import asarray, bytes_, empty, float64, NaN, uint16, unique
+
+from .utils import read_range
+
 try:
     from scipy.io import loadmat, savemat
 except ImportError:
@@ -11,6 +14,9 @@ except ImportError:
                'be able to read and write in FieldTrip format.')
 
 VAR = 'data'
+TRL = 0  # only the first trial is read
+WRITE_CHUNK = 2 ** 16  # n of samples written at once in v7.3 files
+MAT73_HDR_LENGTH = 512  # the userblock, where MATLAB stores its header
 
 
 class FieldTrip:
@@ -25,6 +31,16 @@ class FieldTrip:
     def __init__(self, filename):
         self.filename = filename
 
+        self._trial = None  # the data (v7) or the h5py dataset (v7.3)
+        self._h5 = None  # h5py file, open until close()
+
+    def __getstate__(self):
+        """Do not pickle the data, the file is read again when necessary."""
+        state = self.__dict__.copy()
+        state['_trial'] = None
+        state['_h5'] = None
+        return state
+
     def return_hdr(self):
         """Return the header for further use.
 
@@ -50,6 +66,9 @@ class FieldTrip:
 
         h5py is necessary for this function
 
+        The data of v7 files are kept in memory (the whole file is read by
+        scipy anyway), while v7.3 files stay open and the data are only read
+        when necessary.
         """
         # fieldtrip does not have this information
         orig = dict()
@@ -65,28 +84,33 @@ class FieldTrip:
             ft_data = ft_data[VAR]
 
             s_freq = ft_data['fsample'].astype('float64').item()
-            n_samples = ft_data['trial'].item().shape[1]
+            self._trial = ft_data['trial'].item()
+            if self._trial.dtype == object:  # more than one trial
+                self._trial = self._trial[TRL]
+            n_samples = self._trial.shape[1]
             chan_name = list(ft_data['label'].item())
 
         except NotImplementedError:
             from h5py import File
 
-            with File(self.filename) as f:
+            with File(self.filename, 'r') as f:
 
                 if VAR not in f.keys():
                     raise KeyError('Save the FieldTrip variable as ''{}'''
                                    ''.format(VAR))
 
-                s_freq = int(f[VAR]['fsample'].value.squeeze())
+                s_freq = int(f[VAR]['fsample'][()].squeeze())
 
                 # some hdf5 magic
                 # https://groups.google.com/forum/#!msg/h5py/FT7nbKnU24s/NZaaoLal9ngJ
                 chan_name = []
-                for l in f[VAR]['label'].value.flat:  # convert to np for flat
-                    chan_name.append(''.join([chr(x) for x in f[l].value]))
+                for l in f[VAR]['label'][()].flat:  # convert to np for flat
+                    chan_name.append(''.join([chr(x) for x in f[l][()].flat]))
 
-                n_smp = f[VAR]['sampleinfo'][1] - f[VAR]['sampleinfo'][0] + 1
-                n_samples = int(around(n_smp))
+            # keep the file open, to read the data when necessary
+            self._h5 = File(self.filename, 'r')
+            self._trial = self._h5[self._h5[VAR]['trial'][TRL].item()]
+            n_samples = self._trial.shape[0]
 
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
@@ -105,24 +129,29 @@ class FieldTrip:
         Returns
         -------
         numpy.ndarray
-            A 2d matrix, with dimension chan X samples
+            A 2d matrix, with dimension chan X samples. The samples outside the
+            data are NaN.
 
+        Notes
+        -----
+        For v7.3 files, the file stays open until you call close() and only
+        the requested channels and samples are read from the file.
         """
-        TRL = 0
-        try:
-            ft_data = loadmat(self.filename, struct_as_record=True,
-                              squeeze_me=True)
-            ft_data = ft_data[VAR]
+        if self._trial is None:  # after close()
+            self.return_hdr()
 
-            data = ft_data['trial'].item(TRL)
+        if self._h5 is None:
+            return read_range(self._trial, chan, begsam, endsam)
 
-        except NotImplementedError:
-            from h5py import File
+        return _read_h5_range(self._trial, chan, begsam, endsam)
 
-            with File(self.filename) as f:
-                data = f[f[VAR]['trial'][TRL].item()].value.T
-
-        return data[chan, begsam:endsam]
+    def close(self):
+        """Release the data or close the v7.3 file (it's read again if you
+        read the data)."""
+        if self._h5 is not None:
+            self._h5.close()
+        self._h5 = None
+        self._trial = None
 
     def return_markers(self):
         """Return all the markers (also called triggers or events).
@@ -148,28 +177,82 @@ class FieldTrip:
         return markers
 
 
-def write_fieldtrip(data, filename):
+def _read_h5_range(dset, chan, begsam, endsam):
+    """Read some channels and samples from a h5py dataset, see read_range.
+
+    Parameters
+    ----------
+    dset : instance of h5py.Dataset
+        data stored by MATLAB (samples X chan)
+    chan : int or list
+        index (indices) of the channels to read
+    begsam : int
+        index of the first sample
+    endsam : int
+        index of the last sample
+
+    Returns
+    -------
+    numpy.ndarray
+        A 2d matrix, with dimension chan X samples
+
+    Notes
+    -----
+    h5py only reads the hyperslab of the requested channels and samples, but
+    the channels need to be sorted and unique.
+    """
+    chan = asarray(chan).ravel()
+    n_smp = dset.shape[0]
+    begrec = max((begsam, 0))
+    endrec = max((min((endsam, n_smp)), begrec))
+
+    dat = empty((len(chan), endsam - begsam), dtype=float64)
+    dat[:, :begrec - begsam] = NaN
+    dat[:, endrec - begsam:] = NaN
+
+    if endrec > begrec and len(chan):
+        sorted_chan, idx = unique(chan, return_inverse=True)
+        dat[:, begrec - begsam:endrec - begsam] = \
+            dset[begrec:endrec, list(sorted_chan)].T[idx]
+
+    return dat
+
+
+def write_fieldtrip(data, filename, version='7'):
     """Export data to FieldTrip.
 
     Parameters
     ----------
     data : instance of ChanTime
-        data with only one trial
+        data (it can have multiple trials)
     filename : path to file
         file to export to (include '.mat')
+    version : str
+        '7' (scipy) or '7.3' (HDF5, it requires h5py)
 
     Notes
     -----
-    It saves mat file using Version 6 ('-v7') because it relies on scipy.io
-    functions. Therefore it cannot store data larger than 2 GB.
+    Version '7' saves mat file using Version 6 ('-v7') because it relies on
+    scipy.io functions. Therefore it cannot store data larger than 2 GB.
+
+    Version '7.3' writes an HDF5 file with the layout used by MATLAB, so it
+    can store data of any size. Each trial is written in blocks of
+    WRITE_CHUNK samples, which is also the size of the HDF5 chunks.
     """
+    if version == '7.3':
+        _write_mat73(data, filename)
+        return
+
+    elif version != '7':
+        raise ValueError('FieldTrip version should be "7" or "7.3"')
+
     n_trl = data.number_of('trial')
     trial = empty(n_trl, dtype='O')
     time = empty(n_trl, dtype='O')
 
     for trl in range(n_trl):
         trial[trl] = data.data[trl]
-        time[trl] = data.axis['time'][trl]
+        time[trl] = asarray(data.axis['time'][trl])
 
     ft_data = {'fsample': float(data.s_freq),
                'label': data.axis['chan'][0].astype('O'),
@@ -179,3 +262,87 @@ def write_fieldtrip(data, filename):
                }
 
     savemat(filename, {VAR: ft_data})
+
+
+def _write_mat73(data, filename):
+    """Export data to FieldTrip, as MATLAB v7.3 file, see write_fieldtrip.
+
+    Notes
+    -----
+    MATLAB stores arrays in column-major order, so all the dimensions are
+    transposed. Cell arrays are stored as HDF5 references to datasets in the
+    '#refs#' group. The header in the userblock is necessary for MATLAB to
+    recognize the file.
+    """
+    from h5py import File, special_dtype, Reference
+
+    n_trl = data.number_of('trial')
+    n_samples = data.number_of('time')
+
+    with File(filename, 'w', userblock_size=MAT73_HDR_LENGTH) as f:
+        ft = f.create_group(VAR)
+        ft.attrs['MATLAB_class'] = bytes_('struct')
+        refs = f.create_group('#refs#')
+
+        _add_matlab(ft, 'fsample', [[float(data.s_freq)]])
+
+        labels = [_add_matlab(refs, 'label_{}'.format(i), _to_char(label))
+                  for i, label in enumerate(data.axis['chan'][0])]
+
+        trials = []
+        times = []
+        for trl in range(n_trl):
+            dat = data.data[trl]
+            n_chan, n_smp = dat.shape
+            dset = refs.create_dataset('trial_{}'.format(trl),
+                                       shape=(n_smp, n_chan), dtype=float64,
+                                       chunks=(max((min((n_smp, WRITE_CHUNK)),
+                                                    1)),
+                                               max((n_chan, 1))))
+            dset.attrs['MATLAB_class'] = bytes_('double')
+            for i in range(0, n_smp, WRITE_CHUNK):
+                dset[i:i + WRITE_CHUNK, :] = dat[:, i:i + WRITE_CHUNK].T
+            trials.append(dset)
+
+            times.append(_add_matlab(refs, 'time_{}'.format(trl),
+                                     asarray(data.axis['time'][trl])[:, None]))
+
+        ref_dtype = special_dtype(ref=Reference)
+        for name, cells, shape in (('label', labels, (1, len(labels))),
+                                   ('trial', trials, (n_trl, 1)),
+                                   ('time', times, (n_trl, 1))):
+            dset = ft.create_dataset(name, shape=shape, dtype=ref_dtype)
+            dset.attrs['MATLAB_class'] = bytes_('cell')
+            for i, one_cell in enumerate(cells):
+                dset[(0, i) if shape[0] == 1 else (i, 0)] = one_cell.ref
+
+        endsam = n_samples.cumsum()
+        _add_matlab(ft, 'sampleinfo', [endsam - n_samples + 1, endsam])
+        cfg = 'Converted from phypno on ' + str(datetime.now())
+        _add_matlab(ft, 'cfg', _to_char(cfg))
+
+    hdr = ('MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: ' +
+           datetime.now().strftime('%a %b %d %H:%M:%S %Y') +
+           ' HDF5 schema 1.00 .')
+    with open(filename, 'r+b') as f:
+        f.write(hdr.ljust(116).encode() + b' ' * 8 + b'\x00\x02IM')
+
+
+def _to_char(s):
+    """Convert str into MATLAB char (as uint16, transposed)."""
+    return asarray([ord(x) for x in s], dtype=uint16)[:, None]
+
+
+def _add_matlab(group, name, value):
+    """Add double or char (if uint16) matrix, already transposed, to a group
+    (struct or #refs#) of a MATLAB v7.3 file."""
+    value = asarray(value)
+    if value.dtype != uint16:
+        value = value.astype(float64)
+    dset = group.create_dataset(name, data=value)
+    if value.dtype == uint16:
+        dset.attrs['MATLAB_class'] = bytes_('char')
+        dset.attrs['MATLAB_int_decode'] = 2
+    else:
+        dset.attrs['MATLAB_class'] = bytes_('double')
+    return dset
@@ -1,16 +1,23 @@
 """explain sess behavior"""
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from os import remove, replace, utime, walk
+from os.path import getsize, join
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from threading import Lock
 from urllib.parse import urljoin
 from base64 import standard_b64encode
 from getpass import getpass
 import hashlib
 from xml.etree import ElementTree
 
-from numpy import array, fromstring, newaxis
+from numpy import array, empty, frombuffer, load, NaN, newaxis, save
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
 except ImportError as import_err:
     requests = import_err  # import_err is local to except-statement
 
@@ -20,23 +27,66 @@ URL_ID = '/services/timeseries/getIdByDataSnapshotName/'
 URL_DETAILS = '/services/timeseries/getDataSnapshotTimeSeriesDetails/'
 URL_DATA = '/services/timeseries/getUnscaledTimeSeriesSetBinaryRaw/'
 
+N_CONNECTIONS = 8  # max n of parallel requests (and of open connections)
+BLOCK_SIZE = 2 ** 15  # n of samples in each request (and in each cache file)
+# suggested directory for the blocks of data (see IEEG_org, cache_dir)
+CACHE_DIR = Path.home() / '.cache' / 'phypno' / 'ieeg_org'
+CACHE_SIZE = 2 ** 31  # max n of bytes in CACHE_DIR
+
 
 SESS = None
 
 
 class IEEG_org:
-
-    def __init__(self, name):
+    """Read the data from ieeg.org
+
+    Parameters
+    ----------
+    name : str
+        name of the dataset (snapshot) on ieeg.org
+    session : instance of Session
+        if None, it uses (or creates) the global session SESS
+    cache_dir : path to dir
+        directory where to store the blocks of data (if None, no cache). The
+        data of the patients remain on disk, so use it only on a computer
+        where it's allowed (f.e. CACHE_DIR).
+    cache_size : int
+        max number of bytes in cache_dir
+    prefetch : bool
+        when the data are read consecutively (for example, when scrolling),
+        start downloading the next window of data in the background
+
+    Notes
+    -----
+    The data are downloaded in blocks of BLOCK_SIZE samples, which are
+    requested in parallel and stored in the cache, one file for each channel
+    and block. Only the blocks of the current window and of the next window
+    are kept while they are downloaded.
+    """
+    def __init__(self, name, session=None, cache_dir=None,
+                 cache_size=CACHE_SIZE, prefetch=True):
         global SESS
-        if SESS is None:
-            SESS = Session()
-        self._sess = SESS
-
-        self.filename = name
-        self._snapshot = self._sess.get_snapshot(name)
+        if session is None:
+            if SESS is None:
+                SESS = Session()
+            session = SESS
+        self._sess = session
+
+        self.filename = str(name)
+        self._snapshot = self._sess.get_snapshot(self.filename)
         xml = self._sess.get_dataset(self._snapshot)
         self._details = ElementTree.fromstring(xml).find('details')
 
+        self._cache = None
+        if cache_dir is not None:
+            self._cache = DiskCache(cache_dir, cache_size)
+        self.prefetch = prefetch
+
+        self._pending = {}  # blocks which are being downloaded
+        self._executor = None  # threads which download the blocks
+        self._lock = Lock()
+        self._last_read = None  # begsam, endsam
+
     def return_hdr(self):
         chan_name = [chan.find('channelLabel').text for chan in self._details]
         factor = [float(chan.find('voltageConversionFactor').text) for chan in self._details]
@@ -48,6 +98,7 @@ class IEEG_org:
         s_freq = float(one_chan.find('sampleRate').text)
         self.s_freq = s_freq
         n_samples = int(one_chan.find('numberOfSamples').text)
+        self.n_samples = n_samples
         orig = self._details
 
         self._chan_id = array([chan.find('revisionId').text for chan in self._details])
@@ -55,12 +106,146 @@ class IEEG_org:
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
     def return_dat(self, chan, begsam, endsam):
-        """order of chan is taken into account by ieeg.org server"""
+        """order of chan is taken into account by ieeg.org server
+
+        The samples outside the recording are NaN. The blocks which are not in
+        the cache are downloaded in parallel.
+        """
+        chan_id = tuple(self._chan_id[chan].ravel())
+        dat = empty((len(chan_id), endsam - begsam))
+        dat.fill(NaN)
+
+        begrec = max((begsam, 0))
+        endrec = min((endsam, self.n_samples))
+
+        blocks = self._request_blocks(chan_id, begrec, endrec)
+
+        # when scrolling forward, download the next window
+        endnext = endrec
+        if (self.prefetch and self._last_read is not None and
+                self._last_read[0] < begsam <= self._last_read[1]):
+            endnext = endrec + endsam - begsam
+            self._request_blocks(chan_id, endrec, endnext)
+        self._last_read = begsam, endsam
+
+        for blk, future in blocks:
+            try:
+                blk_dat = future.result()
+            except Exception:
+                with self._lock:  # so that it's requested again
+                    self._pending.pop((chan_id, blk), None)
+                raise
+
+            blk0 = blk * BLOCK_SIZE
+            sel0 = max((begrec, blk0))
+            sel1 = min((endrec, blk0 + blk_dat.shape[1]))
+            dat[:, sel0 - begsam:sel1 - begsam] = \
+                blk_dat[:, sel0 - blk0:sel1 - blk0]
+
+        # keep only the last block of this window and the next window (the
+        # blocks which are still downloading are stored in the cache anyway)
+        first_blk = (endrec - 1) // BLOCK_SIZE
+        last_blk = (max((endnext, endrec)) - 1) // BLOCK_SIZE
+        with self._lock:
+            for key in [k for k in self._pending
+                        if k[0] != chan_id or
+                        not first_blk <= k[1] <= last_blk]:
+                del self._pending[key]
+
+        return dat
+
+    def return_markers(self):
+        return []
+
+    def close(self):
+        """Stop the downloads which have not started yet and the threads
+        (they are started again if you read the data)."""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            executor, self._executor = self._executor, None
+            self._last_read = None
+
+        if executor is not None:
+            executor.shutdown()
+
+    def _request_blocks(self, chan_id, begsam, endsam):
+        """Start downloading the blocks between two samples (if they are not
+        being downloaded already).
+
+        Returns
+        -------
+        list of tuple
+            index of the block and the future, whose result is the data of the
+            block (chan X samples)
+        """
+        endsam = min((endsam, self.n_samples))
+        if begsam >= endsam:
+            return []
+
+        blocks = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=N_CONNECTIONS)
+
+            for blk in range(begsam // BLOCK_SIZE,
+                             (endsam - 1) // BLOCK_SIZE + 1):
+                key = (chan_id, blk)
+                if key not in self._pending:
+                    self._pending[key] = self._executor.submit(
+                        self._read_block, chan_id, blk)
+                blocks.append((blk, self._pending[key]))
+
+        return blocks
+
+    def _read_block(self, chan_id, blk):
+        """Read one block of data, from the cache or from ieeg.org.
+
+        Parameters
+        ----------
+        chan_id : tuple of str
+            revision id of the channels to read
+        blk : int
+            index of the block
+
+        Returns
+        -------
+        numpy.ndarray
+            data of the block (chan X samples)
+        """
+        begsam = blk * BLOCK_SIZE
+        endsam = min((begsam + BLOCK_SIZE, self.n_samples))
+
+        dat = empty((len(chan_id), endsam - begsam))
+        to_download = []
+        for i, one_chan in enumerate(chan_id):
+            cached = None
+            if self._cache is not None:
+                cached = self._cache.get(self._cache_key(one_chan, blk))
+            if cached is None:
+                to_download.append(i)
+            else:
+                dat[i] = cached
+
+        if to_download:
+            chan_dl = [chan_id[i] for i in to_download]
+            dat[to_download] = self._download(chan_dl, begsam, endsam)
+            if self._cache is not None:
+                for i, one_chan in zip(to_download, chan_dl):
+                    self._cache.put(self._cache_key(one_chan, blk), dat[i])
+
+        return dat
+
+    def _cache_key(self, chan_id, blk):
+        return '_'.join((self._snapshot, chan_id, str(blk)))
+
+    def _download(self, chan_id, begsam, endsam):
         start = int(begsam / self.s_freq * 1000000)
         duration = int((endsam - begsam) / self.s_freq * 1000000)
         params = {'start': start, 'duration': duration}
 
-        xml_str = _prepare_xml_str(self._chan_id[chan])
+        xml_str = _prepare_xml_str(chan_id)
         r = self._sess.get_data(self._snapshot, params, xml_str)
 
         h = r.headers
@@ -69,19 +254,40 @@ class IEEG_org:
             raise ValueError('Not all channels have equal length')
         conv = array([float(x) for x in h['voltage-conversion-factors-mv'].split(',')])
 
-        dat = fromstring(r.content, dtype='>i4')
+        dat = frombuffer(r.content, dtype='>i4')
         n_smp = int(list(samples_per_row)[0])
         # TODO: should we use self._factor
         dat = dat.reshape(-1, n_smp) * conv[:, newaxis]
 
-        return dat
-
-    def return_markers(self):
-        return []
+        # the server might return a slightly different number of samples
+        out = empty((len(chan_id), endsam - begsam))
+        out.fill(NaN)
+        n_smp = min((n_smp, out.shape[1]))
+        out[:, :n_smp] = dat[:, :n_smp]
+        return out
 
 
 class Session:
-    def __init__(self, username=None, password=None, password_md5=None):
+    """Session to connect to ieeg.org, which keeps the connections open.
+
+    Parameters
+    ----------
+    username : str
+        ieeg.org username (if None, it's asked)
+    password : str
+        ieeg.org password (if None and password_md5 is None, it's asked)
+    password_md5 : str
+        MD5 hash of the password
+    host : str
+        server (it can be a local server with the same API, for testing)
+    http : str
+        'https://' or 'http://'
+    """
+    def __init__(self, username=None, password=None, password_md5=None,
+                 host=HOST, http=HTTP):
+        if isinstance(requests, BaseException):
+            raise requests  # import error
+
         if username is None:
             username = input('ieeg.org username:')
         self.username = username
@@ -94,6 +300,14 @@ class Session:
         elif password_md5:
             self.password = password_md5
 
+        self.host = host
+        self.http = http
+
+        self._http_sess = requests.Session()
+        adapter = HTTPAdapter(pool_connections=N_CONNECTIONS,
+                              pool_maxsize=N_CONNECTIONS)
+        self._http_sess.mount(http, adapter)
+
     def get_snapshot(self, name):
         return self._get_info(URL_ID + name)
 
@@ -108,8 +322,10 @@ class Session:
                    'timestamp': dtime,
                    'signature': sig,
                    'Content-Type': 'application/xml'}
-        url = urljoin(HTTP + HOST, path)
-        r = requests.post(url, headers=headers, params=params, data=xml_str)
+        url = urljoin(self.http + self.host, path)
+        r = self._http_sess.post(url, headers=headers, params=params,
+                                 data=xml_str)
+        r.raise_for_status()
         return r
 
     def _get_info(self, path):
@@ -118,12 +334,10 @@ class Session:
                    'timestamp': dtime,
                    'signature': sig,
                    'Content-Type': 'application/xml'}
-        url = urljoin(HTTP + HOST, path)
+        url = urljoin(self.http + self.host, path)
 
-        if isinstance(requests, BaseException):
-            raise requests  # import error
-
-        r = requests.get(url, headers=headers)
+        r = self._http_sess.get(url, headers=headers)
+        r.raise_for_status()
         return r.content.decode()
 
     def _make_signature(self, method, urlpath, params=None, xml_str=''):
@@ -134,11 +348,83 @@ class Session:
         params_str = '&'.join(k + '=' + str(v) for k, v in params.items())
 
         xml_str = _sha256(xml_str)
-        to_hash = (self.username, self.password, method, HOST, urlpath,
+        to_hash = (self.username, self.password, method, self.host, urlpath,
                    params_str, dtime, xml_str)
         return dtime, _sha256('\n'.join(to_hash))
 
 
+class DiskCache:
+    """Cache of arrays on disk, which removes the least recently used files
+    when it gets too large.
+
+    Parameters
+    ----------
+    directory : path to dir
+        directory where to store the arrays (one .npy file for each array)
+    max_size : int
+        max number of bytes in the directory
+
+    Notes
+    -----
+    The size of the cache is computed once, when it's created, so other
+    processes using the same directory might make it slightly larger than
+    max_size.
+    """
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+
+        self._lock = Lock()
+        self.size = sum(getsize(join(root, f))
+                        for root, _, files in walk(str(self.directory))
+                        for f in files)
+
+    def get(self, key):
+        """Return the array, or None if it's not in the cache."""
+        filename = self.directory / (key + '.npy')
+        try:
+            dat = load(str(filename))
+            utime(str(filename))  # recently used
+        except (OSError, ValueError):
+            return None
+        return dat
+
+    def put(self, key, dat):
+        """Store the array and remove old arrays if the cache is too large.
+        If the key is already in the cache, the array is replaced."""
+        with NamedTemporaryFile(dir=str(self.directory), suffix='.tmp',
+                                delete=False) as f:
+            save(f, dat)
+
+        filename = str(self.directory / (key + '.npy'))
+        with self._lock:
+            try:
+                old_size = getsize(filename)
+            except OSError:  # not in the cache
+                old_size = 0
+            replace(f.name, filename)
+
+            self.size += getsize(filename) - old_size
+            if self.size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used files until the cache is 90% of
+        max_size."""
+        files = sorted(self.directory.glob('*.npy'),
+                       key=lambda x: x.stat().st_mtime)
+        for filename in files:
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                size = filename.stat().st_size
+                remove(str(filename))
+            except OSError:
+                continue
+            self.size -= size
+
+
 def _prepare_xml_str(chan_id):
     XML_BEG = ('<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
                '<timeSeriesIdAndDChecks><timeSeriesIdAndDChecks>')
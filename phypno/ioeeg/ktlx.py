@@ -19,20 +19,37 @@ from binascii import hexlify
 from datetime import timedelta, datetime
 from logging import getLogger
 from math import ceil
+from os import replace
 from os.path import join
 from pathlib import Path
-from re import sub
-from struct import unpack
-from numpy import (array,
+from re import compile
+from struct import unpack, unpack_from
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from zipfile import BadZipFile
+from numpy import (add,
+                   arange,
                    asarray,
                    concatenate,
+                   cumsum,
                    dtype,
                    empty,
                    expand_dims,
+                   frombuffer,
                    fromfile,
+                   int8,
+                   int16,
                    int32,
+                   int64,
+                   lexsort,
+                   load,
                    NaN,
                    ones,
+                   savez,
+                   searchsorted,
+                   setdiff1d,
+                   uint8,
+                   unique,
                    unpackbits,
                    where,
                    )
@@ -47,6 +64,23 @@ HUNDREDS_OF_NANOSECONDS = 10000000
 
 START_TIME_TOL = 10
 
+# index of each erd file (stored next to it) and distance between checkpoints
+IDX_SUFFIX = '.phypno_idx'
+IDX_VERSION = 1
+CHECKPOINT_INTERVAL = 1024
+# the cumulative sum of the deltas is computed in blocks of rows of this size
+# (in bytes), which fit in the cache of the CPU
+CUMSUM_BLOCK = 256 * 1024
+
+# tokens of the notes in .ent (Excel list): "(.", "(", ")", ",", strings,
+# anything else (numbers or names) and unmatched quotes (until the end)
+ENT_TOKEN = compile(r'\(\.|[(),]|"[^"\\]*(?:\\.[^"\\]*)*"|[^\s(),"]+|".*')
+ENT_STAMP = compile(rb'"Stamp"\s*,\s*(-?\d+)')
+ENT_ESCAPE = compile(r'\\(.)')  # escaped characters in strings, f.e. \"
+ENT_CONTROL = {'n': '\n', 'r': '\r', 't': '\t'}
+ENT_HDR_LENGTH = 352
+ENT_NOTE_HDR_LENGTH = 16
+
 
 def get_date_idx(time_of_interest, start_time, end_time):
     idx = None
@@ -350,13 +384,20 @@ def _read_eeg(eeg_file):
     pass
 
 
-def _read_ent(ent_file):
+def _read_ent(ent_file, begsam=None, endsam=None, parse=True):
     """Read notes stored in .ent file.
 
-    This is a basic implementation, that relies on turning the information in
-    the string in the dict format, and then evaluate it. It's not very flexible
-    and it might not read some notes, but it's fast. I could not implement a
-    nice, recursive approach.
+    Parameters
+    ----------
+    ent_file : Path
+        path to the .ent file
+    begsam : int
+        only read the notes whose Stamp is at or after this sample
+    endsam : int
+        only read the notes whose Stamp is before this sample
+    parse : bool
+        convert the text of each note into 'value' (if False, only 'text' is
+        returned, which is much faster)
 
     Returns
     -------
@@ -366,55 +407,274 @@ def _read_ent(ent_file):
           - length : length of the note in B,
           - prev_length : length of the previous note in B,
           - unused,
-          - value : the actual content of the note.
+          - text : the content of the note, as str
+          - value : the content of the note, converted into dict.
+
+    Notes
+    -----
+    See _iter_ent for the format of the notes.
+    """
+    return list(_iter_ent(ent_file, begsam, endsam, parse))
+
+
+def _iter_ent(ent_file, begsam=None, endsam=None, parse=True):
+    """Iterate over the notes stored in .ent file, one note at the time.
+
+    Parameters
+    ----------
+    ent_file : Path
+        path to the .ent file
+    begsam : int
+        only read the notes whose Stamp is at or after this sample
+    endsam : int
+        only read the notes whose Stamp is before this sample
+    parse : bool
+        convert the text of each note into 'value'
+
+    Yields
+    ------
+    dict
+        one note (see _read_ent)
 
     Notes
     -----
     The notes are stored in a format called 'Excel list' but could not find
-    more information. It's based on "(" and "(.", and I found it very hard to
-    parse. With some basic regex and substitution, it can be evaluated into
-    a dict, with sub dictionaries. However, the note containing the name of the
-    electrodes (I think they called it "montage") cannot be parsed, because
-    it's too complicated. If it cannot be converted into a dict, the whole
-    string is passed as value.
+    more information. It's based on "(" (a list of values) and "(." (a pair
+    of key and value, or a list of pairs, which we convert into a dict). See
+    _parse_ent_note for the details. If the note cannot be parsed (for
+    example, the note containing the name of the electrodes), the whole string
+    is passed as value.
+
+    When selecting notes based on Stamp, only the notes with a Stamp are
+    returned and the notes outside the time range are not parsed.
     """
     with ent_file.open('rb') as f:
-        f.seek(352)  # end of header
+        ent = f.read()
+
+    pos = ENT_HDR_LENGTH
+    while pos + ENT_NOTE_HDR_LENGTH <= len(ent):
+        note = {}
+        (note['type'], note['length'], note['prev_length'],
+         note['unused']) = unpack_from('<4i', ent, pos)
+        if not note['type']:
+            break
+        # it ends with empty bytes
+        b = ent[pos + ENT_NOTE_HDR_LENGTH:pos + note['length'] - 2]
+        pos += note['length']
+
+        if begsam is not None or endsam is not None:
+            stamp = ENT_STAMP.search(b)
+            if stamp is None:
+                continue
+            stamp = int(stamp.group(1))
+            if ((begsam is not None and stamp < begsam) or
+                    (endsam is not None and stamp >= endsam)):
+                continue
+
+        s = b.decode('utf-8', errors='replace')
+        note['text'] = s
+        if parse:
+            try:
+                note['value'] = _parse_ent_note(s)
+            except (ValueError, IndexError, KeyError, TypeError):
+                note['value'] = s
+        yield note
 
-        note_hdr_length = 16
 
-        allnote = []
-        while True:
-            note = {}
-            note['type'], = unpack('<i', f.read(4))
-            note['length'], = unpack('<i', f.read(4))
-            note['prev_length'], = unpack('<i', f.read(4))
-            note['unused'], = unpack('<i', f.read(4))
-            if not note['type']:
-                break
-            s = f.read(note['length'] - note_hdr_length)
-            s = s[:-2]  # it ends with one empty byte
-            s = s.decode('utf-8', errors='replace')
-            s1 = s.replace('\n', ' ')
-            s1 = s1.replace('\\xd ', '')
-            s1 = s1.replace('(.', '{')
-            s1 = sub(r'\(([A-Za-z0-9," ]*)\)', r'[\1]', s1)
-            s1 = s1.replace(')', '}')
-            # s1 = s1.replace('",', '" :')
-            s1 = sub(r'(\{[\w"]*),', r'\1 :', s1)
-            s1 = s1.replace('{"', '"')
-            s1 = s1.replace('},', ',')
-            s1 = s1.replace('}}', '}')
-            s1 = sub(r'\(([0-9 ,-\.]*)\}', r'[\1]', s1)
+def _parse_ent_note(s):
+    """Parse one note in Excel list format in one pass.
+
+    Parameters
+    ----------
+    s : str
+        the text of the note
+
+    Returns
+    -------
+    dict
+        the content of the note, where strings and numbers are converted to
+        str, int and float and lists become lists.
+
+    Raises
+    ------
+    ValueError
+        if the note does not follow the format
+
+    Notes
+    -----
+    The format is:
+      - (."key", value) : one pair, which becomes {"key": value}
+      - (.(."key1", value1), (."key2", value2)) : which becomes one dict
+      - (value1, value2) : which becomes a list
+      - "text" : string
+      - 1, -1.5 : numbers (other names are returned as str)
+
+    Newlines are treated as spaces and \\xd (carriage return) is removed.
+    In strings, escaped characters are unescaped as in python (f.e. \\" and
+    \\n), as done by the previous parser, which used eval.
+    """
+    s = s.replace('\n', ' ').replace('\\xd ', '')
+
+    tokens = ENT_TOKEN.findall(s)
+    if not tokens or tokens[-1] != ')':
+        raise ValueError('Note should end with a closing parenthesis')
+
+    # each element of the stack is a list (for lists of values), a dict (for
+    # lists of pairs) or a tuple with the key (for a pair, waiting the value)
+    stack = []
+    output = None
+    i = 0
+    n_tokens = len(tokens)
+    while i < n_tokens:
+        token = tokens[i]
+        first = token[0]
+        i += 1
+
+        if token == '(.':
+            if (i + 1 < n_tokens and tokens[i][0] == '"' and
+                    tokens[i + 1] == ','):
+                stack.append((_unescape(tokens[i][1:-1]), ))
+                i += 2
+            else:
+                stack.append({})
+            continue
+
+        elif first == '(':
+            stack.append([])
+            continue
+
+        elif first == ',':
+            continue
+
+        elif first == ')':
+            value = stack.pop()
+            if isinstance(value, tuple):
+                if len(value) != 2:
+                    raise ValueError('Pair without value')
+                value = {value[0]: value[1]}
+
+        elif first == '"':
+            value = _unescape(token[1:-1])
+
+        else:
             try:
-                note['value'] = eval(s1)
-            except:
-                note['value'] = s
-            allnote.append(note)
-    return allnote
+                value = int(token)
+            except ValueError:
+                try:
+                    value = float(token)
+                except ValueError:
+                    value = token
+
+        if not stack:
+            if output is not None or not isinstance(value, dict):
+                raise ValueError('Note is not one dict')
+            output = value
+        elif isinstance(stack[-1], list):
+            stack[-1].append(value)
+        elif isinstance(stack[-1], dict):
+            stack[-1].update(value)  # fails if it's not a pair
+        elif len(stack[-1]) == 1:
+            stack[-1] += (value, )
+        else:
+            raise ValueError('Pair with more than one value')
+
+    if stack or output is None:
+        raise ValueError('Missing closing parenthesis')
+
+    return output
+
+
+def _unescape(s):
+    """Remove the backslash before escaped characters in one string."""
+    if '\\' not in s:
+        return s
+    return ENT_ESCAPE.sub(lambda m: ENT_CONTROL.get(m.group(1), m.group(1)),
+                          s)
+
+
+def _read_byte_pairs(buf):
+    """Read each byte together with the next one, as little-endian int16.
+
+    Parameters
+    ----------
+    buf : bytes
+        content of the packet
+
+    Returns
+    -------
+    ndarray of int16
+        vector as long as buf, so that the 2-byte deltas can be read with one
+        index (the last byte is paired with zero).
+    """
+    raw = frombuffer(buf + b'\x00', dtype=uint8).astype(int16)
+    return raw[:-1] | (raw[1:] << BITS_IN_BYTE)
+
+
+def _read_deltas(raw, smp_pos, n_allchan):
+    """Read the delta mask and the delta information of many samples at once.
+
+    Parameters
+    ----------
+    raw : ndarray of int16
+        content of the packet, where each value is made of one byte and the
+        next one (little endian)
+    smp_pos : ndarray of int
+        index (in raw) of the event byte of each sample
+    n_allchan : int
+        number of channels (we should specify if shorted or not)
+
+    Returns
+    -------
+    deltamask : ndarray of bool
+        2d matrix (samples x channels), True if the delta uses 2 bytes
+    delta : ndarray of int16
+        2d matrix (samples x channels) with the deltas
+    n_bytes : ndarray of int
+        length in bytes of the delta information of each sample
+    """
+    l_deltamask = int(ceil(n_allchan / BITS_IN_BYTE))
+
+    byte_deltamask = raw[smp_pos[:, None] + arange(1, 1 + l_deltamask)]
+    deltamask = unpackbits(byte_deltamask.astype(uint8), axis=1,
+                           bitorder='little')
+    deltamask = deltamask[:, :n_allchan].view(bool)
+
+    width = deltamask + int16(1)
+    offset = cumsum(width, axis=1, dtype=int16)
+    n_bytes = offset[:, -1].copy()
+    offset -= width
+    offset = (smp_pos + 1 + l_deltamask).astype(int32)[:, None] + offset
+
+    delta = raw.take(offset)
+    delta = where(deltamask, delta, delta.astype(int8))
+
+    return deltamask, delta, n_bytes
+
+
+def _cumsum_rows(x):
+    """Cumulative sum over the rows of a 2d matrix, in place.
+
+    Parameters
+    ----------
+    x : ndarray of int32
+        2d matrix (samples x channels)
+
+    Notes
+    -----
+    numpy.cumsum along the first axis is slow for large matrices, because it
+    goes through one column at the time. Each block of rows fits in the cache,
+    then the last row of the previous block is added to the next block.
+    """
+    n_rows = max(CUMSUM_BLOCK // max(x.strides[0], 1), 1)
+    for i in range(0, x.shape[0], n_rows):
+        block = x[i:i + n_rows]
+        cumsum(block, axis=0, dtype=int32, out=block)
+        if i > 0:
+            block += x[i - 1]
 
 
-def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
+def _read_packet(f, pos, n_smp, n_allchan, abs_delta, prev=None,
+                 return_pos=False):
     """
     Read a packet of compressed data
 
@@ -433,14 +693,36 @@ def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
         if the delta has this value, it means that you should read the absolute
         value at the end of packet. If schema is 7, the length is 1; if schema
         is 8 or 9, the length is 2.
+    prev : ndarray, optional
+        values of the sample before pos, if pos is not the start of the packet
+        (f.e. one of the checkpoints)
+    return_pos : bool
+        whether to return the position of each sample in the file
 
     Returns
     -------
     ndarray
         data read in the packet up to n_smp.
+    ndarray
+        index of the first byte of each sample in the file (only if
+        return_pos is True)
 
     Notes
     -----
+    The packet is read in one go and decoded in windows of samples. In each
+    window, we first find where each sample starts, based on the number of
+    bits in the delta mask (this is the only loop over samples and it doesn't
+    decode anything). This assumes that there are no absolute values in the
+    window. Then, the deltas of all the samples in the window are decoded at
+    once. If one sample has absolute values, we only keep the samples up to
+    that one and the next window starts after its absolute values. The window
+    grows as long as there are no absolute values (usually, only the first
+    sample of the packet has absolute values).
+
+    Finally, the values are reconstructed with a cumulative sum, which
+    restarts at each absolute value. The values before the first absolute
+    value of a channel are relative to prev (or to zero).
+
     TODO: shorted chan. If I remember correctly, deltamask includes all the
     channels, but the absolute values are only used for not-shorted channels
 
@@ -453,43 +735,133 @@ def _read_packet(f, pos, n_smp, n_allchan, abs_delta):
         abs_delta = unpack('h', abs_delta)[0]
 
     l_deltamask = int(ceil(n_allchan / BITS_IN_BYTE))
-    dat = empty((n_allchan, n_smp), dtype=int32)
-    f.seek(pos)
+    all_chan_bits = (1 << n_allchan) - 1
+    # length of one sample, without 2-byte deltas and absolute values
+    l_sample = 1 + l_deltamask + n_allchan
+    max_smp_length = l_sample + n_allchan
 
-    for i_smp in range(n_smp):
-        eventbite = f.read(1)
+    f.seek(pos)
+    buf = f.read(n_smp * max_smp_length + 4 * n_allchan)
+    raw = _read_byte_pairs(buf)
+
+    delta = empty((n_smp, n_allchan), dtype=int32)
+    all_pos = empty(n_smp, dtype=int64)
+    abs_smp = []
+    abs_chan = []
+    abs_value = []
+
+    i = 0  # position in buf
+    i_smp = 0
+    n_window = 1  # the first sample usually has absolute values
+    while i_smp < n_smp:
+        n_window = min(n_window, n_smp - i_smp)
+
+        smp_pos = []
+        i_start = i
+        n_buf = len(buf)
+        for i_win in range(n_window):
+            deltamask = int.from_bytes(buf[i + 1:i + 1 + l_deltamask],
+                                       'little')
+            end_smp = i + l_sample + bin(deltamask & all_chan_bits).count('1')
+            if end_smp > n_buf:
+                break
+            smp_pos.append(i)
+            i = end_smp
+
+        more_bytes = not smp_pos
+        if smp_pos:
+            smp_pos = asarray(smp_pos)
+            deltamask, win_delta, n_bytes = _read_deltas(raw, smp_pos,
+                                                         n_allchan)
+            win_abs = deltamask & (win_delta == abs_delta)
+            with_abs = where(win_abs.any(axis=1))[0]
+            if len(with_abs) > 0:  # the absolute values should be in buf
+                i_win = with_abs[0]
+                more_bytes = (smp_pos[i_win] + 1 + l_deltamask +
+                              n_bytes[i_win] + 4 * win_abs[i_win].sum() >
+                              n_buf)
+
+        # buf is usually long enough, unless there are many absolute values
+        if more_bytes:
+            more = f.read(n_window * max_smp_length + 4 * n_allchan)
+            if not more:
+                raise EOFError('at pos ' + str(i_smp) + ', the packet is '
+                               'shorter than ' + str(n_smp) + ' samples')
+            buf += more
+            raw = _read_byte_pairs(buf)
+            i = i_start
+            continue
+
+        if len(with_abs) == 0:
+            n_read = len(smp_pos)
+            n_window *= 2
 
-        try:
-            assert eventbite in (b'\x00', b'\x01')
-        except:
-            raise Exception('at pos ' + str(i_smp) +
+        else:
+            i_win = with_abs[0]
+            n_read = i_win + 1
+            n_window = 2 * n_read
+
+            chan_abs = where(win_abs[i_win])[0]
+            i = int(smp_pos[i_win] + 1 + l_deltamask + n_bytes[i_win])
+            abs_smp.extend([i_smp + i_win] * len(chan_abs))
+            abs_chan.extend(chan_abs)
+            abs_value.extend(unpack_from('<' + 'i' * len(chan_abs), buf, i))
+            i += 4 * len(chan_abs)
+
+        # only samples before the absolute values are in the correct position
+        eventbite = raw[smp_pos[:n_read]] & 0xff
+        if (eventbite > 1).any():
+            i_win = where(eventbite > 1)[0][0]
+            raise Exception('at pos ' + str(i_smp + i_win) +
                             ', eventbite (should be x00 or x01): ' +
-                            str(eventbite))
-
-        byte_deltamask = unpack('<' + 'B' * l_deltamask, f.read(l_deltamask))
-        deltamask = unpackbits(array(byte_deltamask[::-1], dtype ='uint8'))
-        deltamask = deltamask[:-n_allchan-1:-1]
-
-        n_bytes = int(deltamask.sum()) + deltamask.shape[0]
-
-        deltamask = deltamask.astype('bool')
-        # numpy has a weird way of handling string/bytes.
-        # We create a byte representation, because then tostring() works fine
-        delta_dtype = empty(n_allchan, dtype='a1')
-        delta_dtype[deltamask] = 'h'
-        delta_dtype[~deltamask] = 'b'
-        relval = array(unpack('<' + delta_dtype.tostring().decode(),
-                              f.read(n_bytes)))
+                            str(buf[smp_pos[i_win]:smp_pos[i_win] + 1]))
+
+        delta[i_smp:i_smp + n_read] = win_delta[:n_read]
+        all_pos[i_smp:i_smp + n_read] = smp_pos[:n_read] + pos
+        i_smp += n_read
+
+    # replace each absolute value with the jump from the previous value
+    # (integer overflow is fine, it wraps around as in int32 arithmetic)
+    abs_smp = asarray(abs_smp, dtype=int64)
+    abs_chan = asarray(abs_chan, dtype=int64)
+    abs_value = asarray(abs_value, dtype=int32)
+    delta[abs_smp, abs_chan] = 0
+    if prev is not None and n_smp > 0:
+        # channels with an absolute value in the first sample don't use prev
+        first = prev.astype(int32)
+        first[abs_chan[abs_smp == 0]] = 0
+        delta[0] += first
+
+    # value before the jump, i.e. sum of the deltas up to that sample (the
+    # samples after the last absolute value are not needed)
+    smp_with_abs = unique(abs_smp)
+    if len(smp_with_abs) > 0:
+        seg = concatenate(([0], smp_with_abs[:-1] + 1))
+        before_abs = cumsum(add.reduceat(delta[:smp_with_abs[-1] + 1], seg,
+                                         axis=0, dtype=int32),
+                            axis=0, dtype=int32)
+        jump = abs_value - before_abs[searchsorted(smp_with_abs, abs_smp),
+                                      abs_chan]
+    else:
+        jump = abs_value
 
-        read_abs = (delta_dtype == b'h') & (relval == abs_delta)
+    # absolute values are sorted by sample, then by channel
+    by_chan = lexsort((abs_smp, abs_chan))
+    jump = jump[by_chan]
+    same_chan = abs_chan[by_chan][1:] == abs_chan[by_chan][:-1]
+    jump[1:][same_chan] -= jump[:-1][same_chan]
+    delta[abs_smp[by_chan], abs_chan[by_chan]] = jump
 
-        dat[~read_abs, i_smp] = dat[~read_abs, i_smp - 1] + relval[~read_abs]
-        dat[read_abs, i_smp] = fromfile(f, 'i', count=read_abs.sum())
+    _cumsum_rows(delta)
+    dat = delta.T
 
-    return dat
+    if return_pos:
+        return dat, all_pos
+    else:
+        return dat
 
 
-def _read_erd(erd_file, begsam, endsam):
+def _read_erd(erd_file, begsam, endsam, erd_idx=None, lock=None):
     """Read the raw data and return a matrix, converted to microvolts.
 
     Parameters
@@ -500,6 +872,12 @@ def _read_erd(erd_file, begsam, endsam):
         index of the first sample to read
     endsam : int
         index of the last sample (excluded, per python convention)
+    erd_idx : dict, optional
+        index of the erd file (see _read_erd_index). If not specified, it's
+        read from disk (or created).
+    lock : instance of threading.Lock, optional
+        lock of erd_idx, if many threads read the same erd file with the same
+        index. The checkpoints are only looked up and added while holding it.
 
     Returns
     -------
@@ -545,19 +923,27 @@ def _read_erd(erd_file, begsam, endsam):
 
     About the actual implementation, we always follow the python convention
     that the first sample is included and the last sample is not.
+
+    Packets are decoded from the closest checkpoint before begsam (or from the
+    beginning of the packet) and new checkpoints are added to the index while
+    decoding.
     """
-    hdr = _read_hdr_file(erd_file)
-    n_allchan = hdr['num_channels']
-    shorted = hdr['shorted']  # does this exist for Schema 7 at all?
+    if erd_idx is None:
+        erd_idx = _read_erd_index(erd_file)
+    if lock is None:
+        lock = Lock()
+
+    n_allchan = int(erd_idx['num_channels'])
+    shorted = erd_idx['shorted']  # does this exist for Schema 7 at all?
     n_shorted = sum(shorted)
     if n_shorted > 0:
         raise NotImplementedError('shorted channels not tested yet')
 
-    if hdr['file_schema'] in (7,):
+    if erd_idx['file_schema'] in (7,):
         abs_delta = b'\x80'  # one byte: 10000000
         raise NotImplementedError('schema 7 not tested yet')
 
-    if hdr['file_schema'] in (8, 9):
+    if erd_idx['file_schema'] in (8, 9):
         abs_delta = b'\xff\xff'
 
     n_smp = endsam - begsam
@@ -565,7 +951,7 @@ def _read_erd(erd_file, begsam, endsam):
     data.fill(NaN)
 
     # it includes the sample in both cases
-    etc = _read_etc(erd_file.with_suffix('.etc'))
+    etc = erd_idx['etc']
     all_beg = etc['samplestamp']
     all_end = etc['samplestamp'] + etc['sample_span'] - 1
 
@@ -575,6 +961,7 @@ def _read_erd(erd_file, begsam, endsam):
     except IndexError:
         return data
 
+    new_checkpoint = False
     with erd_file.open('rb') as f:
         for rec in range(begrec, endrec + 1):
 
@@ -589,10 +976,23 @@ def _read_erd(erd_file, begsam, endsam):
             d1 = begpos_rec + all_beg[rec] - begsam
             d2 = endpos_rec + all_beg[rec] - begsam
 
-            dat = _read_packet(f, etc['offset'][rec], endpos_rec, n_allchan,
-                               abs_delta)
-            data[:, d1:d2] = dat[:, begpos_rec:endpos_rec]
+            with lock:
+                first_smp, pos, prev = _find_checkpoint(erd_idx, rec,
+                                                        begpos_rec)
+            dat, smp_pos = _read_packet(f, pos, endpos_rec - first_smp,
+                                        n_allchan, abs_delta, prev=prev,
+                                        return_pos=True)
+            data[:, d1:d2] = dat[:, begpos_rec - first_smp:
+                                 endpos_rec - first_smp]
+
+            with lock:
+                if _add_checkpoints(erd_idx, rec, first_smp, dat, smp_pos):
+                    new_checkpoint = True
 
+    if new_checkpoint:
+        with lock:
+            erd_idx_copy = dict(erd_idx)
+        _write_erd_index(erd_file, erd_idx_copy)
 
     # fill up the output data, put NaN for shorted channels
     if n_shorted > 0:
@@ -603,8 +1003,170 @@ def _read_erd(erd_file, begsam, endsam):
     else:
         output = data
 
-    factor = _calculate_conversion(hdr)
-    return expand_dims(factor, 1) * output
+    return expand_dims(erd_idx['factor'], 1) * output
+
+
+def _read_erd_index(erd_file):
+    """Read the index of one erd file, or create it if it's missing or old.
+
+    Parameters
+    ----------
+    erd_file : Path
+        one of the .erd files
+
+    Returns
+    -------
+    dict
+        - erd_size, erd_mtime : size and modification time of the erd file
+          when the index was created
+        - file_schema, num_channels, shorted : from the header of the erd file
+        - factor : conversion factor for each channel
+        - etc : the table of content (see _read_etc)
+        - cp_rec, cp_smp, cp_pos, cp_prev : checkpoints, i.e. the packet, the
+          sample in the packet, the position in the file and the values of the
+          previous sample
+
+    Notes
+    -----
+    The index is stored next to the erd file (with the same name and the
+    extension in IDX_SUFFIX), so that the headers, the table of content and
+    the checkpoints are only read once per recording. Checkpoints are added
+    every CHECKPOINT_INTERVAL samples of a packet, when the packet is decoded
+    for the first time, so that the next time we don't need to decode the
+    packet from the beginning.
+    """
+    idx_file = erd_file.with_suffix(IDX_SUFFIX)
+    erd_stat = erd_file.stat()
+
+    try:
+        with idx_file.open('rb') as f, load(f) as npz:
+            erd_idx = {k: npz[k] for k in npz.files}
+
+    except (FileNotFoundError, PermissionError):
+        pass
+
+    except (OSError, ValueError, BadZipFile):
+        lg.warning('Could not read index ' + str(idx_file))
+
+    else:
+        if (erd_idx['version'] == IDX_VERSION and
+            erd_idx['erd_size'] == erd_stat.st_size and
+            erd_idx['erd_mtime'] == erd_stat.st_mtime):
+            return erd_idx
+
+    hdr = _read_hdr_file(erd_file)
+    n_allchan = hdr['num_channels']
+    erd_idx = {'version': IDX_VERSION,
+               'erd_size': erd_stat.st_size,
+               'erd_mtime': erd_stat.st_mtime,
+               'file_schema': hdr['file_schema'],
+               'num_channels': n_allchan,
+               'shorted': asarray(hdr.get('shorted', ()), dtype=int64),
+               'factor': _calculate_conversion(hdr),
+               'etc': _read_etc(erd_file.with_suffix('.etc')),
+               'cp_rec': empty(0, dtype=int64),
+               'cp_smp': empty(0, dtype=int64),
+               'cp_pos': empty(0, dtype=int64),
+               'cp_prev': empty((0, n_allchan), dtype=int32),
+               }
+    _write_erd_index(erd_file, erd_idx)
+
+    return erd_idx
+
+
+def _write_erd_index(erd_file, erd_idx):
+    """Write the index of one erd file, if the directory is writable.
+
+    The index is first written to a temporary file and then renamed, so that
+    it's never incomplete when many threads or processes read the same file.
+    """
+    idx_file = erd_file.with_suffix(IDX_SUFFIX)
+    tmp_file = None
+    try:
+        with NamedTemporaryFile(dir=str(idx_file.parent), suffix=IDX_SUFFIX,
+                                delete=False) as f:
+            tmp_file = Path(f.name)
+            savez(f, **erd_idx)
+        replace(str(tmp_file), str(idx_file))
+        tmp_file = None
+    except OSError:
+        lg.debug('Could not write index ' + str(idx_file))
+    finally:
+        if tmp_file is not None:
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
+
+
+def _find_checkpoint(erd_idx, rec, begpos_rec):
+    """Find the closest checkpoint before a sample in a packet.
+
+    Parameters
+    ----------
+    erd_idx : dict
+        index of the erd file
+    rec : int
+        index of the packet in the table of content
+    begpos_rec : int
+        first sample of interest, in the packet
+
+    Returns
+    -------
+    int
+        sample of the checkpoint in the packet (0 for beginning of packet)
+    int
+        position of the sample in the erd file
+    ndarray or None
+        values of the sample before the checkpoint
+    """
+    cp = where((erd_idx['cp_rec'] == rec) &
+               (erd_idx['cp_smp'] <= begpos_rec))[0]
+    if len(cp) == 0:
+        return 0, int(erd_idx['etc']['offset'][rec]), None
+
+    i_cp = cp[erd_idx['cp_smp'][cp].argmax()]
+    return (int(erd_idx['cp_smp'][i_cp]), int(erd_idx['cp_pos'][i_cp]),
+            erd_idx['cp_prev'][i_cp])
+
+
+def _add_checkpoints(erd_idx, rec, first_smp, dat, smp_pos):
+    """Add checkpoints to the index, based on the samples of one packet.
+
+    Parameters
+    ----------
+    erd_idx : dict
+        index of the erd file (it's modified in place, so the caller should
+        hold the lock of the index, if it's shared between threads)
+    rec : int
+        index of the packet in the table of content
+    first_smp : int
+        sample in the packet of the first sample in dat
+    dat : ndarray
+        values (channels x samples) as read from the packet
+    smp_pos : ndarray
+        position of each sample in the erd file
+
+    Returns
+    -------
+    bool
+        whether new checkpoints were added
+    """
+    end_smp = first_smp + dat.shape[1]
+    cp_smp = arange(CHECKPOINT_INTERVAL, end_smp, CHECKPOINT_INTERVAL)
+    cp_smp = cp_smp[cp_smp > first_smp]
+    cp_smp = setdiff1d(cp_smp, erd_idx['cp_smp'][erd_idx['cp_rec'] == rec])
+    if len(cp_smp) == 0:
+        return False
+
+    erd_idx['cp_rec'] = concatenate((erd_idx['cp_rec'],
+                                     ones(len(cp_smp), dtype=int64) * rec))
+    erd_idx['cp_smp'] = concatenate((erd_idx['cp_smp'], cp_smp))
+    erd_idx['cp_pos'] = concatenate((erd_idx['cp_pos'],
+                                     smp_pos[cp_smp - first_smp]))
+    erd_idx['cp_prev'] = concatenate((erd_idx['cp_prev'],
+                                      dat[:, cp_smp - first_smp - 1].T))
+    return True
 
 
 def _read_etc(etc_file):
@@ -840,6 +1402,34 @@ class Ktlx():
         self.filename = ktlx_dir
         self._filename = None  # Path of dir and filename stem
         self._hdr = self._read_hdr_dir()
+        self._erd_idx = {}  # index of each erd file, once it's read
+        self._idx_lock = {}  # lock of the index of each erd file
+        self._lock = Lock()  # to add the index of a new erd file
+
+    def __getstate__(self):
+        """Do not pickle the locks, they are created again."""
+        state = self.__dict__.copy()
+        del state['_idx_lock']
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._idx_lock = {erd_file: Lock() for erd_file in self._erd_idx}
+        self._lock = Lock()
+
+    def _index(self, erd_file):
+        """Return the index of one erd file and its lock.
+
+        The index is read (or created) the first time. The same index is
+        shared by all the threads which read the erd file, so it should only
+        be changed while holding the lock (see _read_erd).
+        """
+        with self._lock:
+            if erd_file not in self._erd_idx:
+                self._erd_idx[erd_file] = _read_erd_index(erd_file)
+                self._idx_lock[erd_file] = Lock()
+            return self._erd_idx[erd_file], self._idx_lock[erd_file]
 
     def _read_hdr_dir(self):
         """Read the header for basic information.
@@ -917,11 +1507,15 @@ class Ktlx():
         actual acquisition starts. STC takes the offset into account. This has
         the counterintuitive result that if you call read_data, the first few
         hundreds samples are nan.
+
+        The stamps of the STC file are the ones read when opening the dataset
+        and the index of each erd file is kept in memory after the first time
+        (see _read_erd_index).
         """
         dat = empty((len(chan), endsam - begsam))
         dat.fill(NaN)
 
-        stc, all_stamp = _read_stc(self._filename.with_suffix('.stc'))
+        all_stamp = self._hdr['stamps']
 
         all_erd = all_stamp['segment_name'].astype('U')  # convert to str
         all_beg = all_stamp['start_stamp']
@@ -946,13 +1540,19 @@ class Ktlx():
             erd_file = (Path(self.filename) / all_erd[rec]).with_suffix('.erd')
 
             try:
-                dat_rec = _read_erd(erd_file, begpos_rec, endpos_rec)
+                erd_idx, lock = self._index(erd_file)
+                dat_rec = _read_erd(erd_file, begpos_rec, endpos_rec,
+                                    erd_idx, lock)
                 dat[:, d1:d2] = dat_rec[chan, :]
             except (FileNotFoundError, PermissionError):
                 lg.warning('{} does not exist'.format(erd_file))
 
         return dat
 
+    def return_segments(self):
+        """Return the first sample of each erd file (see Dataset.read_data)."""
+        return self._hdr['stamps']['start_stamp']
+
     def return_hdr(self):
         """Return the header for further use.
 
@@ -989,7 +1589,8 @@ class Ktlx():
             ent_file = self._filename.with_suffix('.ent')
             if not ent_file.exists():
                 ent_file = self._filename.with_suffix('.ent.old')
-            ent_notes = _read_ent(ent_file)
+            # only the text is needed to find the channel names
+            ent_notes = _read_ent(ent_file, parse=False)
         except (FileNotFoundError, PermissionError):
             lg.warning('could not find .ent file, channels have arbitrary '
                        'names')
@@ -999,7 +1600,7 @@ class Ktlx():
             # use the last montage, hoping that it's the most accurate
             for ent_note in reversed(ent_notes):
                 try:
-                    chan_name = _find_channels(ent_note['value'])
+                    chan_name = _find_channels(ent_note['text'])
                     chan_name = chan_name[:orig['num_channels']]
                 except:
                     continue
@@ -1020,15 +1621,35 @@ class Ktlx():
 
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
-    def return_markers(self):
+    def return_markers(self, begtime=None, endtime=None):
         """Reads the notes of the Ktlx recordings.
+
+        Parameters
+        ----------
+        begtime : float
+            only read the notes at or after this time (in s)
+        endtime : float
+            only read the notes before this time (in s)
+
+        Returns
+        -------
+        list of dict
+            where each dict contains 'name' as str, 'start' and 'end' as float
+            in seconds from the start of the recordings, and 'chan' as None.
         """
         ent_file = self._filename.with_suffix('.ent')
         if not ent_file.exists():
             ent_file = self._filename.with_suffix('.ent.old')
 
+        s_freq = self._hdr['erd']['sample_freq']
+        begsam = endsam = None
+        if begtime is not None:
+            begsam = ceil(begtime * s_freq)
+        if endtime is not None:
+            endsam = ceil(endtime * s_freq)
+
         try:
-            ent_notes = _read_ent(ent_file)
+            ent_notes = _read_ent(ent_file, begsam, endsam)
 
         except (FileNotFoundError, PermissionError):
             markers = []
@@ -1043,7 +1664,6 @@ class Ktlx():
                     lg.debug('Note of length {} was not '
                              'converted to dict'.format(n['length']))
 
-            s_freq = self._hdr['erd']['sample_freq']
             pcname = '0CFEBE72-DA20-4b3a-A8AC-CDD41BFE2F0D'
             note_time = []
             note_name = []
@@ -2,16 +2,19 @@ from os import SEEK_SET, SEEK_END
 from datetime import datetime
 from struct import unpack
 
-from numpy import fromfile
+from numpy import asarray, fromfile, memmap
 
-units = {-1: -1e9,  # nV
-         0: -1e6,  # uV,
-         1: -1e3,  # mV
-         2: 1,
-         100: 100,  # percent
+from .utils import read_range
+
+# convert the units to uV (the other units are not converted)
+units = {-1: 1e-3,  # nV
+         0: 1,  # uV,
+         1: 1e3,  # mV
+         2: 1e6,  # V
+         100: 1,  # percent
          101: 1,  # dimentionless
          102: 1,  # dimentionless
-        }
+         }
 
 class Micromed:
     """Basic class to read the data.
@@ -24,6 +27,14 @@ class Micromed:
     def __init__(self, filename):
         self.filename = filename
 
+        self._memmap = None
+
+    def __getstate__(self):
+        """Do not pickle the memmap, it's opened again when necessary."""
+        state = self.__dict__.copy()
+        state['_memmap'] = None
+        return state
+
     def return_hdr(self):
         """Return the header for further use.
 
@@ -76,7 +87,15 @@ class Micromed:
             EOData = f.tell()
             n_samples = int((EOData - BOData) / (n_chan * N_BYTES))
 
-            chan_name =  _read_channels(f, n_chan, order, zones)[0]
+            chan_name, ground, factor = _read_channels(f, n_chan, order,
+                                                       zones)[:3]
+
+        self._BOData = BOData
+        self._n_bytes = N_BYTES
+        self._n_chan = n_chan
+        self._n_samples = n_samples
+        self._ground = asarray(ground, dtype='float64')[:, None]
+        self._factor = asarray(factor, dtype='float64')[:, None]
 
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
@@ -95,21 +114,34 @@ class Micromed:
         Returns
         -------
         numpy.ndarray
-            A 2d matrix, with dimension chan X samples
+            A 2d matrix, with dimension chan X samples. The samples outside the
+            data are NaN.
+
+        Notes
+        -----
+        The samples (of 1, 2 or 4 bytes) are memory-mapped the first time that
+        you read the data (until close()). The selected samples are copied
+        once into the output and then calibrated for all the channels at
+        once.
         """
-        if begsam < 0:
-            begpad = -1 * begsam
-            begsam = 0
-        else:
-            begpad = 0
+        if self._memmap is None:
+            self._memmap = memmap(str(self.filename),
+                                  dtype='<u' + str(self._n_bytes), mode='r',
+                                  offset=self._BOData,
+                                  shape=(self._n_samples, self._n_chan))
+
+        if isinstance(chan, int):
+            chan = [chan, ]
+
+        dat = read_range(self._memmap.T, chan, begsam, endsam)
+        dat -= self._ground[chan]
+        dat *= self._factor[chan]
 
-        if endsam > self.n_smp:
-            endpad = endsam - self.n_smp
-            endsam = self.n_smp
-        else:
-            endpad = 0
+        return dat
 
-        return None
+    def close(self):
+        """Release the memmap of the data."""
+        self._memmap = None
 
     def return_markers(self):
         """Return all the markers (also called triggers or events).
@@ -132,29 +164,56 @@ class Micromed:
 
 
 def _read_channels(f, n_chan, order, zones):
+    """Read the information about the channels.
+
+    Parameters
+    ----------
+    f : file
+        the TRC file, open in binary mode
+    n_chan : int
+        number of channels
+    order : numpy.ndarray
+        index of each channel in the LABCOD zone
+    zones : dict
+        position and length of each zone in the header
+
+    Returns
+    -------
+    list of str
+        name of the channels
+    list of int
+        logical ground of each channel
+    list of float
+        calibration factor of each channel, in uV (when applicable)
+    list of int
+        sampling rate of each channel
+    """
     chan_names = []
+    all_ground = []
+    all_factor = []
     all_s_freq = []
 
+    pos, length = zones['LABCOD']
     for c in range(n_chan):
-        pos, length = zones['LABCOD']
         f.seek(pos + order[c] * 128, 0)
 
         chan_name = f.read(6).strip(b"\x00").decode()
         chan_names.append(chan_name)
-        ground = f.read(6).strip(b"\x00").decode()
+        f.read(6)  # ground electrode
 
-        logical_min, logical_max, logical_ground, physical_min, physical_max = unpack('iiiii', f.read(20))
-        factor = float(physical_max - physical_min) / float( logical_max - logical_min + 1)
+        (logical_min, logical_max, logical_ground, physical_min,
+         physical_max) = unpack('iiiii', f.read(20))
+        factor = (float(physical_max - physical_min) /
+                  float(logical_max - logical_min + 1))
 
         k = unpack('h', f.read(2))[0]
-        if k in units.keys():
-            unit = units[k]
-        else:
-            unit = units[0]
+        unit = units.get(k, units[0])
+
+        all_ground.append(logical_ground)
+        all_factor.append(factor * unit)
 
         f.seek(8, 1)
         s_rate = unpack('H', f.read(2))[0]
         all_s_freq.append(s_rate)
 
-        # signal = (rawdata[:, c].astype('f') - logical_ground) * factor * unit
-    return chan_names,  factor, unit, all_s_freq
+    return chan_names, all_ground, all_factor, all_s_freq
@@ -2,7 +2,9 @@ from os.path import getsize, join
 from xml.etree.ElementTree import parse
 from datetime import datetime, timedelta, timezone
 
-from numpy import NaN, pad, reshape, zeros
+from numpy import memmap, NaN, pad
+
+from .utils import read_int24
 
 TIMEZONE = timezone.utc
 # 24bit precision
@@ -125,16 +127,9 @@ class Moberg:
         else:
             endpad = 0
 
-        first_sam = DATA_PRECISION * self.n_chan * begsam
-        toread_sam = DATA_PRECISION * self.n_chan * (endsam - begsam)
-
-        with open(join(self.filename, EEG_FILE), 'rb') as f:
-            f.seek(first_sam)
-            x = f.read(toread_sam)
-
-        dat = _read_dat(x)
-        dat = reshape(dat, (self.n_chan, -1), 'F')
-        dat = self.convertion(dat[chan, :])
+        x = memmap(join(self.filename, EEG_FILE), dtype='u1', mode='r',
+                   shape=(self.n_smp, self.n_chan, DATA_PRECISION))
+        dat = self.convertion(read_int24(x[begsam:endsam, chan]).T)
         dat = pad(dat, ((0, 0), (begpad, endpad)),
                   mode='constant', constant_values=NaN)
 
@@ -159,30 +154,3 @@ class Moberg:
         markers = []
         return markers
 
-
-def _read_dat(x):
-    """read 24bit binary data and convert them to numpy.
-
-    Parameters
-    ----------
-    x : bytes
-        bytes (length should be divisible by 3)
-
-    Returns
-    -------
-    numpy vector
-        vector with the signed 24bit values
-
-    Notes
-    -----
-    It's pretty slow but it's pretty a PITA to read 24bit as far as I can tell.
-    """
-    n_smp = int(len(x) / DATA_PRECISION)
-    dat = zeros(n_smp)
-
-    for i in range(n_smp):
-        i0 = i * DATA_PRECISION
-        i1 = i0 + DATA_PRECISION
-        dat[i] = int.from_bytes(x[i0:i1], byteorder='little', signed=True)
-
-    return dat
@@ -5,7 +5,9 @@ from pathlib import Path
 from struct import unpack
 from os import SEEK_END
 
-from numpy import c_, empty, float64, NaN, memmap
+from numpy import float64, memmap
+
+from .utils import read_range
 
 
 N_HDR_BYTES = 12
@@ -19,12 +21,22 @@ class OpBox:
     ----------
     filename : path to file
         the name of the filename with extension .phy
+    dtype : str or None
+        dtype of the data that is returned (if None, float64 as in the file)
     """
-    def __init__(self, filename):
+    def __init__(self, filename, dtype='float64'):
         self.filename = filename
+        self.dtype = dtype
 
         self._n_samples = None
         self._n_chan_in_dat = None
+        self._memmap = None
+
+    def __getstate__(self):
+        """Do not pickle the memmap, it's opened again when necessary."""
+        state = self.__dict__.copy()
+        state['_memmap'] = None
+        return state
 
     def return_hdr(self):
         """Return the header for further use.
@@ -74,7 +86,7 @@ class OpBox:
 
         return subj_id, start_time, s_freq, chan_name, n_samples, orig
 
-    def return_dat(self, chan, begsam, endsam):
+    def return_dat(self, chan, begsam, endsam, view=False):
         """Return the data as 2D numpy.ndarray.
 
         Parameters
@@ -85,37 +97,28 @@ class OpBox:
             index of the first sample
         endsam : int
             index of the last sample
+        view : bool
+            return a read-only view of the memmap, without copying the data,
+            when possible (see read_range)
 
         Returns
         -------
         numpy.ndarray
-            A 2d matrix, with dimension chan X samples. To save memory, the
-            data are memory-mapped, and you cannot change the values on disk.
+            A 2d matrix, with dimension chan X samples. The file is
+            memory-mapped the first time that you read the data and it stays
+            open until you call close().
         """
-        if isinstance(chan, int):  # make sure it's a list
-            chan = [chan, ]
-
-        data = memmap(self.filename, dtype='float64', mode='c',
-                      shape=(self._n_chan_in_dat, self._n_samples), order='F',
-                      offset=N_HDR_BYTES)
-        data = data[1:, :]  # ignore timestamps
-
-        begrec = max((begsam, 0))
-        endrec = min((endsam, self._n_samples))
-        dat = data[chan, begrec:endrec].astype(float64)
-
-        if begsam < 0:
-            pad = empty((dat.shape[0], 0 - begsam))
-            pad.fill(NaN)
-            dat = c_[pad, dat]
-
-        if endsam >= self._n_samples:
+        if self._memmap is None:
+            data = memmap(self.filename, dtype='float64', mode='r',
+                          shape=(self._n_chan_in_dat, self._n_samples),
+                          order='F', offset=N_HDR_BYTES)
+            self._memmap = data[1:, :]  # ignore timestamps
 
-            pad = empty((dat.shape[0], endsam - self._n_samples))
-            pad.fill(NaN)
-            dat = c_[dat, pad]
+        return read_range(self._memmap, chan, begsam, endsam, self.dtype, view)
 
-        return dat
+    def close(self):
+        """Release the memmap of the data."""
+        self._memmap = None
 
     def return_markers(self):
         """This format doesn't have markers.
@@ -1,9 +1,36 @@
 """Package to import and export common formats.
 """
 from datetime import datetime, timedelta
+from hashlib import sha1
 from json import dump, load
+from math import ceil
 from pathlib import Path
-from numpy import c_, empty, float64, NaN, memmap
+from zlib import compress, decompress
+
+from numpy import (asarray,
+                   clip,
+                   cumsum,
+                   diff,
+                   dtype as np_dtype,
+                   empty,
+                   flatnonzero,
+                   float64,
+                   frombuffer,
+                   hstack,
+                   iinfo,
+                   isinf,
+                   isnan,
+                   NaN,
+                   memmap,
+                   rint,
+                   unique,
+                   )
+
+from .utils import prepare_chunks, read_range
+
+# chunks of version 2: n of channels X n of samples
+CHUNK_SHAPE = (8, 8192)
+COMPRESSION = (None, 'zlib')
 
 
 class Phypno:
@@ -13,9 +40,27 @@ class Phypno:
     ----------
     filename : path to file
         the name of the filename with extension .phy
+    dtype : str or None
+        dtype of the data that is returned (if None, the dtype in the file)
+
+    Notes
+    -----
+    There are two versions of the format. Version 1 stores the data as one
+    memory-mapped matrix. Version 2 stores the data in chunks of channels and
+    samples, possibly compressed, and only the chunks containing the requested
+    data are read (see write_phypno).
     """
-    def __init__(self, filename):
+    def __init__(self, filename, dtype='float64'):
         self.filename = filename
+        self.dtype = dtype
+        self.version = 1
+        self._memmap = None
+
+    def __getstate__(self):
+        """Do not pickle the memmap, it's opened again when necessary."""
+        state = self.__dict__.copy()
+        state['_memmap'] = None
+        return state
 
     def return_hdr(self):
         """Return the header for further use.
@@ -42,12 +87,24 @@ class Phypno:
                                        '%Y-%m-%d %H:%M:%S.%f')
         self.memshape = (len(orig['chan_name']),
                          orig['n_samples'])
-        self.dtype = orig.get('dtype', 'float64')
+        self.file_dtype = orig.get('dtype', 'float64')
+        self.version = orig.get('version', 1)
+
+        if self.version == 2:
+            self.chunk_shape = tuple(orig['chunk_shape'])
+            self.compression = orig['compression']
+            self.delta = orig['delta']
+            self.nan_value = orig.get('nan_value')
+            self.chunks = {k: asarray(v) for k, v in orig['chunks'].items()}
+
+        elif self.version != 1:
+            raise ValueError('Phypno format version ' + str(self.version) +
+                             ' is not supported')
 
         return (orig['subj_id'], start_time, orig['s_freq'], orig['chan_name'],
                 orig['n_samples'], orig)
 
-    def return_dat(self, chan, begsam, endsam):
+    def return_dat(self, chan, begsam, endsam, view=False):
         """Return the data as 2D numpy.ndarray.
 
         Parameters
@@ -58,12 +115,15 @@ class Phypno:
             index of the first sample
         endsam : int
             index of the last sample
+        view : bool
+            return a read-only view of the memmap, without copying the data,
+            when possible (only version 1, see read_range)
 
         Returns
         -------
         numpy.ndarray
-            A 2d matrix, with dimension chan X samples. To save memory, the
-            data are memory-mapped, and you cannot change the values on disk.
+            A 2d matrix, with dimension chan X samples, in the dtype passed
+            when creating the class (if dtype is None, the dtype in the file).
 
         Raises
         ------
@@ -73,31 +133,81 @@ class Phypno:
         Notes
         -----
         When asking for an interval outside the data boundaries, it returns NaN
-        for those values. It then converts the memmap to a normal numpy array,
-        I think, and so it reads the data into memory. However, I'm not 100%
-        sure that this is what happens.
-        """
-        memmap_file = Path(self.filename).with_suffix('.dat')
-        if not memmap_file.exists():
-            raise FileNotFoundError('Could not find ' + str(memmap_file))
-
-        data = memmap(str(memmap_file), self.dtype, mode='c',
-                      shape=self.memshape, order='F')
-
-        n_smp = self.memshape[1]
-        dat = data[chan, max((begsam, 0)):min((endsam, n_smp))].astype(float64)
-
-        if begsam < 0:
+        for those values.
 
-            pad = empty((dat.shape[0], 0 - begsam))
-            pad.fill(NaN)
-            dat = c_[pad, dat]
+        The .dat file is memory-mapped the first time that you read the data
+        and it stays open until you call close().
 
-        if endsam >= n_smp:
-
-            pad = empty((dat.shape[0], endsam - n_smp))
-            pad.fill(NaN)
-            dat = c_[dat, pad]
+        For version 2, only the chunks which contain the channels and the
+        samples of interest are read and decoded.
+        """
+        data = self._open()
+
+        if self.version == 2:
+            return self._read_chunks(data, chan, begsam, endsam)
+
+        return read_range(data, chan, begsam, endsam, self.dtype, view)
+
+    def close(self):
+        """Release the memmap of the .dat file."""
+        self._memmap = None
+
+    def _open(self):
+        """Memory-map the .dat file, if it's not open yet."""
+        if self._memmap is None:
+            memmap_file = Path(self.filename).with_suffix('.dat')
+            if not memmap_file.exists():
+                raise FileNotFoundError('Could not find ' + str(memmap_file))
+
+            if self.version == 2:
+                self._memmap = memmap(str(memmap_file), 'u1', mode='r')
+            else:
+                self._memmap = memmap(str(memmap_file), self.file_dtype,
+                                      mode='r', shape=self.memshape,
+                                      order='F')
+
+        return self._memmap
+
+    def _read_chunks(self, data, chan, begsam, endsam):
+        """Read the data from the chunks (version 2), see return_dat."""
+        n_chan, n_smp = self.memshape
+        chan_size, smp_size = self.chunk_shape
+        n_chan_chunks = ceil(n_chan / chan_size)
+
+        chan = asarray(chan).ravel()
+        dat = empty((len(chan), endsam - begsam), dtype=self.dtype or float64)
+        dat.fill(NaN)
+
+        begsam_in = max((begsam, 0))
+        endsam_in = min((endsam, n_smp))
+        if begsam_in >= endsam_in:
+            return dat
+
+        chan_chunk = chan // chan_size
+        for i_smp in range(begsam_in // smp_size,
+                           (endsam_in - 1) // smp_size + 1):
+            smp0 = i_smp * smp_size
+            smp1 = min((smp0 + smp_size, n_smp))
+            sel0 = max((begsam_in, smp0))
+            sel1 = min((endsam_in, smp1))
+
+            for i_chan in unique(chan_chunk):
+                chan0 = i_chan * chan_size
+                chan1 = min((chan0 + chan_size, n_chan))
+                i = i_smp * n_chan_chunks + i_chan
+
+                pos = self.chunks['position'][i]
+                x = _decode_chunk(data[pos:pos + self.chunks['length'][i]],
+                                  (chan1 - chan0, smp1 - smp0),
+                                  self.file_dtype,
+                                  self.chunks['scale'][i],
+                                  self.chunks['offset'][i],
+                                  self.compression, self.delta,
+                                  self.nan_value)
+
+                rows = flatnonzero(chan_chunk == i_chan)
+                dat[rows, sel0 - begsam:sel1 - begsam] = \
+                    x[chan[rows] - chan0, sel0 - smp0:sel1 - smp0]
 
         return dat
 
@@ -117,19 +227,27 @@ class Phypno:
         return []
 
 
-def write_phypno(data, filename, subj_id='', dtype='float64'):
+def write_phypno(data, filename, subj_id='', dtype='float64', version=1,
+                 chunk_shape=CHUNK_SHAPE, compression=None):
     """Write file in simple phypno format.
 
     Parameters
     ----------
-    data : instance of ChanTime
-        data with only one trial
+    data : instance of ChanTime (or Dataset or iterable of ChanTime)
+        data with only one trial. For version 2, it can also be a dataset or
+        consecutive chunks of data (see write_edf).
     filename : path to file
         file to export to (the extensions .phy and .dat will be added)
     subj_id : str
         subject id
     dtype : str
         numpy dtype in which you want to save the data
+    version : int
+        1 (one memory-mapped matrix) or 2 (chunks)
+    chunk_shape : tuple of int
+        number of channels and number of samples in each chunk (only version 2)
+    compression : None or 'zlib'
+        if 'zlib', each chunk is compressed (only version 2)
 
     Notes
     -----
@@ -140,12 +258,33 @@ def write_phypno(data, filename, subj_id='', dtype='float64'):
 
     Memory-mapped matrices are column-major, Fortran-style, to be compatible
     with Matlab.
+
+    In version 2, the data are divided into chunks of chunk_shape, which are
+    stored one after the other (channels X samples, row-major). If dtype is an
+    integer type, each chunk is scaled to use the whole range of dtype, and
+    the scale and offset of each chunk are stored in the .phy file, together
+    with the position of the chunks in the .dat file. If the data are
+    compressed and dtype is an integer type, the difference between
+    consecutive samples is compressed, so that the compression is lossless
+    (but the conversion to integers is not). If dtype is an integer type, NaN
+    are stored as the minimum value of dtype (which is not used by the other
+    values), stored in the .phy file as 'nan_value'. The SHA-1 checksum of the
+    .dat file is stored in the .phy file, as 'sha1'.
     """
     filename = Path(filename)
 
     json_file = filename.with_suffix('.phy')
     memmap_file = filename.with_suffix('.dat')
 
+    if version == 2:
+        _write_chunks(data, json_file, memmap_file, subj_id, dtype,
+                      chunk_shape, compression)
+        return
+
+    elif version != 1:
+        raise ValueError('Phypno format version ' + str(version) +
+                         ' is not supported')
+
     start_time = data.start_time + timedelta(seconds=data.axis['time'][0][0])
 
     start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S.%f')
@@ -166,3 +305,175 @@ def write_phypno(data, filename, subj_id='', dtype='float64'):
     mem = memmap(str(memmap_file), dtype, mode='w+', shape=memshape, order='F')
     mem[:, :] = data.data[0]
     mem.flush()  # not sure if necessary
+
+
+def _write_chunks(data, json_file, memmap_file, subj_id, dtype, chunk_shape,
+                  compression):
+    """Write data in phypno format, version 2. See write_phypno."""
+    if compression not in COMPRESSION:
+        raise ValueError('compression should be one of ' + str(COMPRESSION))
+
+    start_time, s_freq, chan_name, chunks = prepare_chunks(data, 60)
+    chan_size, smp_size = [int(x) for x in chunk_shape]
+    delta = compression is not None and np_dtype(dtype).kind in 'iu'
+    nan_value = None
+    if np_dtype(dtype).kind in 'iu':
+        nan_value = int(iinfo(dtype).min)
+
+    index = {'position': [], 'length': [], 'scale': [], 'offset': []}
+    checksum = sha1()
+    n_samples = 0
+    position = 0
+    with memmap_file.open('wb') as f:
+        for dat in _fixed_chunks(chunks, smp_size):
+            n_samples += dat.shape[1]
+            for chan0 in range(0, dat.shape[0], chan_size):
+                b, scale, offset = _encode_chunk(dat[chan0:chan0 + chan_size],
+                                                 dtype, compression, delta,
+                                                 nan_value)
+                f.write(b)
+                checksum.update(b)
+                index['position'].append(position)
+                index['length'].append(len(b))
+                index['scale'].append(scale)
+                index['offset'].append(offset)
+                position += len(b)
+
+    dataset = {'subj_id': subj_id,
+               'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S.%f'),
+               's_freq': float(s_freq),
+               'chan_name': chan_name,
+               'n_samples': n_samples,
+               'dtype': dtype,
+               'version': 2,
+               'chunk_shape': [chan_size, smp_size],
+               'compression': compression,
+               'delta': delta,
+               'nan_value': nan_value,
+               'chunks': index,
+               'sha1': checksum.hexdigest(),
+               }
+
+    # write the header at the end, so it's complete only if the data are
+    with json_file.open('w') as f:
+        dump(dataset, f, sort_keys=True, indent=4)
+
+
+def _fixed_chunks(chunks, n_smp):
+    """Regroup chunks of data into chunks of n_smp samples (the last one can be
+    shorter).
+
+    Parameters
+    ----------
+    chunks : iterable of numpy.ndarray
+        2d matrices (chan X time) with any number of samples
+    n_smp : int
+        number of samples of the output chunks
+
+    Yields
+    ------
+    numpy.ndarray
+        2d matrix (chan X time) with n_smp samples
+    """
+    buffer = []
+    n_buffer = 0
+    for dat in chunks:
+        buffer.append(dat)
+        n_buffer += dat.shape[1]
+        if n_buffer < n_smp:
+            continue
+
+        dat = hstack(buffer) if len(buffer) > 1 else buffer[0]
+        i = 0
+        for i in range(0, n_buffer - n_smp + 1, n_smp):
+            yield dat[:, i:i + n_smp]
+        buffer = [dat[:, i + n_smp:]]
+        n_buffer = buffer[0].shape[1]
+
+    if n_buffer:
+        yield hstack(buffer)
+
+
+def _encode_chunk(x, dtype, compression, delta, nan_value=None):
+    """Convert one chunk of data into bytes.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        2d matrix (chan X time)
+    dtype : str
+        numpy dtype of the stored data
+    compression : None or 'zlib'
+        compression of the chunk
+    delta : bool
+        store the difference between consecutive samples
+    nan_value : int or None
+        value which replaces NaN, if dtype is an integer type (it should be
+        the minimum of dtype, the other values are scaled above it). If None,
+        the whole range of dtype is used.
+
+    Returns
+    -------
+    bytes
+        the chunk, as stored on disk
+    float
+        scale of the chunk
+    float
+        offset of the chunk
+
+    Raises
+    ------
+    ValueError
+        if dtype is an integer type and the data contains inf (or NaN, if
+        nan_value is None)
+    """
+    scale = 1.
+    offset = 0.
+    if np_dtype(dtype).kind in 'iu':
+        if isinf(x).any() or (nan_value is None and isnan(x).any()):
+            raise ValueError('NaN or inf cannot be stored as ' + dtype)
+        info = iinfo(dtype)
+        i_min = info.min if nan_value is None else nan_value + 1
+        is_nan = isnan(x)
+        if is_nan.all():
+            x_min = x_max = 0.
+        else:
+            x_min = float(x[~is_nan].min())
+            x_max = float(x[~is_nan].max())
+        offset = (x_max + x_min) / 2
+        if x_max > x_min:
+            scale = (x_max - x_min) / (info.max - i_min)
+        offset -= scale * (info.max + i_min) / 2
+        x = clip(rint((x - offset) / scale), i_min, info.max)
+        if is_nan.any():
+            x[is_nan] = nan_value
+
+    x = x.astype(dtype)
+    if delta:
+        x = diff(x, axis=1, prepend=0).astype(dtype)
+    b = x.tobytes(order='C')
+    if compression == 'zlib':
+        b = compress(b)
+
+    return b, scale, offset
+
+
+def _decode_chunk(b, shape, dtype, scale, offset, compression, delta,
+                  nan_value=None):
+    """Convert bytes into one chunk of data (see _encode_chunk).
+
+    Returns
+    -------
+    numpy.ndarray
+        2d matrix (chan X time) in float64
+    """
+    if compression == 'zlib':
+        b = decompress(b)
+    x = frombuffer(b, dtype=dtype).reshape(shape)
+    if delta:
+        x = cumsum(x, axis=1, dtype=dtype)
+
+    output = x * scale + offset
+    if nan_value is not None:
+        output[x == nan_value] = NaN
+    return output
@@ -0,0 +1,175 @@
+"""Functions shared by the readers of different formats.
+"""
+from datetime import timedelta
+from itertools import chain
+
+from numpy import asarray, diff, dtype as np_dtype, empty, frombuffer, NaN, \
+    ndarray, uint8
+
+
+# n of samples copied at once, when the samples of one channel are not
+# contiguous (so that all the channels of those samples stay in the CPU cache)
+COPY_BLOCK = 4096
+
+
+def read_int24(x):
+    """Convert 24bit little-endian signed values to numpy.
+
+    Parameters
+    ----------
+    x : bytes or numpy.ndarray
+        bytes (length should be divisible by 3) or array of uint8, where the
+        last dimension contains the 3 bytes of each value (it can be a memmap)
+
+    Returns
+    -------
+    numpy.ndarray
+        array of int32 with the signed 24bit values. If x is an array, it has
+        the same shape as x, without the last dimension.
+
+    Notes
+    -----
+    The 3 bytes are copied in the 3 most significant bytes of an int32, so that
+    the arithmetic shift to the right extends the sign.
+    """
+    if isinstance(x, ndarray):
+        shape = x.shape[:-1]
+    else:
+        x = frombuffer(x, dtype=uint8)
+        shape = (x.shape[0] // 3, )
+
+    x = x.reshape(-1, 3)
+    dat = empty((x.shape[0], 4), dtype=uint8)
+    dat[:, 0] = 0
+    dat[:, 1:] = x
+
+    return (dat.view('<i4') >> 8).reshape(shape)
+
+
+def read_range(data, chan, begsam, endsam, dtype='float64', view=False):
+    """Read some channels and samples from a 2d matrix, such as a memmap.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        2d matrix (chan X samples), usually a memmap of the whole recording
+    chan : int or list
+        index (indices) of the channels to read
+    begsam : int
+        index of the first sample (it can be negative)
+    endsam : int
+        index of the last sample (it can be after the end of the data)
+    dtype : str or None
+        dtype of the output. If None, it's the same dtype as data.
+    view : bool
+        if the samples are within the data, the channels are consecutive and
+        dtype does not change, return a view of the data (no copy)
+
+    Returns
+    -------
+    numpy.ndarray
+        A 2d matrix, with dimension chan X samples. The samples outside the
+        data are NaN.
+
+    Raises
+    ------
+    ValueError
+        if some samples are outside the data, but dtype cannot store NaN
+
+    Notes
+    -----
+    The output is allocated once and each channel is copied directly, without
+    intermediate copies. If the data are column-major (as memmaps compatible
+    with Matlab), the samples are copied in blocks of COPY_BLOCK samples.
+    """
+    chan = asarray(chan).ravel()
+    if dtype is None:
+        dtype = data.dtype
+    n_smp = data.shape[1]
+    begrec = max((begsam, 0))
+    endrec = max((min((endsam, n_smp)), begrec))
+
+    consecutive = len(chan) > 0 and (diff(chan) == 1).all()
+    if (view and consecutive and np_dtype(dtype) == data.dtype and
+            begrec == begsam and endrec == endsam):
+        return data[chan[0]:chan[-1] + 1, begsam:endsam]
+
+    dat = empty((len(chan), endsam - begsam), dtype=dtype)
+    if begrec > begsam or endrec < endsam:
+        if dat.dtype.kind not in 'fc':
+            raise ValueError('Samples outside the data cannot be stored as ' +
+                             str(dat.dtype))
+        dat[:, :begrec - begsam] = NaN
+        dat[:, endrec - begsam:] = NaN
+
+    step = max((endrec - begrec, 1))
+    if data.strides[0] < data.strides[1]:
+        step = COPY_BLOCK
+
+    for i0 in range(begrec, endrec, step):
+        i1 = min((i0 + step, endrec))
+        block = data[:, i0:i1]
+        if consecutive:
+            dat[:, i0 - begsam:i1 - begsam] = block[chan[0]:chan[-1] + 1]
+        else:
+            for i, one_chan in enumerate(chan):
+                dat[i, i0 - begsam:i1 - begsam] = block[one_chan]
+
+    return dat
+
+
+def prepare_chunks(data, chunk_duration):
+    """Get the information about the data and a generator over the data.
+
+    Parameters
+    ----------
+    data : instance of ChanTime or Dataset or iterable of ChanTime
+        the data to write (for iterable of ChanTime, each item is one chunk)
+    chunk_duration : float
+        duration in s of each chunk (for ChanTime and Dataset)
+
+    Returns
+    -------
+    start_time : datetime
+        time of the first sample
+    s_freq : float
+        sampling frequency
+    chan_name : list of str
+        name of the channels
+    generator
+        which returns 2d matrices (chan X time)
+    """
+    if hasattr(data, 'read_data'):
+        s_freq = data.header['s_freq']
+        chan_name = list(data.header['chan_name'])
+        n_samples = data.header['n_samples']
+        n_smp_chunk = max((int(chunk_duration * s_freq), 1))
+
+        def chunks():
+            for begsam in range(0, n_samples, n_smp_chunk):
+                endsam = min(begsam + n_smp_chunk, n_samples)
+                yield data.read_data(begsam=begsam, endsam=endsam).data[0]
+
+        start_time = data.header['start_time']
+        return start_time, s_freq, chan_name, chunks()
+
+    if hasattr(data, 'data'):
+        s_freq = data.s_freq
+        n_smp_chunk = max((int(chunk_duration * s_freq), 1))
+        dat = data.data[0]
+        chunks = (dat[:, i:i + n_smp_chunk]
+                  for i in range(0, dat.shape[1], n_smp_chunk))
+        first = data
+
+    else:
+        data = iter(data)
+        first = next(data)
+        s_freq = first.s_freq
+        chunks = chain([first.data[0]], (x.data[0] for x in data))
+
+    if first.start_time is None:
+        raise ValueError('Data should contain a valid start_time (as datetime)')
+    start_time = first.start_time + timedelta(seconds=first.axis['time'][0][0])
+    chan_name = list(first.axis['chan'][0])
+
+    return start_time, s_freq, chan_name, chunks
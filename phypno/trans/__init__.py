@@ -6,6 +6,7 @@ use this package to transform to other classes. If you want to transform to
 basic elements, use the package "detect" for example.
 
 """
+from .lazy import lazy, LazyData
 from .filter import filter_, convolve
 from .select import select, resample
 from .frequency import frequency, timefrequency
@@ -4,11 +4,15 @@ from logging import getLogger
 
 from itertools import product
 
-from numpy import empty, ix_, expand_dims, squeeze
+from numpy import ceil, empty, ix_, expand_dims, log, roots, squeeze
 from scipy.signal import iirfilter, filtfilt, get_window, fftconvolve
 
+from .lazy import LazyData
+
 lg = getLogger(__name__)
 
+FILTER_DECAY = 1e-6  # impulse response which is negligible, for LazyData
+
 
 def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
             ftype='butter', Rs=None):
@@ -42,6 +46,13 @@ def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
     If you specify high_cut only, it generates a low-pass filter.
     If you specify both, it generates a band-pass filter.
 
+    If the trials are stacked (see Data.stack_trials), all the trials are
+    filtered at once.
+
+    If data is an instance of LazyData, the filter is computed later, in
+    chunks which overlap for as many samples as the impulse response of the
+    filter needs to become negligible.
+
     low_cut and high_cut should be given as ratio of the Nyquist. But if you
     specify s_freq, then the ratio will be computed automatically.
 
@@ -86,7 +97,17 @@ def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
              ''.format(order, str(Wn), btype, ftype))
     b, a = iirfilter(order, Wn, btype=btype, ftype=ftype, rs=Rs)
 
+    if isinstance(data, LazyData):
+        return data._add(filter_, overlap=_filter_overlap(b, a), axis=axis,
+                         low_cut=low_cut, high_cut=high_cut, order=order,
+                         ftype=ftype, Rs=Rs)
+
     fdata = data._copy()
+    if data.stacked is not None:  # all the trials at once
+        fdata._set_stacked(filtfilt(b, a, data.stacked,
+                                    axis=data.index_of(axis) + 1))
+        return fdata
+
     for i in range(data.number_of('trial')):
         fdata.data[i] = filtfilt(b, a,
                                  data.data[i],
@@ -94,6 +115,15 @@ def filter_(data, axis='time', low_cut=None, high_cut=None, order=4,
     return fdata
 
 
+def _filter_overlap(b, a):
+    """Number of samples after which the impulse response of the filter is
+    negligible (smaller than FILTER_DECAY), based on the slowest pole."""
+    radius = abs(roots(a)).max() if len(a) > 1 else 0
+    if radius == 0:  # FIR filter
+        return len(b)
+    return int(ceil(log(FILTER_DECAY) / log(radius))) + len(b)
+
+
 def convolve(data, window, axis='time', length=1):
     """Design taper and convolve it with the signal.
 
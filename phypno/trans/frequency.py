@@ -57,6 +57,9 @@ def frequency(data, method='welch', **options):
 
         The output is real PSD, not complex, because of
         https://github.com/scipy/scipy/issues/5757
+
+    For method 'welch', if the trials are stacked (see Data.stack_trials), the
+    power spectrum of all the trials is computed at once.
     """
     implemented_methods = ('welch', 'multitaper')
 
@@ -97,6 +100,20 @@ def frequency(data, method='welch', **options):
     freq.axis['freq'] = empty(data.number_of('trial'), dtype='O')
     freq.data = empty(data.number_of('trial'), dtype='O')
 
+    if method == 'welch' and data.stacked is not None:  # all the trials
+        nperseg = int(options['duration'] * data.s_freq)
+        noverlap = int(options['overlap'] * nperseg)
+        f, Pxx = welch(data.stacked,
+                       fs=data.s_freq,
+                       nperseg=nperseg,
+                       noverlap=noverlap,
+                       scaling=options['scaling'],
+                       axis=idx_time + 1)
+        freq._set_stacked(Pxx)
+        for i in range(data.number_of('trial')):
+            freq.axis['freq'][i] = f
+        return freq
+
     for i in range(data.number_of('trial')):
         if method == 'welch':
             nperseg = int(options['duration'] * data.s_freq)
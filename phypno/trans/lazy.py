@@ -0,0 +1,413 @@
+"""Module to record the transformations of the data and to run them later,
+one chunk of data at the time.
+
+Each function in trans returns a full copy of the data, so a pipeline on a
+whole-night recording needs several copies of the recording in memory. If you
+pass an instance of LazyData to montage, filter_, math or select, the function
+only records the transformation. compute() then runs all the transformations
+on one chunk of data at the time, so that the intermediate results are never
+larger than one chunk.
+
+Examples
+--------
+>>> from phypno.trans import filter_, lazy, math, select
+>>> ldata = lazy(dataset, chan=['Fz', 'Cz'])
+>>> ldata = filter_(ldata, low_cut=10, high_cut=16)
+>>> ldata = math(ldata, operator_name=('hilbert', 'absolute'), axis='time')
+>>> ldata = select(ldata, time=(3600, 7200))
+>>> data = ldata.compute(chunk_duration=60, n_jobs=4)
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+
+from numpy import array_split, asarray, empty, NaN, searchsorted
+
+from ..dataset import Dataset
+from ..datatype import ChanTime, RegularAxis, _as_slice
+
+lg = getLogger(__name__)
+
+CHUNK_DURATION = 60  # s
+OVERLAP = 5  # s, for the transformations whose edge effects do not end
+
+
+def lazy(source, chan=None, trial=0):
+    """Record the transformations of the data, to compute them in chunks.
+
+    Parameters
+    ----------
+    source : instance of Dataset or ChanTime
+        the recordings to transform
+    chan : list of str, optional
+        channels to read (default: all the channels)
+    trial : int, optional
+        the trial to transform, if source is an instance of ChanTime
+
+    Returns
+    -------
+    instance of LazyData
+        it can be passed to montage, filter_, math and select. Call compute()
+        to get the transformed data.
+    """
+    return LazyData(source, chan, trial)
+
+
+class LazyData:
+    """Recordings with the transformations which will be computed in chunks.
+
+    Parameters
+    ----------
+    source : instance of Dataset or ChanTime
+        the recordings to transform
+    chan : list of str, optional
+        channels to read (default: all the channels)
+    trial : int, optional
+        the trial to transform, if source is an instance of ChanTime
+
+    Attributes
+    ----------
+    s_freq : int or float
+        sampling frequency
+    start_time : instance of datetime.datetime
+        the start time of the recording
+    attr : dict
+        additional information, as in Data
+    chan : list of str
+        channels to read
+    time : ndarray or RegularAxis
+        time of each sample of the source
+    nodes : list of dict
+        the transformations, with keys:
+            - func : function in trans to run on each chunk
+            - kwargs : dict with the arguments of func
+            - overlap : int or None, number of samples of the previous and
+              next chunks which are necessary (None if the edge effects never
+              end, such as for hilbert)
+            - chan_wise : bool, if each channel is transformed independently
+              of the others
+            - selection : bool, if func is select
+
+    Notes
+    -----
+    The functions which transform the data record a new node and return a new
+    instance of LazyData, so that the original LazyData does not change.
+    """
+    def __init__(self, source, chan=None, trial=0):
+        self.source = source
+        self.trial = trial
+        self.nodes = []
+
+        if isinstance(source, Dataset):
+            self.s_freq = source.header['s_freq']
+            self.start_time = source.header['start_time']
+            self.attr = ChanTime().attr
+            all_chan = list(source.header['chan_name'])
+            self.time = RegularAxis(0, self.s_freq,
+                                    source.header['n_samples'])
+
+        else:
+            if source.list_of_axes != ('chan', 'time'):
+                raise TypeError('Only data with axes chan and time can be '
+                                'transformed in chunks')
+            self.s_freq = source.s_freq
+            self.start_time = source.start_time
+            self.attr = source.attr
+            all_chan = list(source.axis['chan'][trial])
+            self.time = source.axis['time'][trial]
+
+        if chan is None:
+            chan = all_chan
+        missing = [x for x in chan if x not in all_chan]
+        if missing:
+            raise ValueError('Channels ' + ', '.join(missing) + ' are not '
+                             'in the data')
+        self.chan = list(chan)
+        self._idx_chan = {}  # the first channel, if some have the same name
+        for i, one_chan in enumerate(all_chan):
+            self._idx_chan.setdefault(one_chan, i)
+
+    def _add(self, func, overlap=0, chan_wise=True, selection=False,
+             **kwargs):
+        """Record one transformation.
+
+        Parameters
+        ----------
+        func : function
+            function in trans, which is run on each chunk
+        overlap : int or None
+            number of samples of the previous and next chunks which are
+            necessary to compute the transformation (None for OVERLAP)
+        chan_wise : bool
+            if each channel is transformed independently of the others
+        selection : bool
+            if func is select
+        **kwargs
+            arguments of func
+
+        Returns
+        -------
+        instance of LazyData
+            new instance, with the transformation
+        """
+        output = LazyData.__new__(LazyData)
+        output.__dict__.update(self.__dict__)
+        output.nodes = self.nodes + [{'func': func,
+                                      'kwargs': kwargs,
+                                      'overlap': overlap,
+                                      'chan_wise': chan_wise,
+                                      'selection': selection,
+                                      }]
+        return output
+
+    def compute(self, chunk_duration=CHUNK_DURATION, overlap=OVERLAP,
+                n_jobs=1, executor=None):
+        """Run all the transformations, one chunk of data at the time.
+
+        Parameters
+        ----------
+        chunk_duration : float
+            duration in s of each chunk of data
+        overlap : float
+            duration in s of the data before and after each chunk, for the
+            transformations whose edge effects do not end (such as hilbert)
+        n_jobs : int
+            number of threads (and of blocks of channels, if all the
+            transformations are applied to each channel independently)
+        executor : instance of concurrent.futures.Executor
+            pool of threads to compute the chunks (if specified, n_jobs is
+            the number of blocks of channels)
+
+        Returns
+        -------
+        instance of ChanTime (or the class returned by the transformations)
+            the transformed data, in one trial
+
+        Raises
+        ------
+        ValueError
+            if no data was selected or if the transformations change the time
+            axis.
+
+        Notes
+        -----
+        Each chunk is read with the data before and after it, which is
+        necessary to avoid edge effects (for filters, the samples in which
+        the impulse response of the filter is not negligible), and then it's
+        cropped. Only the time interval selected with select is computed.
+
+        If all the transformations are applied to each channel independently,
+        the channels are split into n_jobs blocks, which are computed in
+        parallel. Otherwise (f.e. with montage), the chunks of time are
+        computed in parallel. At most 2 * n_jobs chunks are in memory at the
+        same time.
+        """
+        begsam, endsam = self._selected_samples()
+        n_smp_chunk = max((int(chunk_duration * self.s_freq), 1))
+        chunks = [(i, min((i + n_smp_chunk, endsam)))
+                  for i in range(begsam, endsam, n_smp_chunk)]
+        n_overlap = sum(int(overlap * self.s_freq) if x['overlap'] is None
+                        else x['overlap'] for x in self.nodes)
+
+        chan_wise = all(x['chan_wise'] for x in self.nodes)
+        if chan_wise:
+            chan, rows = self._selected_chan()
+            nodes = _remove_chan_selection(self.nodes)
+            blocks = [(list(x), [chan[i] for i in x])
+                      for x in array_split(rows, n_jobs) if len(x)]
+        else:
+            chan = None
+            nodes = self.nodes
+            blocks = [(None, self.chan)]
+
+        if not chunks or not blocks:
+            raise ValueError('No data was selected')
+        units = [(one_block, one_chunk) for one_block in blocks
+                 for one_chunk in chunks]
+
+        # the first chunk defines the shape and dtype of the output
+        first, dat = self._compute_chunk(nodes, units[0][0][1], *units[0][1],
+                                         n_overlap=n_overlap)
+        output = first._copy()
+        for one_axis in output.axis:
+            output.axis[one_axis] = empty(1, dtype='O')
+            output.axis[one_axis][0] = first.axis[one_axis][0]
+        output.axis['time'][0] = self.time[begsam:endsam]
+
+        idx_time = output.index_of('time')
+        shape = list(dat.shape)
+        shape[idx_time] = endsam - begsam
+        if chan_wise:
+            idx_chan = output.index_of('chan')
+            shape[idx_chan] = len(chan)
+            output.axis['chan'][0] = asarray(chan, dtype='U')
+
+        output.data = empty(1, dtype='O')
+        output.data[0] = empty(shape, dtype=dat.dtype)
+        if chan_wise and len(rows) < len(chan):
+            output.data[0].fill(NaN)  # channels which are not in the data
+
+        def store(unit, dat):
+            (rows, _), (one_begsam, one_endsam) = unit
+            idx = [slice(None)] * dat.ndim
+            idx[idx_time] = slice(one_begsam - begsam, one_endsam - begsam)
+            if rows is not None:
+                idx[idx_chan] = _as_slice(asarray(rows, dtype=int))
+            output.data[0][tuple(idx)] = dat
+
+        store(units[0], dat)
+        if len(units) == 1:
+            return output
+
+        if n_jobs == 1 and executor is None:
+            for unit in units[1:]:
+                store(unit, self._compute_chunk(nodes, unit[0][1], *unit[1],
+                                                n_overlap=n_overlap)[1])
+            return output
+
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=n_jobs)
+
+        try:
+            futures = deque()
+            for unit in units[1:]:
+                futures.append((unit, executor.submit(self._compute_chunk,
+                                                      nodes, unit[0][1],
+                                                      *unit[1],
+                                                      n_overlap=n_overlap)))
+                if len(futures) >= 2 * n_jobs:
+                    unit, future = futures.popleft()
+                    store(unit, future.result()[1])
+
+            while futures:
+                unit, future = futures.popleft()
+                store(unit, future.result()[1])
+
+        finally:
+            if own_executor:
+                executor.shutdown()
+
+        return output
+
+    def _selected_samples(self):
+        """Return the first and last sample selected with select (time)."""
+        begsam, endsam = 0, len(self.time)
+        for node in self.nodes:
+            if not node['selection'] or 'time' not in node['kwargs']:
+                continue
+
+            time_range = node['kwargs']['time']
+            if len(time_range) == 0:
+                endsam = begsam
+                continue
+            if time_range[0] is not None:
+                begsam = max((begsam, int(searchsorted(self.time,
+                                                       time_range[0]))))
+            if time_range[1] is not None:
+                endsam = min((endsam, int(searchsorted(self.time,
+                                                       time_range[1]))))
+
+        return begsam, max((begsam, endsam))
+
+    def _selected_chan(self):
+        """Return the channels selected with select (chan).
+
+        Returns
+        -------
+        list of str
+            the channels in the output
+        list of int
+            the channels in the output which are in the data (the others are
+            NaN)
+        """
+        chan = self.chan
+        in_data = [True] * len(chan)
+        for node in self.nodes:
+            if not node['selection'] or 'chan' not in node['kwargs']:
+                continue
+
+            selected = list(node['kwargs']['chan'])
+            in_data = [x in chan and in_data[chan.index(x)] for x in selected]
+            chan = selected
+
+        return chan, [i for i, x in enumerate(in_data) if x]
+
+    def _compute_chunk(self, nodes, chan, begsam, endsam, n_overlap):
+        """Read one chunk of data and run all the transformations.
+
+        Parameters
+        ----------
+        nodes : list of dict
+            the transformations
+        chan : list of str
+            the channels to read
+        begsam : int
+            first sample of the chunk
+        endsam : int
+            last sample of the chunk (not included)
+        n_overlap : int
+            number of samples to read before and after the chunk
+
+        Returns
+        -------
+        instance of Data
+            the transformed chunk, with overlap
+        ndarray
+            the data of the chunk, without overlap
+
+        Raises
+        ------
+        ValueError
+            if the transformations changed the time axis
+        """
+        data = self._read(chan, max((begsam - n_overlap, 0)),
+                          min((endsam + n_overlap, len(self.time))))
+        for node in nodes:
+            data = node['func'](data, **node['kwargs'])
+
+        time = data.axis['time'][0]
+        idx_time = data.index_of('time')
+        beg = int(searchsorted(time, self.time[begsam], side='left'))
+        end = int(searchsorted(time, self.time[endsam - 1], side='right'))
+        if (end - beg != endsam - begsam or
+                data.data[0].shape[idx_time] != len(time)):
+            raise ValueError('The transformations changed the time axis, so '
+                             'they cannot be computed in chunks')
+
+        idx = [slice(None)] * data.data[0].ndim
+        idx[idx_time] = slice(beg, end)
+        return data, data.data[0][tuple(idx)]
+
+    def _read(self, chan, begsam, endsam):
+        """Read some channels and samples of the source, as ChanTime."""
+        if isinstance(self.source, Dataset):
+            return self.source.read_data(chan=chan, begsam=begsam,
+                                         endsam=endsam)
+
+        idx_chan = [self._idx_chan[x] for x in chan]
+        data = ChanTime()
+        data.s_freq = self.s_freq
+        data.start_time = self.start_time
+        data.attr = self.attr.copy()
+        data.axis['chan'] = empty(1, dtype='O')
+        data.axis['chan'][0] = asarray(chan, dtype='U')
+        data.axis['time'] = empty(1, dtype='O')
+        data.axis['time'][0] = self.time[begsam:endsam]
+        data.data = empty(1, dtype='O')
+        data.data[0] = self.source.data[self.trial][idx_chan, begsam:endsam]
+        return data
+
+
+def _remove_chan_selection(nodes):
+    """Remove the selection of channels, when the channels are selected before
+    reading the data (see LazyData._selected_chan)."""
+    output = []
+    for node in nodes:
+        if node['selection'] and 'chan' in node['kwargs']:
+            kwargs = {k: v for k, v in node['kwargs'].items() if k != 'chan'}
+            if not kwargs:
+                continue
+            node = dict(node, kwargs=kwargs)
+        output.append(node)
+    return output
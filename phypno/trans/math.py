@@ -1,14 +1,16 @@
 """Convenient module to convert data based on simple mathematical operations.
 """
-from inspect import getfullargspec
+from inspect import signature
 from logging import getLogger
 
 # for Math
-from numpy import (absolute, angle, diff, exp, log, median, mean, pad, sqrt,
-                   square, sum, std, unwrap)
+from numpy import (absolute, angle, diff, exp, log, may_share_memory,
+                   median, mean, pad, sqrt, square, sum, std, ufunc, unwrap)
 from scipy.signal import detrend, hilbert
 from scipy.stats import mode
 
+from .lazy import LazyData
+
 lg = getLogger(__name__)
 
 NOKEEPDIM = (median, mode)
@@ -85,6 +87,15 @@ def math(data, operator=None, operator_name=None, axis=None):
 
     >>> def func(x, axis, keepdims=None):
     >>>     return nanmax(x, axis=axis)
+
+    If the trials are stacked (see Data.stack_trials), the functions which
+    take 'axis' and the numpy ufuncs (such as absolute) are run once on all
+    the trials. The other functions are run on each trial.
+
+    If data is an instance of LazyData, the operators are computed later, in
+    chunks. Along 'time', only 'hilbert' (with the overlap of
+    LazyData.compute) can be computed in chunks ('diff' cannot, because its
+    first value depends on the mean of the whole trial).
     """
     if operator is not None and operator_name is not None:
         raise TypeError('Parameters "operator" and "operator_name" are '
@@ -110,10 +121,10 @@ def math(data, operator=None, operator_name=None, axis=None):
         keepdims = True
 
         try:
-            args = getfullargspec(one_operator).args
-        except TypeError:
-            lg.debug('func ' + str(one_operator) + ' is not a Python '
-                     'function')
+            args = signature(one_operator).parameters
+        except (TypeError, ValueError):
+            lg.debug('func ' + str(one_operator) + ' has no signature, it '
+                     'should be point-wise')
         else:
             if 'axis' in args:
                 on_axis = True
@@ -132,8 +143,13 @@ def math(data, operator=None, operator_name=None, axis=None):
                            'keepdims': keepdims,
                            })
 
+    if isinstance(data, LazyData):
+        return data._add(math, operator=tuple(operator), axis=axis,
+                         **_lazy_properties(operations, axis))
+
     output = data._copy()
 
+    idx_axis = None
     if axis is not None:
         idx_axis = data.index_of(axis)
 
@@ -145,40 +161,123 @@ def math(data, operator=None, operator_name=None, axis=None):
         if func == mode:
             func = lambda x, axis: mode(x, axis=axis)[0]
 
-        for i in range(output.number_of('trial')):
-            
-            # don't copy original data, but use data if it's the first operation
-            if first_op:
-                x = data(trial=i)
+        if first_op:
+            stacked = data.stacked
+        else:
+            stacked = output.stacked
+
+        if stacked is not None and not (op['on_axis'] or
+                                        isinstance(func, ufunc)):
+            lg.debug(op['name'] + ' might not be point-wise, running it on '
+                     'each trial')
+            stacked = None
+
+        if stacked is not None and op['on_axis']:  # all the trials at once
+            output._set_stacked(_run_operator(data, op, func, stacked, axis,
+                                              idx_axis + 1))
+
+        elif stacked is not None:
+            if (not first_op and func.nin == 1 and func.nout == 1 and
+                    not may_share_memory(stacked, data.stacked) and
+                    func(stacked[:0]).dtype == stacked.dtype):
+                func(stacked, out=stacked)  # don't copy all the trials again
             else:
-                x = output(trial=i)
-            
-            if op['on_axis']:
-                lg.debug('running ' + op['name'] + ' on ' + str(idx_axis))
-               
-                try:
-                    if func == diff:
-                        lg.debug('Diff has one-point of zero padding')
-                        x = _pad_one_axis_one_value(x, idx_axis)
-                    output.data[i] = func(x, axis=idx_axis)
-
-                except IndexError:
-                    raise ValueError('The axis ' + axis + ' does not '
-                                     'exist in [' +
-                                     ', '.join(list(data.axis.keys())) + ']')
+                output._set_stacked(func(stacked))
 
-            else:
-                lg.debug('running ' + op['name'] + ' on each datapoint')
-                output.data[i] = func(x)
+        if stacked is None:
+            for i in range(output.number_of('trial')):
+
+                # don't copy original data, but use data if it's the first
+                # operation
+                if first_op:
+                    x = data(trial=i)
+                else:
+                    x = output(trial=i)
+
+                output.data[i] = _run_operator(data, op, func, x, axis,
+                                               idx_axis)
+
+        first_op = False
 
-        first_op = False 
-        
         if op['on_axis'] and not op['keepdims']:
             del output.axis[axis]
 
     return output
 
 
+def _lazy_properties(operations, axis):
+    """Overlap between chunks and channel independence of the operators, for
+    LazyData.
+
+    Returns
+    -------
+    dict
+        with 'overlap' (0 or None) and 'chan_wise' (bool)
+
+    Raises
+    ------
+    ValueError
+        if one of the operators along 'time' cannot be computed in chunks
+    """
+    overlap = 0
+    chan_wise = True
+    for op in operations:
+        if not op['on_axis']:
+            continue
+
+        if axis != 'time':
+            chan_wise = False
+        elif op['func'] == hilbert:
+            overlap = None
+        else:
+            raise ValueError(op['name'] + ' along time cannot be computed '
+                             'in chunks, call compute() first')
+
+    return {'overlap': overlap, 'chan_wise': chan_wise}
+
+
+def _run_operator(data, op, func, x, axis, idx_axis):
+    """Run one operator on one trial (or on the stacked trials).
+
+    Parameters
+    ----------
+    data : instance of Data
+        the original data (only used for the error message)
+    op : dict
+        the operator, with 'name', 'func', 'on_axis', 'keepdims'
+    func : function
+        the function to run
+    x : ndarray
+        the data of one trial (or the stacked trials)
+    axis : str
+        the axis to run the function on
+    idx_axis : int
+        the index of the axis in x
+
+    Returns
+    -------
+    ndarray
+        the output of the function
+    """
+    if op['on_axis']:
+        lg.debug('running ' + op['name'] + ' on ' + str(idx_axis))
+
+        try:
+            if func == diff:
+                lg.debug('Diff has one-point of zero padding')
+                x = _pad_one_axis_one_value(x, idx_axis)
+            return func(x, axis=idx_axis)
+
+        except IndexError:
+            raise ValueError('The axis ' + axis + ' does not '
+                             'exist in [' +
+                             ', '.join(list(data.axis.keys())) + ']')
+
+    else:
+        lg.debug('running ' + op['name'] + ' on each datapoint')
+        return func(x)
+
+
 def _pad_one_axis_one_value(x, idx_axis):
     pad_width = [(0, 0)] * x.ndim
     pad_width[idx_axis] = (1, 0)
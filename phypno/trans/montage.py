@@ -4,6 +4,7 @@ from numpy import asarray, dot, zeros, where, c_, mean
 from numpy.linalg import norm
 
 from ..attr import Channels
+from .lazy import LazyData
 
 lg = getLogger(__name__)
 
@@ -31,6 +32,9 @@ def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None):
     Notes
     -----
     If you don't change anything, it returns the same instance of data.
+
+    If data is an instance of LazyData, the montage is computed later, in
+    chunks.
     """
     if ref_to_avg and ref_chan is not None:
         raise TypeError('You cannot specify reference to the average and '
@@ -44,6 +48,13 @@ def montage(data, ref_chan=None, ref_to_avg=False, bipolar=None):
     if ref_chan is None:
         ref_chan = []  # TODO: check bool for ref_chan
 
+    if isinstance(data, LazyData):
+        if not (ref_to_avg or ref_chan or bipolar):
+            return data
+        return data._add(montage, chan_wise=False,
+                         ref_chan=ref_chan or None, ref_to_avg=ref_to_avg,
+                         bipolar=bipolar)
+
     if bipolar:
         if not data.attr['chan']:
             raise ValueError('Data should have Chan information in attr')
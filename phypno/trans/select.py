@@ -15,6 +15,9 @@ from logging import getLogger
 from numpy import asarray, empty, linspace, ones, setdiff1d
 from scipy.signal import decimate
 
+from ..datatype import RegularAxis, _as_slice, _get_indices, _take
+from .lazy import LazyData
+
 lg = getLogger(__name__)
 
 
@@ -40,6 +43,15 @@ def select(data, trial=None, invert=False, **axes_to_select):
     -------
     instance, same class as input
         data where selection has been applied.
+
+    Notes
+    -----
+    If the trials are stacked (see Data.stack_trials) and the selected axes
+    are the same in all the trials, the selection is applied to all the
+    trials at once and the output is stacked as well.
+
+    If data is an instance of LazyData, only chan and time can be selected
+    and only the selected time interval is computed.
     """
     if trial is not None and not isinstance(trial, Iterable):
         raise TypeError('Trial needs to be iterable.')
@@ -49,6 +61,15 @@ def select(data, trial=None, invert=False, **axes_to_select):
             isinstance(values_to_select, str)):
             raise TypeError(axis_to_select + ' needs to be iterable.')
 
+    if isinstance(data, LazyData):
+        if trial is not None or invert:
+            raise TypeError('Trials and invert cannot be selected in chunks, '
+                            'call compute() first')
+        if set(axes_to_select) - {'chan', 'time'}:
+            raise TypeError('Only chan and time can be selected in chunks, '
+                            'call compute() first')
+        return data._add(select, selection=True, **axes_to_select)
+
     if trial is None:
         trial = range(data.number_of('trial'))
     else:
@@ -62,6 +83,11 @@ def select(data, trial=None, invert=False, **axes_to_select):
         output.axis[one_axis] = empty(len(trial), dtype='O')
     output.data = empty(len(trial), dtype='O')
 
+    if (data.stacked is not None and len(trial) > 0 and
+            all(data._shared_axis(x, trial) for x in axes_to_select)):
+        if _select_stacked(data, output, trial, axes_to_select, invert):
+            return output
+
     to_select = {}
     for cnt, i in enumerate(trial):
         lg.debug('Selection on trial {0: 6}'.format(i))
@@ -69,29 +95,9 @@ def select(data, trial=None, invert=False, **axes_to_select):
             values = data.axis[one_axis][i]
 
             if one_axis in axes_to_select.keys():
-                values_to_select = axes_to_select[one_axis]
-
-                if len(values_to_select) == 0:
-                    selected_values = ()
-
-                elif isinstance(values_to_select[0], str):
-                    selected_values = asarray(values_to_select, dtype='U')
-
-                else:
-                    if (values_to_select[0] is None and
-                        values_to_select[1] is None):
-                        bool_values = ones(len(values), dtype=bool)
-                    elif values_to_select[0] is None:
-                        bool_values = values < values_to_select[1]
-                    elif values_to_select[1] is None:
-                        bool_values = values_to_select[0] <= values
-                    else:
-                        bool_values = ((values_to_select[0] <= values) &
-                                       (values < values_to_select[1]))
-                    selected_values = values[bool_values]
-
-                if invert:
-                    selected_values = setdiff1d(values, selected_values)
+                selected_values = _select_values(values,
+                                                 axes_to_select[one_axis],
+                                                 invert)
 
                 lg.debug('In axis {0}, selecting {1: 6} '
                          'values'.format(one_axis,
@@ -109,6 +115,109 @@ def select(data, trial=None, invert=False, **axes_to_select):
     return output
 
 
+def _select_values(values, values_to_select, invert):
+    """Select the values of one axis, see select.
+
+    Parameters
+    ----------
+    values : ndarray
+        values of the axis in one trial
+    values_to_select : tuple or list
+        strings to select or range of numeric values
+    invert : bool
+        take the opposite selection
+
+    Returns
+    -------
+    ndarray
+        selected values
+    """
+    if len(values_to_select) == 0:
+        selected_values = ()
+
+    elif isinstance(values_to_select[0], str):
+        selected_values = asarray(values_to_select, dtype='U')
+
+    elif isinstance(values, RegularAxis):  # only compute the indices
+        beg, end = 0, len(values)
+        if values_to_select[0] is not None:
+            beg = values.searchsorted(values_to_select[0])
+        if values_to_select[1] is not None:
+            end = values.searchsorted(values_to_select[1])
+        selected_values = values[beg:end]
+
+    else:
+        if (values_to_select[0] is None and
+            values_to_select[1] is None):
+            bool_values = ones(len(values), dtype=bool)
+        elif values_to_select[0] is None:
+            bool_values = values < values_to_select[1]
+        elif values_to_select[1] is None:
+            bool_values = values_to_select[0] <= values
+        else:
+            bool_values = ((values_to_select[0] <= values) &
+                           (values < values_to_select[1]))
+        selected_values = values[bool_values]
+
+    if invert:
+        selected_values = setdiff1d(values, selected_values)
+
+    return selected_values
+
+
+def _select_stacked(data, output, trial, axes_to_select, invert):
+    """Select the same values from all the stacked trials at once.
+
+    Parameters
+    ----------
+    data : instance of Data
+        data with stacked trials, where the selected axes are shared
+    output : instance of Data
+        data where selection is stored (the axes are already empty)
+    trial : list of int or ndarray (dtype='i')
+        index of trials of interest
+    axes_to_select : dict
+        the selection for each axis, see select
+    invert : bool
+        take the opposite selection
+
+    Returns
+    -------
+    bool
+        True if the selection was stored in output. False if some of the
+        selected values are not in the data (they need to be NaN, so the
+        trials are selected one by one).
+    """
+    idx = [_as_slice(asarray(trial, dtype=int))]
+    for one_axis in output.axis:
+        if one_axis in axes_to_select.keys():
+            values = data.axis[one_axis][trial[0]]
+            selected_values = _select_values(values, axes_to_select[one_axis],
+                                             invert)
+            idx_data, idx_output = _get_indices(data._lookup(one_axis,
+                                                             trial[0]),
+                                                selected_values, None)
+            if len(idx_output) < len(selected_values):
+                return False
+
+            idx.append(_as_slice(idx_data))
+        else:
+            idx.append(slice(None))
+
+        for cnt, i in enumerate(trial):
+            if one_axis in axes_to_select.keys():
+                output.axis[one_axis][cnt] = selected_values  # shared
+            else:
+                output.axis[one_axis][cnt] = data.axis[one_axis][i]
+
+    stacked = _take(data.stacked, idx)
+    if all(isinstance(x, slice) for x in idx):
+        stacked = stacked.copy()  # not a view of the data
+    output._set_stacked(stacked)
+
+    return True
+
+
 def resample(data, s_freq=None, axis='time', ftype='fir', n=None):
     """Downsample the data after applying a filter.
 
@@ -130,14 +239,29 @@ def resample(data, s_freq=None, axis='time', ftype='fir', n=None):
     -------
     instance of Data
         downsampled data
+
+    Notes
+    -----
+    If the trials are stacked (see Data.stack_trials), all the trials are
+    downsampled at once.
     """
     output = data._copy()
     ratio = int(data.s_freq / s_freq)
 
+    if data.stacked is not None:  # all the trials at once
+        output._set_stacked(decimate(data.stacked, ratio,
+                                     axis=data.index_of(axis) + 1,
+                                     zero_phase=True))
+
     for i in range(data.number_of('trial')):
-        output.data[i] = decimate(data.data[i], ratio,
-                                  axis=data.index_of(axis),
-                                  zero_phase=True)
+        if data.stacked is None:
+            output.data[i] = decimate(data.data[i], ratio,
+                                      axis=data.index_of(axis),
+                                      zero_phase=True)
+
+        if i > 0 and data.axis[axis][i] is data.axis[axis][i - 1]:
+            output.axis[axis][i] = output.axis[axis][i - 1]  # shared axis
+            continue
 
         n_samples = output.data[i].shape[data.index_of(axis)]
         output.axis[axis][i] = linspace(data.axis[axis][i][0],
@@ -232,7 +232,9 @@ class Info(QWidget):
                 ieeg_org.SESS = ieeg_org.Session(username=username,
                                                  password_md5=password)
 
-            self.dataset = Dataset(filename, server=repo)
+            cache_size = self.parent.value('dataset_cache_mb') * 2 ** 20
+            self.dataset = Dataset(filename, server=repo,
+                                   cache_size=cache_size)
 
         except FileNotFoundError:
             self.parent.statusBar().showMessage('File ' + basename(filename) +
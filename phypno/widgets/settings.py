@@ -63,6 +63,7 @@ DEFAULTS['traces'] = {'n_time_labels': 3,
                       'grid_y': False,
                       }
 DEFAULTS['settings'] = {'max_dataset_history': 20,
+                        'dataset_cache_mb': 256,
                         'y_distance_presets': [20., 30., 40., 50., 100., 200.],
                         'y_scale_presets': [.1, .2, .5, 1, 2, 5, 10],
                         'window_length_presets': [1., 5., 10., 20., 30., 60.],
@@ -281,12 +282,15 @@ class ConfigUtils(Config):
         box0 = QGroupBox('History')
         self.index['max_dataset_history'] = FormInt()
         self.index['recording_dir'] = FormStr()
+        self.index['dataset_cache_mb'] = FormInt()
 
         form_layout = QFormLayout()
         form_layout.addRow('Max History Size',
                            self.index['max_dataset_history'])
         form_layout.addRow('Directory with recordings',
                            self.index['recording_dir'])
+        form_layout.addRow('Cache of the data (MB)',
+                           self.index['dataset_cache_mb'])
         box0.setLayout(form_layout)
 
         box1 = QGroupBox('Default values')
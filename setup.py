@@ -53,6 +53,7 @@ setup(
     entry_points={
         'console_scripts': [
             'scroll_data=phypno.scroll_data:main',
+            'convert_data=phypno.convert_data:main',
         ],
     },
 )
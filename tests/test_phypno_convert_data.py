@@ -0,0 +1,68 @@
+from numpy import isnan, NaN, nanmax, nanmin
+from numpy.testing import assert_array_equal, assert_array_less
+from pytest import raises
+
+from phypno import Dataset
+from phypno.convert_data import convert, is_converted
+from phypno.ioeeg import write_edf, write_phypno
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+edf_file = DOWNLOADS_PATH / 'convert_data.edf'
+nan_file = DOWNLOADS_PATH / 'convert_data_nan.phy'
+v1_file = DOWNLOADS_PATH / 'convert_data_v1.phy'
+output_dir = DOWNLOADS_PATH / 'convert_data'
+
+
+def test_convert_data():
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    write_edf(data, edf_file, physical_max=100)
+
+    phypno_file, converted = convert(edf_file, output_dir, overwrite=True)
+    assert converted
+    assert is_converted(phypno_file, edf_file)
+
+    # it's skipped the second time
+    assert not convert(edf_file, output_dir)[1]
+
+    dat = Dataset(phypno_file).read_data()
+    orig = Dataset(edf_file).read_data()
+    assert_array_less(abs(dat.data[0] - orig.data[0]), 200 / 65534)
+
+
+def test_convert_data_nan():
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    data.data[0][1, 100:200] = NaN
+    write_phypno(data, nan_file)
+
+    phypno_file, converted = convert(nan_file, output_dir, overwrite=True)
+    assert converted
+
+    dat = Dataset(phypno_file).read_data()
+    assert isnan(dat.data[0][1, 100:200]).all()
+    assert not isnan(dat.data[0][:, 200:]).any()
+    x = data.data[0]
+    assert_array_less(abs(dat.data[0][:, 200:] - x[:, 200:]),
+                      (nanmax(x) - nanmin(x)) / 65533)
+
+
+def test_convert_data_same_file():
+    """the converted files of a .phy file (version 1) would replace it"""
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    write_phypno(data, v1_file)
+    dat_file = v1_file.with_suffix('.dat')
+    memmap = dat_file.read_bytes()
+
+    with raises(ValueError):
+        convert(v1_file)
+    with raises(ValueError):
+        convert(v1_file, output_dir=DOWNLOADS_PATH / '.' / '')
+
+    assert dat_file.read_bytes() == memmap
+    assert_array_equal(Dataset(v1_file).read_data().data[0], data.data[0])
+
+    # no temporary files are left
+    phypno_file = convert(v1_file, output_dir)[0]
+    assert is_converted(phypno_file, v1_file)
+    assert not list(output_dir.glob('.convert_*'))
@@ -0,0 +1,74 @@
+from os import utime
+
+from numpy.testing import assert_array_equal
+
+import phypno.dataset
+from phypno import Dataset
+from phypno.dataset import _header_cache_file
+from phypno.ioeeg import Phypno, write_phypno
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+phypno_file = DOWNLOADS_PATH / 'header_cache.phy'
+dat_file = DOWNLOADS_PATH / 'header_cache.dat'
+cache_dir = DOWNLOADS_PATH / 'header_cache'
+
+
+def _return_hdr(self):
+    raise AssertionError('the header should be read from the cache')
+
+
+def _read_from_cache(filename):
+    """Read the dataset, which must use the header in the cache."""
+    return_hdr = Phypno.return_hdr
+    Phypno.return_hdr = _return_hdr
+    try:
+        return Dataset(filename, header_cache=True)
+    finally:
+        Phypno.return_hdr = return_hdr
+
+
+def test_header_cache():
+    header_cache_dir = phypno.dataset.HEADER_CACHE_DIR
+    phypno.dataset.HEADER_CACHE_DIR = cache_dir
+    try:
+        write_phypno(create_data(n_trial=1), phypno_file)
+
+        d = Dataset(phypno_file)
+        assert not _header_cache_file(phypno_file).exists()
+        d = Dataset(phypno_file, header_cache=True)
+        assert not d._hdr_from_cache
+        assert _header_cache_file(phypno_file).exists()
+
+        d_cache = _read_from_cache(phypno_file)
+        assert d_cache._hdr_from_cache
+        assert d_cache.IOClass is Phypno
+        assert d_cache.header['chan_name'] == d.header['chan_name']
+        assert d_cache.header['n_samples'] == d.header['n_samples']
+        assert_array_equal(d_cache.read_data(begsam=10, endsam=20).data[0],
+                           d.read_data(begsam=10, endsam=20).data[0])
+
+        # a different mtime invalidates the cache
+        stat = dat_file.stat()
+        utime(str(dat_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert not Dataset(phypno_file, header_cache=True)._hdr_from_cache
+        assert _read_from_cache(phypno_file)._hdr_from_cache
+
+        # a different size invalidates the cache
+        with dat_file.open('ab') as f:
+            f.write(b'\x00' * 8)
+        utime(str(dat_file), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        d = Dataset(phypno_file, header_cache=True)
+        assert not d._hdr_from_cache
+        n_samples = d.header['n_samples']
+
+        # a corrupted cache file is ignored
+        for corrupted in (b'', b'\x80\x04\x95garbage', b'\x80\x03]q\x00.'):
+            _header_cache_file(phypno_file).write_bytes(corrupted)
+            d = Dataset(phypno_file, header_cache=True)
+            assert not d._hdr_from_cache
+            assert d.header['n_samples'] == n_samples
+
+    finally:
+        phypno.dataset.HEADER_CACHE_DIR = header_cache_dir
@@ -1,6 +1,8 @@
+from phypno.datatype import RegularAxis
 from phypno.utils import create_data
 from pickle import load, dump
 from tempfile import NamedTemporaryFile
+from numpy import arange, array, isnan
 from numpy.testing import assert_array_equal
 
 
@@ -16,3 +18,68 @@ def test_pickle_01():
 
     assert_array_equal(data.axis['time'][0], loaded.time[0])
 
+
+def test_select_values():
+    data = create_data()
+
+    chan = data.axis['chan'][0]
+    time = data.axis['time'][0]
+    dat = data(trial=0, chan=[chan[2], 'xxx', chan[0]],
+               time=time[10:20] + 1e-6, tolerance=1e-4)
+    assert_array_equal(dat[0], data.data[0][2, 10:20])
+    assert_array_equal(dat[2], data.data[0][0, 10:20])
+    assert isnan(dat[1]).all()
+
+    # the lookup is updated when the axis is reassigned
+    data.axis['chan'][0] = array(['new' + x for x in chan], dtype='U')
+    assert_array_equal(data(trial=0, chan='new' + chan[1]),
+                       data.data[0][1, :])
+
+
+def test_copy_shares_axes():
+    data = create_data()
+    output = data._copy()
+    assert output.axis['time'][0].base is data.axis['time'][0]
+    assert not output.axis['time'][0].flags.writeable
+    assert data.axis['time'][0].flags.writeable
+
+    output.axis['time'][0] = output.axis['time'][0] + 1
+    assert_array_equal(data.axis['time'][0] + 1, output.axis['time'][0])
+
+
+def test_regular_axis():
+    time = RegularAxis(100, 256, 1000)
+    values = arange(100, 1100) / 256
+    assert_array_equal(time, values)
+    assert time[-1] == values[-1]
+    assert_array_equal(time[10:20], values[10:20])
+    assert time.searchsorted(values[50]) == 50
+    assert time.searchsorted(1) == values.searchsorted(1)
+
+    assert_array_equal(time[20:10:-3], values[20:10:-3])
+    assert_array_equal(time[::-1], values[::-1])
+    assert len(time[10:10]) == 0
+    assert len(time[20:10]) == 0
+    assert_array_equal(time[10:10], values[10:10])
+
+    assert time.min() == values.min() and time.max() == values.max()
+    assert time[::7].max() == values[::7].max()
+    assert time.tolist() == values.tolist()
+    assert_array_equal(time.astype('float32'), values.astype('float32'))
+    assert time.copy() is not time
+    assert_array_equal(time.copy(), values)
+
+
+def test_regular_axis_call():
+    data = create_data(s_freq=256, time=(0, 10))
+    values = data.axis['time'][0]
+    data.axis['time'][0] = RegularAxis(0, 256, len(values))
+
+    # the same values (aligned) as the axis of the data
+    dat = data(trial=0, time=RegularAxis(512, 256, 256))
+    assert_array_equal(dat, data.data[0][:, 512:768])
+
+    # partly outside the data
+    dat = data(trial=0, time=RegularAxis(-128, 256, 256))
+    assert isnan(dat[:, :128]).all()
+    assert_array_equal(dat[:, 128:], data.data[0][:, :128])
@@ -1,8 +1,69 @@
+from numpy import arange, array, zeros
+from numpy.testing import assert_array_equal
+
 from phypno import Dataset
 
 from .utils import DOWNLOADS_PATH
 
 bci2000_file = DOWNLOADS_PATH / 'eeg3_2.dat'
+states_file = DOWNLOADS_PATH / 'bci2000_states.dat'
+
+S_FREQ = 100
+N_SAMPLES = 300
+GAIN = [0.5, 2.]
+STATES = [  # name, length, byte location, bit location
+    ('Running', 1, 0, 0),
+    ('StimulusCode', 5, 0, 1),
+    ('MicromedCode', 12, 1, 2),  # across the second and third byte
+    ]
+PARAMETERS = [
+    'Source:Signal%20Properties int SourceCh= 2 16 1 % // number of channels',
+    'Source:Signal%20Properties floatlist SourceChGain= 2 0.5 2.0 0 % % // ',
+    'Source int SamplingRate= 100 256Hz 1 % // sampling rate',
+    'Storage string StorageTime= 2017-03-02T10:20:30 % % % // start',
+    'Storage string SubjectName= subj % % % // subject',
+    ]
+
+
+def _write_bci2000(filename):
+    """Write a small BCI2000 file, with two channels and three states.
+
+    Returns
+    -------
+    dict
+        the value of each state for each sample
+    """
+    smp = arange(N_SAMPLES)
+    states = {
+        'Running': zeros(N_SAMPLES, dtype=int) + 1,
+        'StimulusCode': smp // 60 * 7,
+        'MicromedCode': array([0] * 50 + [1000] * 100 + [3] * 150),
+        }
+
+    rows = ['[ State Vector Definition ] ']
+    statevector = zeros(N_SAMPLES, dtype='<u4')
+    for name, length, byte, bit in STATES:
+        rows.append('{} {} 0 {} {}'.format(name, length, byte, bit))
+        statevector |= states[name].astype('<u4') << (byte * 8 + bit)
+    rows.append('[ Parameter Definition ] ')
+    rows.extend(PARAMETERS)
+
+    first_row = ('BCI2000V= 1.1 HeaderLen= {:05d} SourceCh= 2 '
+                 'StatevectorLen= 3 DataFormat= int16')
+    hdr_len = len('\r\n'.join([first_row.format(0)] + rows + ['']))
+    hdr = '\r\n'.join([first_row.format(hdr_len)] + rows + [''])
+
+    dat = zeros((N_SAMPLES, 4), dtype='<i2')
+    dat[:, 0] = smp
+    dat[:, 1] = -smp
+    dat = dat.view('u1')[:, :7]
+    dat[:, 4:] = statevector.view('u1').reshape(-1, 4)[:, :3]
+
+    with filename.open('wb') as f:
+        f.write(hdr.encode())
+        f.write(dat.tobytes())
+
+    return states
 
 
 def test_bci2000_data():
@@ -13,3 +74,48 @@ def test_bci2000_data():
 
     data = d.read_data()
     assert data.data[0][0, 0] == 179.702
+
+
+def test_bci2000_states():
+    states = _write_bci2000(states_file)
+
+    d = Dataset(states_file)
+    assert d.header['n_samples'] == N_SAMPLES
+    assert d.header['s_freq'] == S_FREQ
+
+    data = d.read_data(begsam=10, endsam=20)
+    assert_array_equal(data.data[0][0], arange(10, 20) * GAIN[0])
+    assert_array_equal(data.data[0][1], -arange(10, 20) * GAIN[1])
+
+    assert_array_equal(d.dataset._read_states()['Running'], states['Running'])
+    read_states = d.dataset._read_states(45, 155)
+    for name in states:
+        assert_array_equal(read_states[name], states[name][45:155])
+    assert len(d.dataset._read_states(100, 100)['MicromedCode']) == 0
+
+
+def test_bci2000_markers():
+    _write_bci2000(states_file)
+    d = Dataset(states_file)
+
+    def _markers(*args):
+        return [(x['name'], x['start'], x['end'])
+                for x in d.dataset.return_markers(*args)]
+
+    assert _markers() == [('0', 0, 0.5), ('1000', 0.5, 1.5), ('3', 1.5, 3)]
+    assert _markers('StimulusCode', None, 1.5) == [('0', 0, 0.6),
+                                                    ('7', 0.6, 1.2),
+                                                    ('14', 1.2, 1.5)]
+
+    # the end of the time range is not included
+    assert _markers('MicromedCode', 0.5, 1.5) == [('1000', 0.5, 1.5)]
+    assert _markers('MicromedCode', 0.7, 1.2) == [('1000', 0.7, 1.2)]
+    assert _markers('MicromedCode', 0.4, 1.6) == [('0', 0.4, 0.5),
+                                                  ('1000', 0.5, 1.5),
+                                                  ('3', 1.5, 1.6)]
+    assert _markers('MicromedCode', 2, 10) == [('3', 2, 3)]
+
+    # outside of the recordings or unknown state
+    assert _markers('MicromedCode', 5) == []
+    assert _markers('MicromedCode', 1, 1) == []
+    assert _markers('NotAState') == []
@@ -0,0 +1,164 @@
+from datetime import datetime, timedelta
+
+from numpy import abs, isnan
+from numpy.testing import assert_array_equal, assert_array_less
+
+from phypno import Dataset, MultiDataset
+from phypno.dataset import _group_trials
+from phypno.ioeeg import write_edf
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+edf_file = DOWNLOADS_PATH / 'write_edf.edf'
+
+
+def _write_edf_file(filename):
+    """Write 10 s of data, so that each test reads its own file."""
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    write_edf(data, filename, physical_max=5000)
+    return filename
+
+
+def test_write_edf_chunks_markers():
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    markers = [{'name': 'spindle', 'start': 2.5, 'end': 3, 'chan': None}]
+    write_edf(data, edf_file, physical_max=5000, markers=markers,
+              chunk_duration=3)
+
+    d = Dataset(edf_file)
+    assert d.header['chan_name'] == list(data.axis['chan'][0])
+    assert d.header['n_samples'] == data.number_of('time')[0]
+    assert d.read_markers() == markers
+
+    dat = d.read_data()
+    assert_array_less(abs(dat.data[0] - data.data[0]), 5000 / 32767)
+
+
+def test_iter_chunks():
+    d = Dataset(_write_edf_file(DOWNLOADS_PATH / 'iter_chunks.edf'))
+    all_data = d.read_data()
+
+    n_samples = 0
+    for data in d.iter_chunks(chunk_duration=3, overlap=1):
+        t = data.axis['time'][0]
+        begsam = int(round(t[0] * d.header['s_freq']))
+        endsam = begsam + len(t)
+        assert (data.data[0] == all_data.data[0][:, begsam:endsam]).all()
+        n_samples += endsam - begsam
+
+    # 4 chunks, with 1 s overlap on both sides (except at the edges)
+    assert n_samples == d.header['n_samples'] + 6 * d.header['s_freq']
+
+
+def test_read_data_n_jobs():
+    d = Dataset(_write_edf_file(DOWNLOADS_PATH / 'read_data_n_jobs.edf'))
+    begtime = [5, 1, 8, 0.5, 3]
+    endtime = [x + 1 for x in begtime]
+    data = d.read_data(begtime=begtime, endtime=endtime)
+    data_par = d.read_data(begtime=begtime, endtime=endtime, n_jobs=2)
+
+    for dat, dat_par in zip(data.data, data_par.data):
+        assert (dat == dat_par).all()
+
+
+def test_block_cache():
+    cache_file = _write_edf_file(DOWNLOADS_PATH / 'block_cache.edf')
+    d = Dataset(cache_file)
+    d_cache = Dataset(cache_file, cache_size=2 ** 20)
+
+    data = d.read_data(begtime=2, endtime=7)
+    data_cache = d_cache.read_data(begtime=2, endtime=7)
+    assert (data.data[0] == data_cache.data[0]).all()
+    assert d_cache.cache.hits == 0
+    n_chan = len(d.header['chan_name'])
+    assert d_cache.cache.misses == n_chan  # all in the first block
+
+    data_cache = d_cache.read_data(begtime=3, endtime=4)
+    assert (data.data[0][:, 512:1024] == data_cache.data[0]).all()
+    assert d_cache.cache.hits > 0
+    assert d_cache.cache.misses == n_chan
+
+    block_size = d_cache.cache.block_size
+    data_cache = d_cache.read_data(begsam=block_size, endsam=block_size)
+    assert data_cache.data[0].shape == (n_chan, 0)
+
+
+def test_multidataset():
+    start_time = datetime(2000, 1, 1, 22, 0, 0)
+    edf_files = []
+    for i, offset in enumerate((0, 12)):  # 2 s gap
+        data = create_data(n_trial=1, time=(0, 10), values=(-100, 100),
+                           start_time=start_time + timedelta(seconds=offset))
+        edf_files.append(DOWNLOADS_PATH / 'multi_{}.edf'.format(i))
+        write_edf(data, edf_files[-1], physical_max=5000)
+
+    d = MultiDataset(edf_files[::-1])
+    assert d.header['n_samples'] == 22 * d.header['s_freq']
+
+    data = d.read_data(begtime=9, endtime=13)
+    s_freq = int(d.header['s_freq'])
+    d0 = Dataset(edf_files[0]).read_data(begtime=9, endtime=10)
+    d1 = Dataset(edf_files[1]).read_data(begtime=0, endtime=1)
+    assert (data.data[0][:, :s_freq] == d0.data[0]).all()
+    assert isnan(data.data[0][:, s_freq:3 * s_freq]).all()
+    assert (data.data[0][:, 3 * s_freq:] == d1.data[0]).all()
+
+    # trials in both recordings, read in groups which do not cross them
+    begtime = [15, 1, 8, 19, 3, 13]
+    endtime = [x + 2 for x in begtime]
+    data = d.read_data(begtime=begtime, endtime=endtime)
+    data_par = d.read_data(begtime=begtime, endtime=endtime, n_jobs=2)
+    for dat, dat_par in zip(data.data, data_par.data):
+        assert_array_equal(dat, dat_par)
+
+    begsam = [x * s_freq for x in begtime]
+    groups = _group_trials(begsam, 1, d.dataset.return_segments())
+    assert [list(x) for x in groups] == [[1, 4, 2], [5, 0, 3]]
+
+
+def test_multidataset_nested():
+    start_time = datetime(2000, 1, 1, 22, 0, 0)
+    edf_files = []
+    for i, (offset, duration) in enumerate(((0, 20), (5, 2))):
+        data = create_data(n_trial=1, time=(0, duration), values=(-100, 100),
+                           start_time=start_time + timedelta(seconds=offset))
+        edf_files.append(DOWNLOADS_PATH / 'nested_{}.edf'.format(i))
+        write_edf(data, edf_files[-1], physical_max=5000)
+
+    d = MultiDataset(edf_files)
+    assert d.header['n_samples'] == 20 * d.header['s_freq']
+
+    # the short recording is used where they overlap
+    data = d.read_data(begtime=6, endtime=9)
+    s_freq = int(d.header['s_freq'])
+    d0 = Dataset(edf_files[0]).read_data(begtime=7, endtime=9)
+    d1 = Dataset(edf_files[1]).read_data(begtime=1, endtime=2)
+    assert (data.data[0][:, :s_freq] == d1.data[0]).all()
+    assert (data.data[0][:, s_freq:] == d0.data[0]).all()
+
+
+def test_write_edf_markers_after_end():
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    markers = [{'name': 'spindle', 'start': 2.5, 'end': 3, 'chan': None},
+               {'name': 'late', 'start': 12, 'end': 13, 'chan': None}]
+    late_file = DOWNLOADS_PATH / 'write_edf_late.edf'
+    write_edf(data, late_file, physical_max=5000, markers=markers)
+
+    assert Dataset(late_file).read_markers() == markers[:1]
+
+
+def test_edf_only_annotations():
+    data = create_data(n_trial=1, n_chan=1, time=(0, 10))
+    markers = [{'name': 'spindle', 'start': 2.5, 'end': 3, 'chan': None}]
+    annot_file = DOWNLOADS_PATH / 'only_annotations.edf'
+    write_edf(data, annot_file, physical_max=5000, markers=markers)
+
+    # the label of the only channel with data
+    with annot_file.open('r+b') as f:
+        f.seek(256)
+        f.write('{:<16}'.format('EDF Annotations').encode('ascii'))
+
+    d = Dataset(annot_file)
+    assert d.header['chan_name'] == []
+    assert d.header['n_samples'] == 0
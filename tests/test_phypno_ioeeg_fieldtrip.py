@@ -0,0 +1,40 @@
+from h5py import File
+from numpy.testing import assert_array_equal
+
+from phypno import Dataset
+from phypno.ioeeg import write_fieldtrip
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+mat73_file = DOWNLOADS_PATH / 'write_fieldtrip_73.mat'
+
+
+def test_write_fieldtrip_73():
+    data = create_data(n_trial=3, s_freq=256, time=(0, 2))
+    write_fieldtrip(data, mat73_file, version='7.3')
+
+    # Dataset reads the first trial
+    d = Dataset(mat73_file)
+    assert d.header['chan_name'] == list(data.axis['chan'][0])
+    assert d.header['s_freq'] == 256
+    assert d.header['n_samples'] == data.number_of('time')[0]
+
+    chan = ['chan05', 'chan01', 'chan02']
+    dat = d.read_data(chan=chan, begsam=100, endsam=300)
+    idx = [list(data.axis['chan'][0]).index(x) for x in chan]
+    assert_array_equal(dat.data[0], data.data[0][idx, 100:300])
+    d.close()
+
+    with File(str(mat73_file), 'r') as f:
+        ft = f['data']
+        assert ft['fsample'][()].item() == 256
+        label = [''.join(chr(x) for x in f[ref][()].flat)
+                 for ref in ft['label'][()].flat]
+        assert label == list(data.axis['chan'][0])
+
+        for trl in range(3):
+            trial = f[ft['trial'][trl, 0]][()]
+            time = f[ft['time'][trl, 0]][()]
+            assert_array_equal(trial.T, data.data[trl])
+            assert_array_equal(time[:, 0], data.axis['time'][trl])
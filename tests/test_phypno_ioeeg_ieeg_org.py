@@ -0,0 +1,122 @@
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from re import findall
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+from numpy import arange, isnan
+
+from phypno import Dataset
+from phypno.ioeeg import ieeg_org
+
+from .utils import DOWNLOADS_PATH
+
+S_FREQ = 256
+N_SAMPLES = 100000
+CHAN = ['rev0', 'rev1', 'rev2']
+DETAILS = ('<timeSeriesDetails><details>' + ''.join(
+    '<detail><channelLabel>chan{0}</channelLabel><revisionId>rev{0}'
+    '</revisionId><voltageConversionFactor>1</voltageConversionFactor>'
+    '<startTime>1000000</startTime><sampleRate>{1}</sampleRate>'
+    '<numberOfSamples>{2}</numberOfSamples></detail>'.format(i, S_FREQ,
+                                                             N_SAMPLES)
+    for i in range(len(CHAN))) + '</details></timeSeriesDetails>')
+
+
+def _fake_data(chan, begsam, endsam):
+    return (arange(begsam, endsam) + 1000000 * CHAN.index(chan)) % 2 ** 30
+
+
+class FakeIEEG(BaseHTTPRequestHandler):
+    """Local server with the same API as ieeg.org (/services/timeseries)."""
+    n_data_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, content, headers={}):
+        self.send_response(200)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path.startswith(ieeg_org.URL_ID):
+            self._reply(b'snapshot0')
+        elif self.path.startswith(ieeg_org.URL_DETAILS):
+            self._reply(DETAILS.encode())
+
+    def do_POST(self):
+        FakeIEEG.n_data_requests += 1
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        begsam = round(int(params['start'][0]) * S_FREQ / 1e6)
+        n_smp = round(int(params['duration'][0]) * S_FREQ / 1e6)
+
+        xml = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        chan = findall('<id>(.*?)</id>', xml)
+        dat = [_fake_data(c, begsam, begsam + n_smp) for c in chan]
+        content = b''.join(x.astype('>i4').tobytes() for x in dat)
+        self._reply(content,
+                    {'samples-per-row': ','.join([str(n_smp)] * len(chan)),
+                     'voltage-conversion-factors-mv': ','.join(['1'] *
+                                                               len(chan))})
+
+
+def test_ieeg_org_local_server():
+    server = HTTPServer(('localhost', 0), FakeIEEG)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    ieeg_org.SESS = ieeg_org.Session(username='user', password='pass',
+                                     host='localhost:' +
+                                     str(server.server_port),
+                                     http='http://')
+    IOClass = partial(ieeg_org.IEEG_org,
+                      cache_dir=DOWNLOADS_PATH / 'ieeg_org')
+    d = Dataset('dataset', IOClass=IOClass, server='ieeg.org')
+    assert d.header['chan_name'] == ['chan0', 'chan1', 'chan2']
+
+    begsam = ieeg_org.BLOCK_SIZE - 100
+    data = d.read_data(chan=['chan2', 'chan0'], begsam=begsam,
+                       endsam=begsam + 1000)
+    assert (data.data[0][0] == _fake_data('rev2', begsam, begsam + 1000)).all()
+    assert (data.data[0][1] == _fake_data('rev0', begsam, begsam + 1000)).all()
+
+    # the same blocks are read from the cache
+    n_requests = FakeIEEG.n_data_requests
+    d.dataset._pending.clear()
+    d.read_data(chan=['chan0'], begsam=begsam, endsam=begsam + 1000)
+    assert FakeIEEG.n_data_requests == n_requests
+
+    data = d.read_data(chan=['chan1'], begsam=N_SAMPLES - 10,
+                       endsam=N_SAMPLES + 10)
+    assert isnan(data.data[0][0, 10:]).all()
+    assert (data.data[0][0, :10] == _fake_data('rev1', N_SAMPLES - 10,
+                                               N_SAMPLES)).all()
+
+    # only the blocks of the last window (and the next one) are kept
+    for begsam in (0, 1000, 2000, 500, 40000, 41000):
+        d.read_data(chan=['chan1'], begsam=begsam, endsam=begsam + 1000)
+    d.read_data(chan=['chan0', 'chan2'], begsam=40000, endsam=41000)
+    pending = d.dataset._pending
+    assert {k[0] for k in pending} == {('rev0', 'rev2')}
+    assert {k[1] for k in pending} == {40000 // ieeg_org.BLOCK_SIZE}
+
+    d.close()
+    assert d.dataset._executor is None and not d.dataset._pending
+    data = d.read_data(chan=['chan0'], begsam=0, endsam=10)
+    assert (data.data[0][0] == _fake_data('rev0', 0, 10)).all()
+    d.close()
+
+    server.shutdown()
+
+
+def test_disk_cache_overwrite():
+    cache = ieeg_org.DiskCache(DOWNLOADS_PATH / 'disk_cache', 2 ** 20)
+    cache.put('block', arange(1000))
+    size = cache.size
+    cache.put('block', arange(1000))
+    assert cache.size == size
+    assert (cache.get('block') == arange(1000)).all()
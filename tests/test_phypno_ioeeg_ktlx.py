@@ -1,6 +1,11 @@
-from numpy.testing import assert_array_almost_equal
+from struct import pack
+from tempfile import TemporaryFile
+
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+from pytest import raises
 
 from phypno import Dataset
+from phypno.ioeeg.ktlx import _parse_ent_note, _read_packet
 
 from .utils import IO_PATH
 
@@ -13,9 +18,82 @@ def test_xltek_data():
     assert_array_almost_equal(data.data[0][0, 0], -2021.171532)
 
 
+def test_xltek_index():
+    """second time, it reads the index and starts from the checkpoints"""
+    d = Dataset(ktlx_file)
+    data = d.read_data(begsam=223380, endsam=226380, chan=('Fz', ))
+
+    d = Dataset(ktlx_file)
+    data_idx = d.read_data(begsam=223380, endsam=226380, chan=('Fz', ))
+    assert_array_equal(data.data[0], data_idx.data[0])
+
+
 def test_xltek_marker():
     d = Dataset(ktlx_file)
     markers = d.read_markers()
     assert markers[0]['name'] == 'Gain/Filter change (-unknown-)'
     assert markers[-1]['end'] == 1052.1
 
+
+def test_xltek_packet():
+    packet = (b'\x00\xff' + b'\xff' * 6 + pack('<iii', 10, -20, 30000) +
+              b'\x00\xfa' + pack('<bhb', 5, 300, -3) +
+              b'\x01\xfa' + pack('<bhb', -1, -1, 0) + pack('<i', 123456))
+
+    with TemporaryFile() as f:
+        f.write(packet)
+        dat = _read_packet(f, 0, 3, 3, b'\xff\xff')
+
+    assert_array_equal(dat, [[10, 15, 14],
+                             [-20, 280, 123456],
+                             [30000, 29997, 29997]])
+
+
+def test_xltek_packet_checkpoint():
+    """the first sample after the checkpoint has an absolute value"""
+    packet = (b'\x00\xff' + b'\xff' * 6 + pack('<iii', 10, -20, 30000) +
+              b'\x00\xfa' + pack('<bhb', 5, 300, -3) +
+              b'\x01\xfa' + pack('<bhb', -1, -1, 0) + pack('<i', 123456))
+
+    with TemporaryFile() as f:
+        f.write(packet)
+        dat, pos = _read_packet(f, 0, 3, 3, b'\xff\xff', return_pos=True)
+        dat_cp = _read_packet(f, pos[2], 1, 3, b'\xff\xff',
+                              prev=dat[:, 1])
+
+    assert_array_equal(dat_cp, dat[:, 2:])
+
+
+def test_xltek_note():
+    note = ('(.(."Comment", "Spike"), (."Data", (.(."CHANNEL", 0), '
+            '(."User", "XLSpike - Intracranial"), (."Pos", (1, -2.5, 3)))), '
+            '(."Stamp", 123456), (."Text", "Spike"))')
+    assert _parse_ent_note(note) == {
+        'Comment': 'Spike',
+        'Data': {'CHANNEL': 0, 'User': 'XLSpike - Intracranial',
+                 'Pos': [1, -2.5, 3]},
+        'Stamp': 123456,
+        'Text': 'Spike',
+        }
+
+
+def test_xltek_note_escape():
+    note = r'(.(."Stamp", 10), (."Text", "say \"hi\" \\ (ok, \"no\")"))'
+    assert _parse_ent_note(note)['Text'] == r'say "hi" \ (ok, "no")'
+
+    note = r'(.(."Sa\"y", "x"), (."Stamp", 10))'
+    assert _parse_ent_note(note) == {'Sa"y': 'x', 'Stamp': 10}
+
+
+def test_xltek_note_empty():
+    note = '(.(."Data", (.(."User", ""), (."Empty", ()))), (."Stamp", 5000))'
+    assert _parse_ent_note(note) == {'Data': {'User': '', 'Empty': []},
+                                     'Stamp': 5000}
+
+    note = '(.(."Text", "multi\\nline"), (."Stamp", 1))'
+    assert _parse_ent_note(note)['Text'] == 'multi\nline'
+
+
+def test_xltek_note_malformed():
+    with raises(ValueError):
+        _parse_ent_note('(.(."Stamp", 5000)')
@@ -0,0 +1,99 @@
+from struct import pack
+
+from numpy import arange, isnan, random
+from numpy.testing import assert_array_almost_equal
+
+from phypno import Dataset
+
+from .utils import DOWNLOADS_PATH
+
+BODATA = 1024  # first byte of the data
+S_FREQ = 256
+N_SAMPLES = 500
+CHAN = [  # name, logical_min, logical_max, ground, physical_min, max, unit
+    ('Fp1', 0, 255, 128, -500, 500, 0),  # uV
+    ('Fp2', 0, 255, 100, -2, 2, 1),  # mV
+    ('EKG', 0, 255, 0, -2000, 2000, -1),  # nV
+    ]
+
+
+def _write_trc(filename, n_bytes):
+    """Write a small TRC file (header version 4), with random samples.
+
+    Returns
+    -------
+    numpy.ndarray
+        the samples, as stored in the file (samples X chan)
+    """
+    n_chan = len(CHAN)
+    lab_pos = 640
+    order_pos = 600
+
+    hdr = bytearray(BODATA)
+    hdr[64:86] = b'Doe'.ljust(22)
+    hdr[86:106] = b'John'.ljust(20)
+    hdr[128:134] = pack('bbbbbb', 2, 3, 117, 10, 20, 30)
+    hdr[138:150] = pack('IHHHH', BODATA, n_chan, 0, S_FREQ, n_bytes)
+    hdr[175:176] = pack('b', 4)
+    zones = [(b'ORDER', order_pos, 2 * n_chan),
+             (b'LABCOD', lab_pos, 128 * n_chan)]
+    zones += [(b'', 0, 0)] * (15 - len(zones))
+    for i, (name, pos, length) in enumerate(zones):
+        hdr[176 + i * 16:192 + i * 16] = pack('8sII', name.ljust(8), pos,
+                                              length)
+
+    # the channels are stored in reverse order in LABCOD
+    order = arange(n_chan)[::-1]
+    hdr[order_pos:order_pos + 2 * n_chan] = order.astype('<u2').tobytes()
+    for i, (name, l_min, l_max, ground, p_min, p_max, unit) in enumerate(CHAN):
+        pos = lab_pos + order[i] * 128
+        lab = (name.encode().ljust(6, b'\x00') + b'G2'.ljust(6, b'\x00') +
+               pack('iiiiih', l_min, l_max, ground, p_min, p_max, unit) +
+               b'\x00' * 8 + pack('H', S_FREQ))
+        hdr[pos:pos + len(lab)] = lab
+
+    dat = random.randint(0, 256, (N_SAMPLES, n_chan)).astype('<u' +
+                                                            str(n_bytes))
+    with filename.open('wb') as f:
+        f.write(bytes(hdr))
+        f.write(dat.tobytes())
+
+    return dat
+
+
+def _calibrate(dat):
+    """Convert the samples to uV."""
+    dat = dat.T.astype('float64')
+    for i, (_, l_min, l_max, ground, p_min, p_max, unit) in enumerate(CHAN):
+        factor = (p_max - p_min) / (l_max - l_min + 1) * 1e3 ** unit
+        dat[i] = (dat[i] - ground) * factor
+    return dat
+
+
+def test_micromed_n_bytes():
+    for n_bytes in (1, 2, 4):
+        trc_file = DOWNLOADS_PATH / 'micromed_{}.TRC'.format(n_bytes)
+        dat = _write_trc(trc_file, n_bytes)
+
+        d = Dataset(trc_file)
+        assert d.header['chan_name'] == [x[0] for x in CHAN]
+        assert d.header['n_samples'] == N_SAMPLES
+        assert d.header['s_freq'] == S_FREQ
+        assert d.header['start_time'].year == 2017
+
+        data = d.read_data()
+        assert_array_almost_equal(data.data[0], _calibrate(dat))
+
+
+def test_micromed_outside():
+    trc_file = DOWNLOADS_PATH / 'micromed_outside.TRC'
+    dat = _calibrate(_write_trc(trc_file, 2))
+
+    d = Dataset(trc_file)
+    data = d.read_data(chan=['EKG', 'Fp1'], begsam=-10, endsam=20)
+    assert isnan(data.data[0][:, :10]).all()
+    assert_array_almost_equal(data.data[0][:, 10:], dat[[2, 0], :20])
+
+    data = d.read_data(begsam=N_SAMPLES - 5, endsam=N_SAMPLES + 5)
+    assert_array_almost_equal(data.data[0][:, :5], dat[:, -5:])
+    assert isnan(data.data[0][:, 5:]).all()
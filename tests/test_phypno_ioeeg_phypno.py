@@ -0,0 +1,29 @@
+from numpy import abs, isnan
+from numpy.testing import assert_array_less
+
+from phypno import Dataset
+from phypno.ioeeg import write_phypno
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+phypno_file = DOWNLOADS_PATH / 'write_phypno_v2.phy'
+
+
+def test_write_phypno_v2():
+    data = create_data(n_trial=1, time=(0, 10), values=(-100, 100))
+    write_phypno(data, phypno_file, dtype='int16', version=2,
+                 chunk_shape=(3, 1000), compression='zlib')
+
+    d = Dataset(phypno_file)
+    assert d.header['chan_name'] == list(data.axis['chan'][0])
+    assert d.header['n_samples'] == data.number_of('time')[0]
+
+    dat = d.read_data(begsam=-10, endsam=2500)
+    assert isnan(dat.data[0][:, :10]).all()
+
+    # the values of create_data are not limited to values, and each chunk
+    # uses 65534 values of int16 (the minimum is for NaN)
+    x = data.data[0]
+    assert_array_less(abs(dat.data[0][:, 10:] - x[:, :2500]),
+                      (x.max() - x.min()) / 65533)
@@ -0,0 +1,98 @@
+from numpy import abs, isnan
+from pytest import raises
+
+from phypno import Dataset
+from phypno.ioeeg import write_edf
+from phypno.trans import filter_, lazy, math, montage, select
+from phypno.utils import create_data
+
+from .utils import DOWNLOADS_PATH
+
+edf_file = DOWNLOADS_PATH / 'lazy.edf'
+
+data = create_data(s_freq=256, time=(0, 10))
+
+
+def test_lazy_filter_select():
+    ldata = filter_(lazy(data), low_cut=10, high_cut=20)
+    ldata = select(ldata, time=(2, 8))
+    data1 = ldata.compute(chunk_duration=1)
+
+    data2 = select(filter_(data, low_cut=10, high_cut=20), time=(2, 8))
+    assert data1.data[0].shape == data2.data[0].shape
+    assert abs(data1.data[0] - data2.data[0]).max() < 1e-3
+
+
+def test_lazy_math_time():
+    with raises(ValueError):
+        math(lazy(data), operator_name='diff', axis='time')
+    with raises(ValueError):
+        math(lazy(data), operator_name='mean', axis='time')
+
+    data1 = math(lazy(data), operator_name='mean', axis='chan').compute()
+    data2 = math(data, operator_name='mean', axis='chan')
+    assert data1.list_of_axes == data2.list_of_axes == ('time', )
+    assert abs(data1.data[0] - data2.data[0]).max() < 1e-10
+
+
+def test_lazy_dataset():
+    write_edf(data, edf_file, physical_max=5000)
+    d = Dataset(edf_file)
+    chan = d.header['chan_name'][:3]
+
+    ldata = filter_(lazy(d, chan=chan), low_cut=10, high_cut=20)
+    data1 = ldata.compute(chunk_duration=1)
+    data2 = filter_(d.read_data(chan=chan), low_cut=10, high_cut=20)
+    assert list(data1.axis['chan'][0]) == chan
+    assert abs(data1.data[0] - data2.data[0]).max() < 1e-3
+
+
+def test_lazy_montage():
+    ldata = montage(lazy(data), ref_to_avg=True)
+    assert not ldata.nodes[0]['chan_wise']
+    data1 = ldata.compute(chunk_duration=1, n_jobs=2)
+
+    data2 = montage(data, ref_to_avg=True)
+    assert abs(data1.data[0] - data2.data[0]).max() < 1e-10
+
+
+def test_lazy_hilbert():
+    ldata = filter_(lazy(data), low_cut=10, high_cut=20)
+    ldata = math(ldata, operator_name=('hilbert', 'absolute'), axis='time')
+    assert ldata.nodes[-1]['overlap'] is None
+    data1 = ldata.compute(chunk_duration=2, overlap=2)
+
+    data2 = math(filter_(data, low_cut=10, high_cut=20),
+                 operator_name=('hilbert', 'absolute'), axis='time')
+    assert data1.data[0].shape == data2.data[0].shape
+    # hilbert of the whole recording has edge effects at the edges
+    x = abs(data1.data[0] - data2.data[0])[:, 512:-512]
+    assert x.max() < 1e-2
+
+
+def test_lazy_n_jobs():
+    ldata = select(filter_(lazy(data), low_cut=10, high_cut=20),
+                   time=(1, 9))
+    data1 = ldata.compute(chunk_duration=1)
+    data_par = ldata.compute(chunk_duration=1, n_jobs=3)
+    assert (data1.data[0] == data_par.data[0]).all()
+
+
+def test_lazy_select_missing_chan():
+    chan = ['chan01', 'chan99', 'chan00']
+    data1 = select(lazy(data), chan=chan).compute(chunk_duration=3)
+
+    assert list(data1.axis['chan'][0]) == chan
+    assert isnan(data1.data[0][1]).all()
+    assert (data1.data[0][[0, 2]] == data.data[0][[1, 0]]).all()
+
+
+def test_lazy_errors():
+    with raises(ValueError):
+        lazy(data, chan=['chan99'])
+
+    with raises(ValueError):
+        select(lazy(data), time=(20, 30)).compute()
+
+    with raises(ValueError):
+        select(lazy(data), chan=[]).compute()
@@ -1,3 +1,5 @@
+from copy import deepcopy
+
 from numpy import power, mean, nanmax, std
 from numpy.testing import assert_array_equal
 from pytest import raises
@@ -97,3 +99,25 @@ def test_math_diff():
     dat = data(trial=0, chan='chan01')[2] - data(trial=0, chan='chan01')[1]
     dat1 = data1(trial=0, chan='chan01')[2]
     assert dat == dat1
+
+
+def test_math_stacked_trials():
+    data_stacked = deepcopy(data)
+    data_stacked.stack_trials()
+    assert data_stacked.stacked.shape[0] == 10
+
+    data1 = math(data_stacked, operator_name=('hilbert', 'absolute'),
+                 axis='time')
+    assert data1.stacked is not None
+    data2 = math(data, operator_name=('hilbert', 'absolute'), axis='time')
+    assert_array_equal(data1.data[3], data2.data[3])
+
+    stacked = data_stacked.stacked.copy()
+    data1 = math(data_stacked, operator_name=('absolute', 'square'))
+    assert data1.stacked is not None
+    assert_array_equal(data_stacked.stacked, stacked)  # input is not changed
+
+    # functions which are not ufuncs are run on each trial
+    data1 = math(data_stacked, operator=lambda x: x[:, :10])
+    assert data1.stacked is None
+    assert data1.data[3].shape == (data.number_of('chan')[3], 10)